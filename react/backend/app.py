@@ -1,185 +1,52 @@
 from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
 from flask_migrate import Migrate
-from models import db, User, Deck, Card, Session, Review
+from models import db, User, Deck, Card, Session, Review, ReviewArchive, UserCardState, deck_cards
+from decay_fit import fit_all_users, start_decay_fit_scheduler
+from scheduling import sample_next_review, Scheduler
+from replay import run_replay
+from export import export_all, read_watermark
+from rollups import record_review, rebuild_rollups, daily_series, remove_card_reviews
+from search import init_search_index, search_cards
+from http_cache import conditional, make_etag
+from card_cache import card_cache
+from session_intervals import session_intervals, PRECOMPUTE_DEFAULT
+from http_encoding import init_response_encoding, benchmark_response, ndjson_response
+from diagnostics import deck_lines, database_lines, SECTIONS as DIAGNOSTIC_SECTIONS, MAX_LIMIT as MAX_DIAGNOSTIC_LIMIT
+from images import submit_card_images, process_pending_images
+from compaction import compact_reviews, review_log
+from attribution import attribute_reviews
+from bulk_load import import_cards, import_reviews, read_csv, benchmark_import
+from idempotency import (DuplicateRequest, request_key, request_fingerprint, replay_response, reserve_key,
+                         store_response, purge_expired_keys, next_card_flight)
+from memory import (start_tracking, tracking_enabled, set_baseline, top_allocations, run_soak, TRACKING_FRAMES,
+                    GROUPINGS as MEMORY_GROUPINGS, MAX_TOP as MAX_MEMORY_TOP)
+from study_queue import study_queues
+from bulk import BulkSelectionError, select_card_ids, delete_cards, move_cards, copy_cards, clone_deck
+from sqlalchemy import func, inspect, select
+from sqlalchemy.exc import IntegrityError
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+import click
 import json
 
 import numpy as np
 from datetime import datetime, timedelta
-import random
 import matplotlib
 matplotlib.use('Agg')  # Use Agg backend which is thread-safe
-import matplotlib.pyplot as plt
+import matplotlib.style
+from matplotlib.figure import Figure
 import scipy.stats
 import os
 from io import BytesIO
 
-# ------------------- BAYESIAN MODEL -------------------
-
-def bayesian_posterior(card, prior_alpha=1.0, prior_beta=1.0):
-    ratings = card.get_ratings()
-    if not ratings:
-        return prior_alpha, prior_beta
-    success = sum(r >= 7 for r in ratings)
-    fail = sum(r < 7 for r in ratings)
-    return prior_alpha + success, prior_beta + fail
-
-def adaptive_decay(card, user_profile, base_decay=None, history_window=5):
-    reviews = card.reviews
-    if base_decay is None:
-        base_decay = user_profile.global_decay
-    if len(reviews) < 2:
-        return base_decay
-        
-    # Get the most recent reviews
-    window = sorted(reviews, key=lambda x: x.timestamp)[-history_window:]
-    decay = base_decay
-    
-    for i in range(1, len(window)):
-        t0, rating0 = window[i-1].timestamp, window[i-1].rating
-        t1, rating1 = window[i].timestamp, window[i].rating
-        delta_t = (t1 - t0).total_seconds() / 60
-        delta_rating = rating1 - rating0
-        if delta_rating < 0:
-            decay += abs(delta_rating) * delta_t / 10000
-        elif delta_rating > 0 and delta_t > 10:
-            decay *= 0.97
-            
-    # reward for maturity streak
-    if card.mature_streak > 3:
-        decay *= 0.6
-    return max(0.001, decay)
-
-def sample_next_review(card, user_profile, target_recall=0.7, n_samples=3000):
-    try:
-        alpha, beta = bayesian_posterior(card)
-        decay = adaptive_decay(card, user_profile)
-        p0_samples = np.random.beta(alpha, beta, n_samples)
-        t_samples = []
-        for p0 in p0_samples:
-            if p0 <= target_recall:
-                t_samples.append(1)
-            else:
-                t = np.log(p0 / target_recall) / decay
-                t_samples.append(max(1, t))
-        
-        # Safely handle streak/age calculation
-        try:
-            mature_streak = getattr(card, 'mature_streak', 0)
-            # Safely call time_since_added
-            time_since = 0
-            try:
-                time_since = card.time_since_added()
-            except Exception:
-                # If time_since_added fails, calculate directly if possible
-                if hasattr(card, 'date_added'):
-                    time_since = (datetime.now() - card.date_added).total_seconds() / 60
-            
-            age_factor = 1 + (mature_streak // 2) + (time_since / (60 * 24 * 7))
-            t_samples = [t * age_factor for t in t_samples]
-        except Exception as e:
-            print(f"Error calculating age factor: {str(e)}")
-            # Continue without applying age factor if there's an error
-        
-        # Add random jitter for multi-scale spacing
-        interval = int(np.percentile(t_samples, np.random.uniform(30, 80)))
-        return interval, t_samples
-    except Exception as e:
-        print(f"Error in sample_next_review: {str(e)}")
-        # Return default values if anything fails
-        return 1, [1] * n_samples
-
-def interval_to_text(minutes):
-    if minutes < 60:
-        return f"{minutes} minutes"
-    elif minutes < 1440:
-        return f"{minutes // 60} hours"
-    else:
-        days = minutes // 1440
-        hours = (minutes % 1440) // 60
-        return f"{days} days, {hours} hours" if hours else f"{days} days"
-
-def get_recent_posterior(user_profile, window=30, prior_alpha=2, prior_beta=1):
-    recent = user_profile.get_recall_history()[-window:]
-    successes = sum(s for _, s in recent)
-    failures = len(recent) - successes
-    alpha = prior_alpha + successes
-    beta = prior_beta + failures
-    return alpha, beta
-
-def sample_success_rate(alpha, beta, n_samples=1000):
-    return np.random.beta(alpha, beta, n_samples)
-
-def bayesian_success_rate_interval(interval, alpha, beta, target=0.8, sensitivity=0.2):
-    p_samples = np.random.beta(alpha, beta, 1000)
-    mean_p = np.mean(p_samples)
-    correction = 1 + sensitivity * (mean_p - target)
-    return int(max(1, interval * correction))
-
-# ------------------- SCHEDULER -------------------
-
-class Scheduler:
-    def __init__(self, user_profile, cards):
-        self.user_profile = user_profile
-        self.cards = cards
-        self.card_review_counts = {card.id: 0 for card in self.cards}  # For per-session review limits
-
-    def select_next_card(self, backlog_limit=50, max_reviews_per_card=2):
-        urgents = []
-        news = []
-        matures = []
-        
-        for c in self.cards:
-            try:
-                # Skip if we've already reviewed this card enough times
-                if self.card_review_counts[c.id] >= max_reviews_per_card:
-                    continue
-                    
-                # Safely get review count
-                review_count = 0
-                try:
-                    review_count = c.review_count()
-                except Exception:
-                    # If review_count method fails, try to calculate directly
-                    review_count = len(c.reviews) if hasattr(c, 'reviews') else 0
-                
-                if review_count == 0:
-                    news.append(c)
-                elif not getattr(c, 'is_mature', False) or (getattr(c, 'last_wrong', None) and 
-                        (datetime.now() - c.last_wrong).total_seconds() / 3600 < 48):
-                    urgents.append(c)
-                else:
-                    matures.append(c)
-            except Exception as e:
-                print(f"Error processing card {c.id}: {str(e)}")
-                # Add to news by default if we have an error
-                news.append(c)
-                
-        random.shuffle(urgents)
-        random.shuffle(news)
-        random.shuffle(matures)
-        
-        to_study = urgents[:backlog_limit] + news[:3] + matures[:5]
-        if len(to_study) > backlog_limit:
-            to_study = to_study[:backlog_limit]
-            
-        if to_study:
-            card = random.choice(to_study)
-            self.card_review_counts[card.id] += 1
-            return card
-        else:
-            remaining = [c for c in self.cards if self.card_review_counts[c.id] < max_reviews_per_card]
-            if remaining:
-                card = random.choice(remaining)
-                self.card_review_counts[card.id] += 1
-                return card
-            return random.choice(self.cards) if self.cards else None
-
 # ------------------- APP CONFIGURATION -------------------
 
 app = Flask(__name__)
 # Configure CORS to accept requests from all origins, including the Electron app
 CORS(app, supports_credentials=True, resources={r"/api/*": {"origins": "*", "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS", "HEAD"]}})
+# orjson serialization and gzip/brotli compression of large responses
+init_response_encoding(app)
 
 # Add a health check endpoint
 @app.route('/api/health', methods=['GET', 'HEAD'])
@@ -192,13 +59,37 @@ def health_check():
 
 # Database configuration
 db_path = os.environ.get('DATABASE_URL', 'sqlite:///' + os.path.join(os.path.abspath(os.path.dirname(__file__)), 'flashcards.db'))
+if db_path.startswith('postgres://'):
+    db_path = 'postgresql://' + db_path[len('postgres://'):]  # Heroku-style URL, rejected by SQLAlchemy
 print(f"Using database at: {db_path}")
 app.config['SQLALCHEMY_DATABASE_URI'] = db_path
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+if not db_path.startswith('sqlite'):
+    # Connection pool per worker process for server databases (PostgreSQL);
+    # SQLite keeps SQLAlchemy's defaults
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),  # seconds
+        'pool_pre_ping': True,  # drop connections the server closed while idle
+    }
 
 # Initialize SQLAlchemy with the Flask app
 db.init_app(app)
-migrate = Migrate(app, db)
+
+# Schema migrations live in migrations/ (Alembic through Flask-Migrate);
+# `flask --app app db upgrade` brings an existing database up to date. A
+# database created from scratch by create_all below is already current and is
+# stamped as such.
+MIGRATIONS_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'migrations')
+migrate = Migrate(app, db, directory=MIGRATIONS_DIR)
+
+def schema_revisions():
+    # (the database's revisions, the migrations' head revisions)
+    with db.engine.connect() as connection:
+        current = set(MigrationContext.configure(connection).get_current_heads())
+    return current, set(ScriptDirectory(MIGRATIONS_DIR).get_heads())
 
 # Create default user if not exists - updated to properly use app_context
 def create_default_user():
@@ -223,15 +114,166 @@ def create_default_user():
 # Initialize database and create tables
 with app.app_context():
     try:
+        fresh = not inspect(db.engine).has_table('user')
+        if not fresh:
+            current, heads = schema_revisions()
+            if current != heads:
+                print("Database schema is out of date; run `flask --app app db upgrade`")
         print("Creating database tables...")
         db.create_all()
         print("Database tables created successfully")
+        if fresh:
+            # create_all made the latest schema
+            with db.engine.begin() as connection:
+                MigrationContext.configure(connection).stamp(ScriptDirectory(MIGRATIONS_DIR), 'heads')
+        if init_search_index():
+            print("Full-text search index ready")
     except Exception as e:
         print(f"Database initialization error: {str(e)}")
 
 # Create default user after tables are created
 create_default_user()
 
+# Offline decay fitting: `flask --app app fit-decay` from cron, or set
+# DECAY_FIT_INTERVAL_HOURS to run it periodically inside the worker
+@app.cli.command('fit-decay')
+def fit_decay_command():
+    fit_all_users()
+
+# Replay the review log against a parameter grid, e.g.
+# `flask --app app replay --grid history_window=3,5,8 --grid maturity_multiplier=0.5,0.6`
+@app.cli.command('replay')
+@click.option('--grid', multiple=True, help='name=value1,value2,... (repeatable)')
+@click.option('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+def replay_command(grid, workers):
+    parsed = {}
+    for option in grid:
+        name, _, values = option.partition('=')
+        cast = int if name == 'history_window' else float
+        parsed[name] = [cast(v) for v in values.split(',')]
+    
+    for result in run_replay(app.config['SQLALCHEMY_DATABASE_URI'], parsed, workers):
+        print(json.dumps(result))
+
+# Columnar export for analytics, e.g. `flask --app app export ./warehouse --incremental`.
+# Point --database-url at a read replica to keep the export off the primary.
+@app.cli.command('export')
+@click.argument('out_dir')
+@click.option('--format', 'fmt', type=click.Choice(['parquet', 'arrow']), default='parquet')
+@click.option('--since', type=click.DateTime(), default=None,
+              help='Only cards and sessions newer than this timestamp (reviews are exported in full)')
+@click.option('--incremental', is_flag=True, help='Continue from the watermark of the previous export')
+@click.option('--database-url', default=None, help='Database to read from (default: the app database)')
+def export_command(out_dir, fmt, since, incremental, database_url):
+    since_review_id = None
+    if incremental and since is None:
+        since, since_review_id = read_watermark(out_dir)
+        reviews = f"reviews after id {since_review_id}" if since_review_id is not None else "all reviews"
+        print(f"Exporting changes since {since.isoformat() if since else 'the beginning'} ({reviews})")
+    db_uri = database_url or app.config['SQLALCHEMY_DATABASE_URI']
+    export_all(db_uri, out_dir, since=since, since_review_id=since_review_id, fmt=fmt)
+
+# Downscale/transcode images and create thumbnails for cards that predate
+# the image pipeline
+@app.cli.command('process-images')
+def process_images_command():
+    process_pending_images()
+
+# Move reviews older than the retention horizon to review_archive, e.g.
+# `flask --app app compact-reviews --retention-days 180` from cron
+@app.cli.command('compact-reviews')
+@click.option('--retention-days', type=int, default=365)
+@click.option('--batch-size', type=int, default=500, help='Cards per transaction')
+def compact_reviews_command(retention_days, batch_size):
+    compact_reviews(retention_days=retention_days, batch_size=batch_size)
+
+# Migration to per-user reviews: attribute existing reviews to their
+# session's user and build every user's card states. `flask db upgrade` runs
+# it once; run it again to give sessionless reviews an owner, e.g.
+# `flask --app app attribute-reviews --sessionless-user default`
+@app.cli.command('attribute-reviews')
+@click.option('--sessionless-user', default=None, help='User to attribute reviews without a session to')
+@click.option('--batch-size', type=int, default=10000, help='Review ids per transaction')
+def attribute_reviews_command(sessionless_user, batch_size):
+    attribute_reviews(sessionless_user=sessionless_user, batch_size=batch_size)
+
+# Bulk imports from CSV (COPY on PostgreSQL), e.g.
+# `flask --app app import-cards Spanish cards.csv` with columns front,back[,type] and
+# `flask --app app import-reviews reviews.csv` with card_id,user,timestamp,rating[,session_id]
+@app.cli.command('import-cards')
+@click.argument('deck')
+@click.argument('path')
+def import_cards_command(deck, path):
+    deck_obj = Deck.query.filter_by(name=deck).first()
+    if not deck_obj:
+        deck_obj = Deck(name=deck)
+        db.session.add(deck_obj)
+        db.session.commit()
+    card_ids = import_cards(deck_obj.id, read_csv(path))
+    print(f"Imported {len(card_ids)} cards into {deck}")
+
+@app.cli.command('import-reviews')
+@click.argument('path')
+def import_reviews_command(path):
+    count = import_reviews(read_csv(path))
+    print(f"Imported {count} reviews")
+
+# Import and read throughput of the configured database in a scratch deck;
+# run it once with a SQLite and once with a PostgreSQL DATABASE_URL to compare
+@app.cli.command('bench-import')
+@click.option('--cards', type=int, default=10000)
+@click.option('--reviews', type=int, default=100000)
+def bench_import_command(cards, reviews):
+    print(json.dumps(benchmark_import(cards, reviews)))
+
+# Delete review idempotency keys past their TTL, e.g. hourly from cron
+@app.cli.command('purge-idempotency-keys')
+def purge_idempotency_keys_command():
+    purge_expired_keys()
+
+# Recompute the stats rollups from the review table
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    rebuild_rollups()
+
+# Serialization and compression cost of the heaviest GETs for one deck, e.g.
+# `flask --app app bench-responses Spanish`
+@app.cli.command('bench-responses')
+@click.argument('deck')
+@click.option('--repeat', type=int, default=5)
+def bench_responses_command(deck, repeat):
+    client = app.test_client()
+    for path in (f'/api/cards/{deck}', f'/api/diagnostic/deck/{deck}'):
+        print(json.dumps(benchmark_response(client, path, repeat)))
+
+# Memory soak test: steady mixed traffic against a scratch deck, failing
+# (exit status 1) if RSS or traced memory grows past its budget after warmup
+@app.cli.command('soak')
+@click.option('--requests', 'n_requests', type=int, default=5000)
+@click.option('--warmup', type=int, default=500)
+@click.option('--cards', type=int, default=200)
+@click.option('--image-bytes', type=int, default=20000, help='Image size of every other card, 0 for none')
+@click.option('--rss-budget-mb', type=float, default=50.0)
+@click.option('--traced-budget-mb', type=float, default=20.0)
+@click.option('--seed', type=int, default=0)
+@click.option('--verbose', is_flag=True, help="Don't silence request logging")
+def soak_command(n_requests, warmup, cards, image_bytes, rss_budget_mb, traced_budget_mb, seed, verbose):
+    report = run_soak(app, requests=n_requests, warmup=warmup, cards=cards, image_bytes=image_bytes,
+                      rss_budget_mb=rss_budget_mb, traced_budget_mb=traced_budget_mb, seed=seed, verbose=verbose)
+    print(json.dumps(report, indent=2))
+    if not report['passed']:
+        raise SystemExit(1)
+
+# Allocation tracking for /api/diagnostic/memory, e.g. MEMORY_TRACKING=1
+if TRACKING_FRAMES:
+    start_tracking(TRACKING_FRAMES)
+    set_baseline()
+
+decay_fit_interval = os.environ.get('DECAY_FIT_INTERVAL_HOURS')
+if decay_fit_interval:
+    print(f"Scheduling decay fit every {decay_fit_interval} hours")
+    start_decay_fit_scheduler(app, float(decay_fit_interval))
+
 # Wrap route handlers with better error handling
 @app.errorhandler(500)
 def handle_500_error(e):
@@ -243,9 +285,44 @@ def handle_exception(e):
     print(f"Unhandled Exception: {str(e)}")
     return jsonify(error=str(e)), 500
 
+# ------------------- ETAGS -------------------
+
+def deck_list_etag():
+    count, max_id = db.session.query(func.count(Deck.id), func.max(Deck.id)).one()
+    return make_etag('decks', count, max_id)
+
+def deck_etag(deck):
+    # Column query, so the deck's cards are not subquery-loaded
+    row = db.session.query(Deck.id, Deck.version).filter_by(name=deck).first()
+    return make_etag('deck', row.id, row.version) if row else None
+
+def cards_etag(deck):
+    # Full images and thumbnails are different representations
+    etag = deck_etag(deck)
+    return make_etag(etag, request.args.get('images')) if etag else None
+
+def user_etag(user):
+    row = db.session.query(User.id, User.version).filter_by(username=user).first()
+    return make_etag('user', row.id, row.version) if row else None
+
+def sessions_etag():
+    user = user_etag(request.args.get('user', 'default'))
+    deck_name = request.args.get('deck')
+    deck_id = db.session.query(Deck.id).filter_by(name=deck_name).scalar() if deck_name else None
+    return make_etag('sessions', user, deck_id) if user else None
+
+def database_etag():
+    decks = db.session.query(func.count(Deck.id), func.coalesce(func.sum(Deck.version), 0)).one()
+    users = db.session.query(func.count(User.id), func.coalesce(func.sum(User.version), 0)).one()
+    sessions = db.session.query(func.count(Session.id)).scalar()
+    # Compaction moves reviews to the archive without bumping any version
+    archived = db.session.query(func.count(ReviewArchive.id)).scalar()
+    return make_etag('db', *decks, *users, sessions, archived)
+
 # ------------------- API ROUTES -------------------
 
 @app.route('/api/decks', methods=['GET', 'POST', 'HEAD', 'OPTIONS'])
+@conditional(deck_list_etag)
 def decks():
     print(f"Request to /api/decks with method {request.method}")
     print(f"Request headers: {dict(request.headers)}")
@@ -342,6 +419,7 @@ def decks():
             return jsonify({'error': f'Failed to create deck: {str(e)}'}), 500
 
 @app.route('/api/cards/<deck>', methods=['GET', 'POST'])
+@conditional(cards_etag)
 def cards(deck):
     # Find the deck
     deck_obj = Deck.query.filter_by(name=deck).first()
@@ -349,7 +427,9 @@ def cards(deck):
         return jsonify({'error': 'Deck not found'}), 404
         
     if request.method == 'GET':
-        cards = [card.to_dict() for card in deck_obj.cards]
+        # ?images=thumbnail for list views
+        thumbnails = request.args.get('images') == 'thumbnail'
+        cards = [card.to_dict(thumbnails=thumbnails) for card in deck_obj.cards]
         return jsonify(cards)
     else:
         card_data = request.json  # {front, back, frontImage, backImage, type}
@@ -366,10 +446,32 @@ def cards(deck):
         # Add card to deck
         deck_obj.cards.append(new_card)
         db.session.add(new_card)
+        Deck.bump_version([deck_obj.id])
         db.session.commit()
+        card_cache.invalidate_deck(deck_obj.id)
+        submit_card_images(new_card.id)
         
         return jsonify({'success': True, 'id': new_card.id})
 
+@app.route('/api/search/<deck>', methods=['GET'])
+def search(deck):
+    deck_obj = Deck.query.filter_by(name=deck).first()
+    if not deck_obj:
+        return jsonify({'error': 'Deck not found'}), 404
+    
+    query = request.args.get('q', '')
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = min(100, max(1, request.args.get('per_page', 20, type=int)))
+    
+    total, results = search_cards(deck_obj.id, query, limit=per_page, offset=(page - 1) * per_page)
+    return jsonify({
+        'query': query,
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'results': results
+    })
+
 @app.route('/api/next_card/<deck>/<user>', methods=['POST'])
 def next_card(deck, user):
     print(f"@@@@@@ Request for next card - deck: {deck}, user: {user}")
@@ -383,61 +485,128 @@ def next_card(deck, user):
         db.session.commit()
     
     # Get deck
-    deck_obj = Deck.query.filter_by(name=deck).first()
-    if not deck_obj:
+    deck_id = card_cache.deck_id(deck)
+    if deck_id is None:
         print(f"@@@@@@ Error: Deck not found: {deck}")
         return jsonify({'success': False, 'error': f'Deck "{deck}" not found'}), 404
-        
-    if not deck_obj.cards or len(deck_obj.cards) == 0:
+    
+    # Concurrent requests for the same user and deck share one selection
+    payload, status = next_card_flight.do((user_obj.id, deck_id), lambda: select_next_card(user_obj, deck, deck_id))
+    return jsonify(payload), status
+
+def select_next_card(user_obj, deck, deck_id):
+    # (payload, status) of a next_card request
+    # Cached scheduling state of every card in the deck, for this user
+    states = card_cache.deck_state(deck_id, user_obj.id)
+    if not len(states):
         print(f"@@@@@@ Error: No cards in deck {deck}")
-        return jsonify({'success': False, 'error': f'No cards in deck "{deck}". Please add cards before studying.'}), 400
+        return {'success': False, 'error': f'No cards in deck "{deck}". Please add cards before studying.'}, 400
     
-    print(f"@@@@@@ Found {len(deck_obj.cards)} cards in deck {deck}")
+    print(f"@@@@@@ Found {len(states)} cards in deck {deck}")
     
     # Use the scheduler to get the next card
     try:
-        scheduler = Scheduler(user_obj, deck_obj.cards)
+        scheduler = Scheduler(user_obj, states)
         next_card = scheduler.select_next_card()
         
         if not next_card:
             print(f"@@@@@@ Error: Scheduler returned no cards")
-            return jsonify({'success': False, 'error': 'No cards available for study at this time.'}), 200
+            return {'success': False, 'error': 'No cards available for study at this time.'}, 200
             
         print(f"@@@@@@ Selected card ID: {next_card.id}")
     except Exception as e:
         print(f"@@@@@@ Error selecting next card: {str(e)}")
         import traceback
         print(traceback.format_exc())
-        return jsonify({'success': False, 'error': f'Error selecting next card: {str(e)}'}), 500
+        return {'success': False, 'error': f'Error selecting next card: {str(e)}'}, 500
     
-    # Get interval prediction
+    return next_card_payload(user_obj, next_card)
+
+def next_card_payload(user_obj, next_card):
+    # (payload, status) presenting a selected card state with its stats
+    # Get interval prediction, precomputed for the active session if possible
     try:
-        interval, _ = sample_next_review(next_card, user_obj)
+        interval = None
+        if user_obj.active_session_id:
+            interval = session_intervals.sample(user_obj.active_session_id, next_card.id, user_obj.global_decay)
+        if interval is None:
+            interval, _ = sample_next_review(next_card, user_obj)
         
         stats = {
             "next_interval": interval,
             "pomodoro_time": user_obj.pomodoro_length
         }
         
-        # Convert card to dict to ensure all fields are serializable
-        card_dict = next_card.to_dict()
+        # Only the selected card's content is loaded from the database
+        card_dict = Card.query.get(next_card.id).to_dict(next_card)
         
         print(f"@@@@@@ Returning card data for card ID: {next_card.id}")
         
         # Return in the structure expected by the frontend
-        return jsonify({
+        return {
             "success": True,
             "next_card": {**card_dict, "stats": stats}
-        })
+        }, 200
     except Exception as e:
         print(f"@@@@@@ Error preparing card response: {str(e)}")
         import traceback
         print(traceback.format_exc())
-        return jsonify({'success': False, 'error': f'Error preparing card: {str(e)}'}), 500
+        return {'success': False, 'error': f'Error preparing card: {str(e)}'}, 500
+
+# Next due card across all of the user's decks, or the ones named in
+# {"decks": [...]}. Same payload as next_card plus the deck the card was
+# picked from, to post its review to.
+@app.route('/api/next_due/<user>', methods=['POST'])
+def next_due_card(user):
+    print(f"@@@@@@ Request for next due card - user: {user}")
+    data = request.get_json(silent=True) or {}
+    
+    # Get or create user
+    user_obj = User.query.filter_by(username=user).first()
+    if not user_obj:
+        print(f"@@@@@@ Creating new user: {user}")
+        user_obj = User(username=user)
+        db.session.add(user_obj)
+        db.session.commit()
+    
+    deck_ids = None
+    if data.get('decks'):
+        deck_ids = []
+        for name in data['decks']:
+            deck_id = card_cache.deck_id(name)
+            if deck_id is None:
+                return jsonify({'success': False, 'error': f'Deck "{name}" not found'}), 404
+            deck_ids.append(deck_id)
+    
+    # Concurrent requests share one pick, so a double tap doesn't skip a card
+    key = (user_obj.id, 'due', tuple(sorted(deck_ids)) if deck_ids is not None else None)
+    payload, status = next_card_flight.do(key, lambda: select_next_due_card(user_obj, deck_ids))
+    return jsonify(payload), status
+
+def select_next_due_card(user_obj, deck_ids):
+    try:
+        picked = study_queues.next_card(user_obj.id, deck_ids)
+    except Exception as e:
+        print(f"@@@@@@ Error selecting next due card: {str(e)}")
+        import traceback
+        print(traceback.format_exc())
+        return {'success': False, 'error': f'Error selecting next card: {str(e)}'}, 500
+    
+    if picked is None:
+        print(f"@@@@@@ Nothing due")
+        return {'success': False, 'error': 'No cards are due in any deck.'}, 200
+    
+    next_card, deck_id = picked
+    print(f"@@@@@@ Selected card ID: {next_card.id} from deck {deck_id}")
+    payload, status = next_card_payload(user_obj, next_card)
+    if payload.get('success'):
+        payload['deck'] = db.session.query(Deck.name).filter_by(id=deck_id).scalar()
+    return payload, status
 
 @app.route('/api/review/<deck>/<user>', methods=['POST'])
 def review_card(deck, user):
     print(f"@@@@@@ Receiving review for deck: {deck}, user: {user}")
+    reserved = None  # (user id, idempotency key) once committed with the review
     try:
         data = request.json
         print(f"@@@@@@ Review data: {data}")
@@ -455,6 +624,11 @@ def review_card(deck, user):
         if rating is None:
             return jsonify({'success': False, 'error': 'Rating is required'}), 400
             
+        try:
+            idempotency_key = request_key(request, data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+            
         # Get or create user
         user_obj = User.query.filter_by(username=user).first()
         if not user_obj:
@@ -462,6 +636,19 @@ def review_card(deck, user):
             db.session.add(user_obj)
             db.session.commit()
         
+        # A retry of a review that was already recorded gets the original response
+        if idempotency_key:
+            fingerprint = request_fingerprint(deck, data)
+            replayed = replay_response(user_obj.id, idempotency_key, fingerprint)
+            if replayed is not None:
+                print(f"@@@@@@ Replaying response for idempotency key {idempotency_key}")
+                return replayed
+        
+        def respond(payload, status=200):
+            if idempotency_key:
+                store_response(user_obj.id, idempotency_key, payload, status)
+            return jsonify(payload), status
+        
         # Find the card
         card = Card.query.get(card_id)
         if not card:
@@ -472,35 +659,64 @@ def review_card(deck, user):
             session_id = user_obj.active_session_id
             print(f"@@@@@@ Using active session: {session_id}")
         
-        # Add the review
-        card.add_review(rating, session_id)
-        user_obj.add_recall(0, rating >= 7)  # Simple success/fail based on rating
+        # Interval since the user's previous review of the card, in minutes
+        last_review = (db.session.query(func.max(Review.timestamp))
+                       .filter_by(user_id=user_obj.id, card_id=card.id).scalar())
+        interval = (datetime.now() - last_review).total_seconds() / 60 if last_review else 0
         
-        # If there's an active session, track the review there as well
+        # Resolve the session the review belongs to
         session = None
         if session_id:
             session = Session.query.get(session_id)
             if session:
                 print(f"@@@@@@ Adding review to session: {session.name}")
-                session.add_review(card_id, rating)
             else:
                 print(f"@@@@@@ Session not found: {session_id}")
         
-        db.session.commit()
+        # Update the rollups before the review row exists, then add the review
+        # (tagged with session_id, which also tracks it on the session)
+        record_review(card, rating, session, user_id=user_obj.id)
+        review = card.add_review(rating, session_id, user_obj.id)
+        user_obj.add_recall(interval, rating >= 7)  # Simple success/fail based on rating
         
-        # Get the deck object
-        deck_obj = Deck.query.filter_by(name=deck).first()
-        if not deck_obj:
-            return jsonify({'success': False, 'error': f'Deck {deck} not found'}), 404
+        # Card review counts and the user's history changed
+        deck_ids = [d.id for d in card.decks]
+        Deck.bump_versions_for_card(card.id)
+        User.bump_version(user_obj.id)
+        
+        review_id, reviewed_at = review.id, review.timestamp
+        try:
+            if idempotency_key:
+                reserve_key(user_obj.id, idempotency_key, fingerprint)
+            db.session.commit()
+        except (IntegrityError, DuplicateRequest) as e:
+            if not idempotency_key:
+                raise
+            # A concurrent duplicate committed the same key first
+            db.session.rollback()
+            replayed = replay_response(user_obj.id, idempotency_key, fingerprint)
+            if replayed is None and isinstance(e, IntegrityError):
+                raise  # some other constraint, the key isn't taken
+            return replayed or (jsonify({'success': False, 'error': 'Duplicate request, retry'}), 409)
+        if idempotency_key:
+            reserved = (user_obj.id, idempotency_key)
+        card_cache.record_review(card.id, user_obj.id, review_id, rating, reviewed_at, deck_ids)
+        session_intervals.record_review(card.id, user_obj.id)
+        study_queues.record_review(card.id, user_obj.id, deck_ids)
+        
+        # Get the deck
+        deck_id = card_cache.deck_id(deck)
+        if deck_id is None:
+            return respond({'success': False, 'error': f'Deck {deck} not found'}, 404)
         
         # Get next card using scheduler
         print(f"@@@@@@ Getting next card after review")
-        scheduler = Scheduler(user_obj, deck_obj.cards)
+        scheduler = Scheduler(user_obj, card_cache.deck_state(deck_id, user_obj.id))
         next_card = scheduler.select_next_card()
         
         if not next_card:
             print(f"@@@@@@ No more cards available for review")
-            return jsonify({
+            return respond({
                 'success': True,
                 'error': 'No more cards available for review',
                 'next_card': None
@@ -508,8 +724,10 @@ def review_card(deck, user):
         
         print(f"@@@@@@ Next card ID: {next_card.id}")
         
-        # Get interval prediction for next card
-        interval, _ = sample_next_review(next_card, user_obj)
+        # Get interval prediction for next card, precomputed for the session if possible
+        interval = session_intervals.sample(session_id, next_card.id, user_obj.global_decay) if session_id else None
+        if interval is None:
+            interval, _ = sample_next_review(next_card, user_obj)
         
         stats = {
             "next_interval": interval,
@@ -517,10 +735,10 @@ def review_card(deck, user):
             "session_id": session_id
         }
         
-        # Convert card to dict to ensure all fields are serializable
-        card_dict = next_card.to_dict()
+        # Only the selected card's content is loaded from the database
+        card_dict = Card.query.get(next_card.id).to_dict(next_card)
         
-        return jsonify({
+        return respond({
             'success': True,
             'next_card': {**card_dict, "stats": stats}
         })
@@ -528,9 +746,21 @@ def review_card(deck, user):
         print(f"@@@@@@ Error in review_card: {str(e)}")
         import traceback
         print(traceback.format_exc())
-        return jsonify({'success': False, 'error': f'Error processing review: {str(e)}'}), 500
+        payload = {'success': False, 'error': f'Error processing review: {str(e)}'}
+        if reserved:
+            # The review was recorded; retries get this response instead of
+            # a 409 until the key expires
+            db.session.rollback()
+            try:
+                store_response(*reserved, payload, 500)
+            except Exception as store_error:
+                print(f"@@@@@@ Error storing the response for idempotency key {reserved[1]}: {str(store_error)}")
+                db.session.rollback()
+        return jsonify(payload), 500
 
+# Weak ETag: durations of open sessions are computed at request time
 @app.route('/api/sessions', methods=['GET'])
+@conditional(sessions_etag, weak=True)
 def get_sessions():
     user_name = request.args.get('user', 'default')
     deck_name = request.args.get('deck')
@@ -586,12 +816,14 @@ def create_session():
     else:
         print(f"Found deck: {deck_name} (id={deck.id})")
         
-    # Check if deck has cards
-    if not deck.cards or len(deck.cards) == 0:
+    # Check if deck has cards (counted, not loaded)
+    card_count = db.session.scalar(select(func.count()).select_from(deck_cards)
+                                   .where(deck_cards.c.deck_id == deck.id))
+    if not card_count:
         print(f"Error: Deck {deck_name} has no cards")
         return jsonify({'error': 'This deck has no cards. Please add cards before studying.'}), 400
     else:
-        print(f"Deck {deck_name} has {len(deck.cards)} cards")
+        print(f"Deck {deck_name} has {card_count} cards")
     
     # Create session
     name = session_name or f"Session {datetime.now().strftime('%Y-%m-%d %H:%M')}"
@@ -607,9 +839,14 @@ def create_session():
         # Link session to user AFTER committing to ensure session.id is valid
         print(f"Linking session {session.id} to user {user.username}")
         user.start_session(session.id)
+        User.bump_version(user.id)
         db.session.commit()
         print(f"Successfully linked session to user")
         
+        # Precompute every card's interval distribution in the background
+        if data.get('precompute', PRECOMPUTE_DEFAULT):
+            session_intervals.start(session.id, deck.id, user.id)
+        
         session_dict = session.to_dict()
         print(f"Session data: {session_dict}")
         
@@ -639,11 +876,13 @@ def end_session(session_id):
         return jsonify({'error': 'Session not found'}), 404
     
     session.end_session()
+    session_intervals.end(session.id)
     
     # Update user profile
     user = session.user_profile
     if user:
         user.end_session()
+        User.bump_version(user.id)
     
     db.session.commit()
     
@@ -652,6 +891,17 @@ def end_session(session_id):
         'session': session.to_dict()
     })
 
+STATS_PLOT_STYLE = {
+    'figure.dpi': 100,
+    'text.color': 'white',
+    'axes.labelcolor': 'white',
+    'axes.edgecolor': 'white',
+    'axes.facecolor': '#2f2f31',
+    'axes.titlecolor': 'white',
+    'xtick.color': 'white',
+    'ytick.color': 'white',
+}
+
 @app.route('/api/stats/<stat_type>', methods=['GET'])
 def get_stats(stat_type):
     user_name = request.args.get('user', 'default')
@@ -663,37 +913,20 @@ def get_stats(stat_type):
     if not user:
         return jsonify({'error': 'User not found'}), 404
     
-    # Set global style for plots with dark background and light text
-    plt.style.use('dark_background')
-    plt.rcParams['figure.dpi'] = 100
-    plt.rcParams['text.color'] = 'white'
-    plt.rcParams['axes.labelcolor'] = 'white'
-    plt.rcParams['axes.edgecolor'] = 'white'
-    plt.rcParams['axes.facecolor'] = '#2f2f31'
-    plt.rcParams['axes.titlecolor'] = 'white'
-    plt.rcParams['xtick.color'] = 'white'
-    plt.rcParams['ytick.color'] = 'white'
-    
-    # Create figure with two subplots side by side
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(8, 4))
-    fig.set_facecolor('#2f2f31')
-    
+    # Cumulative success rate over review count. User and deck stats come
+    # from the daily rollups, with one point per day; session stats use the
+    # session's own reviews.
     title_prefix = ""
     if stat_type == "user":
         title_prefix = f"User: {user_name}"
-        data = user.get_recall_history()
+        series = daily_series(user_id=user.id)
     elif stat_type == "deck" and deck_name:
         title_prefix = f"Deck: {deck_name}"
         # Get the deck
         deck = Deck.query.filter_by(name=deck_name).first()
         if not deck:
             return jsonify({'error': 'Deck not found'}), 404
-            
-        # Get all reviews for cards in this deck
-        data = []
-        for card in deck.cards:
-            for review in card.reviews:
-                data.append((0, 1 if review.rating >= 7 else 0))
+        series = daily_series(user_id=user.id, deck_id=deck.id)  # the user's own reviews of the deck
     elif stat_type == "session" and session_id:
         # Get the session
         session = Session.query.get(session_id)
@@ -701,15 +934,36 @@ def get_stats(stat_type):
             return jsonify({'error': 'Session not found'}), 404
             
         title_prefix = f"Session: {session.name}"
-        data = [(0, 1 if review.rating >= 7 else 0) for review in session.reviews]
+        log = review_log()  # old sessions may have been compacted
+        reviews = (db.session.query(log.c.timestamp, log.c.rating)
+                   .filter(log.c.session_id == session.id).order_by(log.c.timestamp).all())
+        series = [(timestamp, 1, 1 if rating >= 7 else 0) for timestamp, rating in reviews]
     else:
         return jsonify({'error': 'Invalid stat type or missing parameters'}), 400
     
+    # Dark background and light text, applied only while the figure is drawn.
+    # The figure is a plain Figure rather than a pyplot one, so nothing keeps
+    # a reference to it once the response is sent.
+    with matplotlib.style.context('dark_background'), matplotlib.rc_context(STATS_PLOT_STYLE):
+        return plot_stats(series)
+
+def plot_stats(series):
+    # Create figure with two subplots side by side
+    fig = Figure(figsize=(8, 4))
+    ax1, ax2 = fig.subplots(1, 2)
+    fig.set_facecolor('#2f2f31')
+    
+    review_indices = []
+    cumulative_success = []
+    total = successes = 0
+    for _, count, success_count in series:
+        total += count
+        successes += success_count
+        review_indices.append(total)
+        cumulative_success.append(successes / total)
+    
     # Plot 1: Success rate - more compact with minimal elements
-    if data:
-        review_indices = list(range(1, len(data) + 1))
-        cumulative_success = [sum(1 for _, s in data[:i+1] if s == 1) / (i+1) for i in range(len(data))]
-        
+    if total:
         ax1.plot(review_indices, cumulative_success, '-', linewidth=2, color='#2496dc', label='Success')
         ax1.axhline(y=0.7, color='r', linestyle='--', linewidth=1, label='Target')
         ax1.set_xlabel('Review #', fontsize=9, color='white')
@@ -726,9 +980,8 @@ def get_stats(stat_type):
             ax1.set_xticks(review_indices[::step])
     
     # Plot 2: Performance distribution - more compact with minimal elements
-    if data:
-        successes = sum(s for _, s in data)
-        failures = len(data) - successes
+    if total:
+        failures = total - successes
         alpha = 2 + successes  # Adding prior
         beta = 1 + failures    # Adding prior
         
@@ -746,12 +999,11 @@ def get_stats(stat_type):
         ax2.tick_params(axis='both', which='major', labelsize=8, colors='white')
     
     # Remove excess whitespace around plots
-    plt.tight_layout(pad=1.0)
+    fig.tight_layout(pad=1.0)
     
     # Save plot to bytes - using the dark background color and higher quality
     buf = BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight', facecolor='#2f2f31', dpi=120)
-    plt.close(fig)  # Close the figure to free up memory
+    fig.savefig(buf, format='png', bbox_inches='tight', facecolor='#2f2f31', dpi=120)
     buf.seek(0)
     return send_file(buf, mimetype='image/png')
 
@@ -769,13 +1021,20 @@ def delete_card(deck, card_id):
         
     # Remove card from deck
     try:
+        deck_ids = [d.id for d in card.decks]
+        Deck.bump_versions_for_card(card.id)
+        # Take the card's reviews out of the rollups while it is still in its decks
+        remove_card_reviews([card.id])
         # Remove from deck relationship
         deck_obj.cards.remove(card)
         # Delete any reviews associated with this card
         Review.query.filter_by(card_id=card.id).delete()
+        ReviewArchive.query.filter_by(card_id=card.id).delete()
+        UserCardState.query.filter_by(card_id=card.id).delete()
         # Delete the card itself
         db.session.delete(card)
         db.session.commit()
+        card_cache.invalidate_card(int(card_id), deck_ids)
         return jsonify({'success': True})
     except Exception as e:
         db.session.rollback()
@@ -801,66 +1060,144 @@ def update_card(deck, card_id):
             card.front = data['front']
         if 'back' in data:
             card.back = data['back']
-        if 'frontImage' in data:
+        if 'frontImage' in data and data['frontImage'] != card.front_image:
             card.front_image = data['frontImage']
-        if 'backImage' in data:
+            card.front_thumbnail = None
+        if 'backImage' in data and data['backImage'] != card.back_image:
             card.back_image = data['backImage']
+            card.back_thumbnail = None
         if 'type' in data:
             card.card_type = data['type']
             
+        deck_ids = [d.id for d in card.decks]
+        Deck.bump_versions_for_card(card.id)
         db.session.commit()
+        card_cache.note_deck_write(deck_ids)
+        submit_card_images(card.id)
         return jsonify({'success': True, 'card': card.to_dict()})
     except Exception as e:
         db.session.rollback()
         print(f"Error updating card: {str(e)}")
         return jsonify({'error': f'Failed to update card: {str(e)}'}), 500
 
+# ------------------- BULK CARD OPERATIONS -------------------
+#
+# Bodies select the source deck's cards with {"ids": [...]} or
+# {"filter": {"mature": bool, "type": str, "reviewed": bool, "added_before": iso,
+# "added_after": iso, "query": str}}; an empty filter selects the whole deck.
+
+def _bulk_target(data):
+    target = data.get('target')
+    target_id = card_cache.deck_id(target) if target else None
+    if target_id is None:
+        raise BulkSelectionError(f"Target deck {target!r} not found")
+    return target_id
+
+@app.route('/api/cards/<deck>/delete', methods=['POST'])
+def bulk_delete_cards(deck):
+    deck_id = card_cache.deck_id(deck)
+    if deck_id is None:
+        return jsonify({'error': 'Deck not found'}), 404
+
+    data = request.json or {}
+    try:
+        selection = select_card_ids(deck_id, data.get('ids'), data.get('filter'))
+        card_ids, deck_ids = delete_cards(deck_id, selection)
+        db.session.commit()
+        card_cache.invalidate_cards(card_ids, deck_ids)
+        return jsonify({'success': True, 'deleted': len(card_ids)})
+    except BulkSelectionError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error deleting cards: {str(e)}")
+        return jsonify({'error': f'Failed to delete cards: {str(e)}'}), 500
+
+@app.route('/api/cards/<deck>/move', methods=['POST'])
+@app.route('/api/cards/<deck>/copy', methods=['POST'])
+def bulk_move_cards(deck):
+    deck_id = card_cache.deck_id(deck)
+    if deck_id is None:
+        return jsonify({'error': 'Deck not found'}), 404
+
+    copy = request.path.endswith('/copy')
+    data = request.json or {}
+    try:
+        target_id = _bulk_target(data)
+        if target_id == deck_id:
+            raise BulkSelectionError("Source and target deck are the same")
+        selection = select_card_ids(deck_id, data.get('ids'), data.get('filter'))
+        if copy:
+            count = copy_cards(deck_id, target_id, selection)
+        else:
+            count = move_cards(deck_id, target_id, selection)
+        db.session.commit()
+        card_cache.invalidate_deck(deck_id)
+        card_cache.invalidate_deck(target_id)
+        return jsonify({'success': True, 'copied' if copy else 'moved': count})
+    except BulkSelectionError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error {'copying' if copy else 'moving'} cards: {str(e)}")
+        return jsonify({'error': f"Failed to {'copy' if copy else 'move'} cards: {str(e)}"}), 500
+
+@app.route('/api/decks/<deck>/clone', methods=['POST'])
+def clone_deck_route(deck):
+    deck_id = card_cache.deck_id(deck)
+    if deck_id is None:
+        return jsonify({'error': 'Deck not found'}), 404
+
+    name = (request.json or {}).get('name')
+    if not name:
+        return jsonify({'error': 'Name of the new deck is required'}), 400
+    if Deck.query.filter_by(name=name).first():
+        return jsonify({'error': f'Deck "{name}" already exists'}), 409
+
+    try:
+        clone, copied = clone_deck(deck_id, name)
+        db.session.commit()
+        return jsonify({'success': True, 'deck': clone.name, 'copied': copied})
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error cloning deck: {str(e)}")
+        return jsonify({'error': f'Failed to clone deck: {str(e)}'}), 500
+
 # ------------------- DIAGNOSTIC ENDPOINTS -------------------
 
+def diagnostic_page_args():
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, MAX_DIAGNOSTIC_LIMIT))
+    return request.args.get('after'), limit
+
+def diagnostic_deck_etag(deck):
+    # Pages and the image variant are separate representations
+    etag = deck_etag(deck)
+    return make_etag(etag, request.query_string) if etag else None
+
+# NDJSON: a "deck" line, one "card" line per card, then an "end" line.
+# ?limit=N&after=<card id> pages through the cards; ?images=1 includes image bodies.
 @app.route('/api/diagnostic/deck/<deck>', methods=['GET'])
+@conditional(diagnostic_deck_etag)
 def diagnostic_deck(deck):
-    try:
-        # Get deck
-        deck_obj = Deck.query.filter_by(name=deck).first()
-        if not deck_obj:
-            return jsonify({
-                "error": f"Deck '{deck}' not found",
-                "available_decks": [d.name for d in Deck.query.all()]
-            }), 404
-            
-        # Get cards
-        cards = deck_obj.cards
-        
+    deck_id = db.session.query(Deck.id).filter_by(name=deck).scalar()
+    if deck_id is None:
         return jsonify({
-            "success": True,
-            "deck_info": {
-                "id": deck_obj.id,
-                "name": deck_obj.name,
-                "date_created": deck_obj.date_created.isoformat(),
-                "card_count": len(cards),
-                "cards": [{
-                    "id": card.id,
-                    "front": card.front,
-                    "back": card.back,
-                    "front_image": card.front_image,
-                    "back_image": card.back_image,
-                    "card_type": card.card_type,
-                    "date_added": card.date_added.isoformat(),
-                    "review_count": len(card.reviews),
-                    "is_mature": card.is_mature,
-                    "mature_streak": card.mature_streak,
-                    "last_wrong": card.last_wrong.isoformat() if card.last_wrong else None,
-                    "last_review": (max((r.timestamp for r in card.reviews), default=None).isoformat() if card.reviews else None)
-                } for card in cards]
-            }
-        })
-    except Exception as e:
-        print(f"Error in diagnostic endpoint: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
-        return jsonify({"error": str(e)}), 500
+            "error": f"Deck '{deck}' not found",
+            "available_decks": [name for (name,) in db.session.query(Deck.name).order_by(Deck.name)]
+        }), 404
+    
+    after, limit = diagnostic_page_args()
+    try:
+        after = int(after) if after is not None else None
+    except ValueError:
+        return jsonify({"error": "'after' must be a card id"}), 400
+    images = request.args.get('images') in ('1', 'true')
+    return ndjson_response(deck_lines(deck_id, after=after, limit=limit, images=images))
 
 @app.route('/api/diagnostic/session/<user>', methods=['GET'])
+@conditional(user_etag)
 def diagnostic_session(user):
     try:
         # Get user
@@ -889,7 +1226,7 @@ def diagnostic_session(user):
                     "name": active_session.name,
                     "start_time": active_session.start_time.isoformat(),
                     "end_time": active_session.end_time.isoformat() if active_session.end_time else None,
-                    "review_count": len(active_session.reviews)
+                    "review_count": active_session.reviews_count()
                 } if active_session else None,
                 "recall_history": user_obj.get_recall_history()
             }
@@ -900,36 +1237,56 @@ def diagnostic_session(user):
         print(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
+def diagnostic_db_etag():
+    return make_etag(database_etag(), request.query_string)
+
+# NDJSON: a "summary" line of counts, then "deck", "user" and "session" lines,
+# each section closed by an "end" line. ?section=decks|users|sessions returns
+# one section, which can be paged with ?limit=N&after=<id>.
 @app.route('/api/diagnostic/db', methods=['GET'])
+@conditional(diagnostic_db_etag)
 def diagnostic_db():
+    section = request.args.get('section')
+    if section is not None and section not in DIAGNOSTIC_SECTIONS:
+        return jsonify({"error": f"Unknown section '{section}'", "sections": list(DIAGNOSTIC_SECTIONS)}), 400
+    
+    after, limit = diagnostic_page_args()
+    if after is not None and section != 'sessions':
+        try:
+            after = int(after)
+        except ValueError:
+            return jsonify({"error": "'after' must be an id"}), 400
+    return ndjson_response(database_lines(section, after=after, limit=limit))
+
+@app.route('/api/diagnostic/cache', methods=['GET'])
+def diagnostic_cache():
+    # Card state cache, next_card coalescing and cross-deck study queues of this worker process
+    return jsonify({"success": True, "card_cache": card_cache.stats(), "next_card_coalescing": next_card_flight.stats(),
+                    "study_queues": study_queues.stats()})
+
+# Top allocation sites of this worker process; only available with
+# MEMORY_TRACKING set. ?limit=N, ?group=lineno|filename|traceback, and
+# ?since=baseline for growth since startup or the last POST .../baseline.
+@app.route('/api/diagnostic/memory', methods=['GET'])
+def diagnostic_memory():
+    if not tracking_enabled():
+        return jsonify({"error": "Memory tracking is disabled; start the worker with MEMORY_TRACKING=<frames>"}), 404
+    
+    limit = max(1, min(request.args.get('limit', 20, type=int), MAX_MEMORY_TOP))
+    group = request.args.get('group', 'lineno')
+    if group not in MEMORY_GROUPINGS:
+        return jsonify({"error": f"Unknown group '{group}'", "groups": list(MEMORY_GROUPINGS)}), 400
     try:
-        return jsonify({
-            "success": True,
-            "database_info": {
-                "decks": [{
-                    "id": deck.id,
-                    "name": deck.name,
-                    "card_count": len(deck.cards)
-                } for deck in Deck.query.all()],
-                "users": [{
-                    "id": user.id,
-                    "username": user.username,
-                    "active_session_id": user.active_session_id
-                } for user in User.query.all()],
-                "sessions": [{
-                    "id": session.id,
-                    "name": session.name,
-                    "user": session.user_profile.username,
-                    "deck": session.deck_info.name,
-                    "review_count": len(session.reviews)
-                } for session in Session.query.all()]
-            }
-        })
-    except Exception as e:
-        print(f"Error in diagnostic endpoint: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
-        return jsonify({"error": str(e)}), 500
+        report = top_allocations(limit, group, since_baseline=request.args.get('since') == 'baseline')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"success": True, **report})
+
+@app.route('/api/diagnostic/memory/baseline', methods=['POST'])
+def diagnostic_memory_baseline():
+    if not tracking_enabled():
+        return jsonify({"error": "Memory tracking is disabled; start the worker with MEMORY_TRACKING=<frames>"}), 404
+    return jsonify({"success": True, "baseline": set_baseline().isoformat()})
 
 # ------------------- DB INITIALIZATION -------------------
 
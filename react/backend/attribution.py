@@ -0,0 +1,121 @@
+from models import db, Card, Deck, Review, ReviewArchive, Session, User, UserCardState, apply_srs_transition, chunks
+from compaction import review_log
+
+from sqlalchemy import bindparam, case, delete, func, select, update
+
+# ------------------- REVIEW ATTRIBUTION -------------------
+#
+# Reviews and the scheduler's card state are keyed by user. History recorded
+# before that has no Review.user_id and no UserCardState rows;
+# `flask attribute-reviews` migrates it (`flask db upgrade` runs it once, in
+# migration 0a68c24e79fc):
+#
+#   1. every review (live or archived) without a user gets its session's
+#      user, in id-ordered batches of one transaction each. Sessionless
+#      reviews have no owner and stay unattributed unless a user is named
+#      for them.
+#   2. every user's UserCardState rows are rebuilt by replaying their
+#      reviews of each card in order with Card.add_review's transitions.
+#
+# Both steps are idempotent, so the job can be interrupted and rerun. Run it
+# before serving traffic on the new schema: until then every user's cards
+# look unreviewed to the scheduler. The same replay rebuilds Card's card-wide
+# columns after bulk imports (bulk_load.py).
+
+BATCH_SIZE = 10000  # review ids per transaction
+YIELD_PER = 5000
+
+
+def _attribute(model, sessionless_user_id, batch_size):
+    owner = select(Session.user_id).where(Session.id == model.session_id).scalar_subquery()
+    max_id = db.session.scalar(select(func.max(model.id))) or 0
+    attributed = 0
+    for start in range(0, max_id, batch_size):
+        batch = (model.id > start, model.id <= start + batch_size, model.user_id == None)
+        attributed += db.session.execute(
+            update(model).where(*batch, model.session_id != None).values(user_id=owner)
+            .execution_options(synchronize_session=False)).rowcount
+        if sessionless_user_id is not None:
+            attributed += db.session.execute(
+                update(model).where(*batch, model.session_id == None).values(user_id=sessionless_user_id)
+                .execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+    return attributed
+
+
+def _replay(condition):
+    # card id -> replayed state over the review log rows matching condition
+    log = review_log()
+    states = {}
+    for card_id, timestamp, rating in db.session.execute(
+            select(log.c.card_id, log.c.timestamp, log.c.rating)
+            .where(condition(log))
+            .order_by(log.c.card_id, log.c.timestamp, log.c.id)
+            .execution_options(yield_per=YIELD_PER)):
+        state = states.get(card_id)
+        if state is None:
+            state = states[card_id] = {'card_id': card_id, 'mature_streak': 0, 'is_mature': False,
+                                       'last_wrong': None}
+        state['mature_streak'], state['is_mature'], state['last_wrong'] = apply_srs_transition(
+            state['mature_streak'], state['is_mature'], state['last_wrong'], rating, timestamp)
+    return states
+
+
+def rebuild_card_states(card_ids):
+    # Card's streak/maturity/last_wrong over every user's reviews
+    for chunk in chunks(card_ids):
+        states = _replay(lambda log: log.c.card_id.in_(chunk))
+        empty = {'mature_streak': 0, 'is_mature': False, 'last_wrong': None}
+        rows = [{f'b_{key}': value for key, value in {**empty, **states.get(card_id, {}), 'card_id': card_id}.items()}
+                for card_id in chunk]
+        db.session.execute(
+            update(Card.__table__).where(Card.__table__.c.id == bindparam('b_card_id'))
+            .values(mature_streak=bindparam('b_mature_streak'), is_mature=bindparam('b_is_mature'),
+                    last_wrong=bindparam('b_last_wrong')),
+            rows)
+        db.session.commit()
+
+
+def rebuild_user_card_states(user_id):
+    states = _replay(lambda log: log.c.user_id == user_id)
+    for state in states.values():
+        state.update(user_id=user_id, archived_successes=0, archived_failures=0)
+
+    for card_id, successes, failures in db.session.execute(
+            select(ReviewArchive.card_id,
+                   func.sum(case((ReviewArchive.rating >= 7, 1), else_=0)),
+                   func.sum(case((ReviewArchive.rating < 7, 1), else_=0)))
+            .where(ReviewArchive.user_id == user_id)
+            .group_by(ReviewArchive.card_id)):
+        states[card_id]['archived_successes'] = successes
+        states[card_id]['archived_failures'] = failures
+
+    db.session.execute(delete(UserCardState).where(UserCardState.user_id == user_id))
+    if states:
+        db.session.execute(UserCardState.__table__.insert(), list(states.values()))
+    db.session.commit()
+    return len(states)
+
+
+def attribute_reviews(sessionless_user=None, batch_size=BATCH_SIZE):
+    sessionless_user_id = None
+    if sessionless_user is not None:
+        sessionless_user_id = db.session.scalar(select(User.id).where(User.username == sessionless_user))
+        if sessionless_user_id is None:
+            raise ValueError(f"User not found: {sessionless_user}")
+
+    for model in (Review, ReviewArchive):
+        attributed = _attribute(model, sessionless_user_id, batch_size)
+        print(f"Attributed {attributed} rows of {model.__tablename__}")
+    unattributed = db.session.scalar(select(func.count(Review.id)).where(Review.user_id == None))
+    if unattributed:
+        print(f"{unattributed} sessionless reviews left without a user")
+
+    for user_id in list(db.session.scalars(select(User.id).order_by(User.id))):
+        count = rebuild_user_card_states(user_id)
+        print(f"Rebuilt {count} card states of user {user_id}")
+
+    # Other workers reload their cached card states on the version change
+    db.session.execute(update(Deck).values(version=func.coalesce(Deck.version, 0) + 1)
+                       .execution_options(synchronize_session=False))
+    db.session.commit()
@@ -0,0 +1,133 @@
+from models import db, Card, Deck, Review, ReviewArchive, UserCardState, chunks, deck_cards
+from search import matching_card_ids
+from rollups import remove_card_reviews, move_card_reviews
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, literal, select
+
+# ------------------- BULK CARD OPERATIONS -------------------
+#
+# Delete, move and copy any number of a deck's cards, and clone whole decks,
+# with a handful of set-based statements in a single transaction. Cards are
+# selected by explicit ids or by a filter, always within the source deck.
+#
+# Copies are new, independent cards with a fresh review history; they record
+# the card they were copied from in Card.cloned_from. Moving only re-links
+# cards, so their history goes with them.
+
+
+class BulkSelectionError(ValueError):
+    pass
+
+
+def select_card_ids(deck_id, ids=None, filters=None):
+    # SELECT of the selected card ids. Either ids or filters is required, so
+    # an empty request body can't select a whole deck by accident; use an
+    # empty filter ({}) for that.
+    if ids is None and filters is None:
+        raise BulkSelectionError("Provide 'ids' or 'filter'")
+
+    selection = select(deck_cards.c.card_id).where(deck_cards.c.deck_id == deck_id)
+    if ids is not None:
+        try:
+            ids = [int(card_id) for card_id in ids]
+        except (TypeError, ValueError):
+            raise BulkSelectionError("'ids' must be a list of card ids")
+        selection = selection.where(deck_cards.c.card_id.in_(ids))
+
+    filters = filters or {}
+    unknown = set(filters) - {'mature', 'type', 'reviewed', 'added_before', 'added_after', 'query'}
+    if unknown:
+        raise BulkSelectionError(f"Unknown filters: {', '.join(sorted(unknown))}")
+
+    if any(key in filters for key in ('mature', 'type', 'added_before', 'added_after')):
+        selection = selection.join(Card, Card.id == deck_cards.c.card_id)
+    if 'mature' in filters:
+        selection = selection.where(func.coalesce(Card.is_mature, False) == bool(filters['mature']))
+    if 'type' in filters:
+        selection = selection.where(Card.card_type == filters['type'])
+    for key, compare in (('added_before', Card.date_added.__lt__), ('added_after', Card.date_added.__ge__)):
+        if key in filters:
+            try:
+                selection = selection.where(compare(datetime.fromisoformat(filters[key])))
+            except (TypeError, ValueError):
+                raise BulkSelectionError(f"'{key}' must be an ISO timestamp")
+    if 'reviewed' in filters:
+        reviewed = select(Review.card_id).where(Review.card_id == deck_cards.c.card_id).exists()
+        selection = selection.where(reviewed if filters['reviewed'] else ~reviewed)
+    if filters.get('query'):
+        selection = selection.where(deck_cards.c.card_id.in_(matching_card_ids(filters['query'])))
+    return selection
+
+
+def _decks_containing(card_ids):
+    deck_ids = set()
+    for chunk in chunks(card_ids):
+        deck_ids.update(db.session.scalars(
+            select(deck_cards.c.deck_id).where(deck_cards.c.card_id.in_(chunk)).distinct()))
+    return deck_ids
+
+
+def delete_cards(deck_id, selection):
+    # Same semantics as deleting a single card: the cards, their reviews and
+    # their membership of every deck are removed, and the reviews' counts
+    # leave the rollups. Returns (card ids, affected deck ids).
+    card_ids = list(db.session.scalars(selection))
+    deck_ids = _decks_containing(card_ids)
+    for chunk in chunks(card_ids):
+        remove_card_reviews(chunk)
+        db.session.execute(delete(Review).where(Review.card_id.in_(chunk)))
+        db.session.execute(delete(ReviewArchive).where(ReviewArchive.card_id.in_(chunk)))
+        db.session.execute(delete(UserCardState).where(UserCardState.card_id.in_(chunk)))
+        db.session.execute(delete(deck_cards).where(deck_cards.c.card_id.in_(chunk)))
+        db.session.execute(delete(Card).where(Card.id.in_(chunk)))
+    Deck.bump_version(list(deck_ids))
+    return card_ids, deck_ids
+
+
+def move_cards(deck_id, target_id, selection):
+    # Re-link into the target deck (skipping cards already there), then
+    # unlink from the source; the cards' reviews now count towards the
+    # target's rollups. Returns the number of cards moved.
+    selected = selection.subquery()
+    already_in_target = select(deck_cards.c.card_id).where(deck_cards.c.deck_id == target_id)
+    card_ids = list(db.session.scalars(select(selected.c.card_id)))
+    present = set()
+    for chunk in chunks(card_ids):
+        present.update(db.session.scalars(already_in_target.where(deck_cards.c.card_id.in_(chunk))))
+    for chunk in chunks(card_ids):
+        move_card_reviews(chunk, deck_id, target_id, [card_id for card_id in chunk if card_id not in present])
+    db.session.execute(insert(deck_cards).from_select(
+        ['deck_id', 'card_id'],
+        select(literal(target_id), selected.c.card_id).where(selected.c.card_id.not_in(already_in_target))))
+    moved = db.session.execute(delete(deck_cards).where(
+        deck_cards.c.deck_id == deck_id,
+        deck_cards.c.card_id.in_(select(selected.c.card_id)))).rowcount
+    Deck.bump_version([deck_id, target_id])
+    return moved
+
+
+def copy_cards(deck_id, target_id, selection):
+    # INSERT ... SELECT the card rows, RETURNING the new ids, then link those
+    # rows into the target deck. Returns the number of copies.
+    source = select(
+        Card.front, Card.back, Card.front_image, Card.back_image,
+        Card.front_thumbnail, Card.back_thumbnail, Card.card_type,
+        literal(datetime.now()), literal(0), literal(False), Card.id,
+    ).where(Card.id.in_(selection)).order_by(Card.id)
+    copy_ids = list(db.session.scalars(insert(Card).from_select(
+        ['front', 'back', 'front_image', 'back_image', 'front_thumbnail', 'back_thumbnail',
+         'card_type', 'date_added', 'mature_streak', 'is_mature', 'cloned_from'], source)
+        .returning(Card.id)))
+    for chunk in chunks(sorted(copy_ids)):
+        db.session.execute(insert(deck_cards), [{'deck_id': target_id, 'card_id': card_id} for card_id in chunk])
+    Deck.bump_version([target_id])
+    return len(copy_ids)
+
+
+def clone_deck(deck_id, name):
+    clone = Deck(name=name)
+    db.session.add(clone)
+    db.session.flush()
+    copied = copy_cards(deck_id, clone.id, select(deck_cards.c.card_id).where(deck_cards.c.deck_id == deck_id))
+    return clone, copied
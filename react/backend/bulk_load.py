@@ -0,0 +1,230 @@
+from models import db, User, Deck, Card, Review, chunks, deck_cards
+from attribution import rebuild_card_states, rebuild_user_card_states
+from bulk import delete_cards
+from card_cache import load_card_states
+from rollups import rebuild_rollups
+from datetime import datetime, timedelta
+from time import perf_counter
+import csv
+import io
+import random
+
+from sqlalchemy import delete, func, select, text
+
+# ------------------- BULK LOAD -------------------
+#
+# Imports of many cards or reviews at once. On PostgreSQL rows are streamed
+# with COPY ... FROM STDIN (psycopg2 or psycopg 3) in COPY_BATCH chunks;
+# other databases get a multi-row executemany INSERT. Each import is one
+# transaction.
+#
+# Imported reviews can land anywhere in a card's history, so afterwards the
+# derived state is rebuilt from the review log: Card's SRS columns for the
+# touched cards, UserCardState for the touched users, and the rollups.
+
+COPY_BATCH = 10000
+REVIEW_COLUMNS = ('card_id', 'user_id', 'session_id', 'timestamp', 'rating')
+
+
+def _copy_sql(dialect, table, columns):
+    quote = dialect.identifier_preparer
+    return (f"COPY {quote.format_table(table)} ({', '.join(quote.quote(column) for column in columns)}) "
+            f"FROM STDIN WITH (FORMAT csv)")
+
+
+def copy_rows(table, columns, rows):
+    # rows: tuples in column order. Returns the number of rows written.
+    connection = db.session.connection()
+    if connection.dialect.name != 'postgresql':
+        count = 0
+        batch = []
+        for row in rows:
+            batch.append(dict(zip(columns, row)))
+            if len(batch) == COPY_BATCH:
+                connection.execute(table.insert(), batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            connection.execute(table.insert(), batch)
+            count += len(batch)
+        return count
+
+    sql = _copy_sql(connection.dialect, table, columns)
+    cursor = connection.connection.dbapi_connection.cursor()
+    count = 0
+    try:
+        buffer = io.StringIO()
+        for i, row in enumerate(rows, start=1):
+            buffer.write(','.join(_csv_field(value) for value in row) + '\n')
+            if i % COPY_BATCH == 0:
+                _copy(cursor, sql, buffer.getvalue())
+                buffer = io.StringIO()
+            count = i
+        if buffer.tell():
+            _copy(cursor, sql, buffer.getvalue())
+    finally:
+        cursor.close()
+    return count
+
+
+def _csv_field(value):
+    # COPY's CSV format reads an unquoted empty field as NULL and a quoted
+    # one as an empty string, so None is left empty and every string quoted.
+    # (The csv module can't do both: QUOTE_NONNUMERIC quotes None as "".)
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        value = value.isoformat(' ')
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    return str(value)
+
+
+def _copy(cursor, sql, data):
+    if hasattr(cursor, 'copy_expert'):  # psycopg2
+        cursor.copy_expert(sql, io.StringIO(data))
+    else:  # psycopg 3
+        with cursor.copy(sql) as copy:
+            copy.write(data)
+
+
+def _reserve_card_ids(count):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return list(db.session.scalars(
+            text("SELECT nextval(pg_get_serial_sequence('card', 'id')) FROM generate_series(1, :n)"),
+            {'n': count}))
+    # Elsewhere ids follow the current maximum; the import's transaction
+    # fails if a concurrent insert takes one of them first
+    start = (db.session.scalar(select(func.max(Card.id))) or 0) + 1
+    return list(range(start, start + count))
+
+
+def import_cards(deck_id, rows):
+    # rows: dicts with front, back and optionally type. Returns the new ids.
+    rows = list(rows)
+    for line, row in enumerate(rows, start=1):
+        if not row.get('front') or not row.get('back'):
+            raise ValueError(f"Row {line}: front and back are required")
+
+    card_ids = _reserve_card_ids(len(rows))
+    now = datetime.now()
+    copy_rows(Card.__table__,
+              ('id', 'front', 'back', 'card_type', 'date_added', 'mature_streak', 'is_mature',
+               'archived_successes', 'archived_failures'),
+              ((card_id, row['front'], row['back'], row.get('type') or 'Basic', now, 0, False, 0, 0)
+               for card_id, row in zip(card_ids, rows)))
+    copy_rows(deck_cards, ('deck_id', 'card_id'), ((deck_id, card_id) for card_id in card_ids))
+    Deck.bump_version([deck_id])
+    db.session.commit()
+    return card_ids
+
+
+def _user_ids(usernames):
+    # Creates users that don't exist yet, like the review endpoint does
+    known = dict(db.session.execute(select(User.username, User.id).where(User.username.in_(usernames))).all())
+    for username in set(usernames) - set(known):
+        user = User(username=username)
+        db.session.add(user)
+        db.session.flush()
+        known[username] = user.id
+    return known
+
+
+def _parse_review(line, row):
+    try:
+        card_id = int(row['card_id'])
+        rating = int(row['rating'])
+        timestamp = row['timestamp']
+        if not isinstance(timestamp, datetime):
+            timestamp = datetime.fromisoformat(timestamp)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Row {line}: {str(e)}")
+    if not 0 <= rating <= 10:
+        raise ValueError(f"Row {line}: rating must be 0-10")
+    if not row.get('user'):
+        raise ValueError(f"Row {line}: user is required")
+    return card_id, row['user'], row.get('session_id') or None, timestamp, rating
+
+
+def import_reviews(rows, rebuild=True):
+    # rows: dicts with card_id, user (username), timestamp, rating and
+    # optionally session_id. Returns the number of reviews imported.
+    parsed = [_parse_review(line, row) for line, row in enumerate(rows, start=1)]
+    card_ids = sorted({card_id for card_id, *_ in parsed})
+    existing, touched_decks = set(), set()
+    for chunk in chunks(card_ids):
+        existing.update(db.session.scalars(select(Card.id).where(Card.id.in_(chunk))))
+        touched_decks.update(db.session.scalars(
+            select(deck_cards.c.deck_id).where(deck_cards.c.card_id.in_(chunk)).distinct()))
+    missing = [card_id for card_id in card_ids if card_id not in existing]
+    if missing:
+        raise ValueError(f"Unknown card ids: {missing[:10]}")
+
+    users = _user_ids({username for _, username, *_ in parsed})
+    count = copy_rows(Review.__table__, REVIEW_COLUMNS,
+                      ((card_id, users[username], session_id, timestamp, rating)
+                       for card_id, username, session_id, timestamp, rating in parsed))
+    Deck.bump_version(list(touched_decks))
+    for user_id in set(users.values()):
+        User.bump_version(user_id)
+    db.session.commit()
+
+    if rebuild:
+        rebuild_card_states(card_ids)
+        for user_id in sorted(set(users.values())):
+            rebuild_user_card_states(user_id)
+        rebuild_rollups()
+    return count
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+# ------------------- BENCHMARK -------------------
+
+def benchmark_import(n_cards=10000, n_reviews=100000, seed=0):
+    # Bulk import and read throughput against the configured database, in a
+    # scratch deck and user that are removed afterwards. Derived state is not
+    # rebuilt, so nothing else changes. Run once per DATABASE_URL to compare
+    # backends.
+    rng = random.Random(seed)
+    stamp = datetime.now().strftime('%Y%m%d%H%M%S%f')
+    deck = Deck(name=f"_bench_{stamp}")
+    username = f"_bench_{stamp}"
+    db.session.add(deck)
+    db.session.commit()
+    results = {'dialect': db.session.get_bind().dialect.name, 'cards': n_cards, 'reviews': n_reviews}
+
+    try:
+        start = perf_counter()
+        card_ids = import_cards(deck.id, ({'front': f"front {i}", 'back': f"back {i}"} for i in range(n_cards)))
+        results['cards_per_s'] = n_cards / (perf_counter() - start)
+
+        base = datetime.now() - timedelta(days=365)
+        reviews = [{'card_id': rng.choice(card_ids), 'user': username, 'rating': rng.randint(0, 10),
+                    'timestamp': base + timedelta(minutes=rng.randint(0, 365 * 24 * 60))}
+                   for _ in range(n_reviews)]
+        start = perf_counter()
+        import_reviews(reviews, rebuild=False)
+        results['reviews_per_s'] = n_reviews / (perf_counter() - start)
+
+        user_id = db.session.scalar(select(User.id).where(User.username == username))
+        start = perf_counter()
+        load_card_states(deck_id=deck.id, user_id=user_id)
+        results['deck_state_load_ms'] = (perf_counter() - start) * 1000
+
+        start = perf_counter()
+        streamed = sum(1 for _ in db.session.execute(
+            select(Review.id, Review.card_id, Review.timestamp, Review.rating)
+            .where(Review.user_id == user_id)
+            .execution_options(yield_per=COPY_BATCH)))
+        results['streamed_reviews_per_s'] = streamed / (perf_counter() - start)
+    finally:
+        db.session.rollback()
+        delete_cards(deck.id, select(deck_cards.c.card_id).where(deck_cards.c.deck_id == deck.id))
+        db.session.execute(delete(Deck).where(Deck.id == deck.id))
+        db.session.execute(delete(User).where(User.username == username))
+        db.session.commit()
+    return results
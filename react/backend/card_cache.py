@@ -0,0 +1,346 @@
+from models import db, Card, Deck, Review, UserCardState, apply_srs_transition, deck_cards
+from scheduling import DeckState
+from collections import OrderedDict, deque, namedtuple
+from datetime import datetime
+import os
+import sys
+import threading
+import time
+
+from sqlalchemy import and_, case, func, select
+
+# ------------------- CARD STATE CACHE -------------------
+#
+# Per-worker LRU cache of the compact state the scheduler needs for each
+# (user, card) (posterior counts, the last few ratings, streak, maturity,
+# dates) plus each deck's card ids and, per user, its DeckState arrays. A warm
+# deck is scheduled without touching the database.
+#
+# The review path writes through (the cached record is updated the same way
+# Card.add_review updates the user's row); card creation and deletes drop the
+# affected entries of every user, and content edits, which don't change any
+# scheduling state, keep them. Other workers' writes are picked up when a deck
+# entry is older than REVALIDATE_SECONDS and its Deck.version no longer matches.
+
+MAX_BYTES = int(float(os.environ.get('CARD_CACHE_MB', 64)) * 1024 * 1024)
+REVALIDATE_SECONDS = float(os.environ.get('CARD_CACHE_REVALIDATE_SECONDS', 30))
+WINDOW = 5  # adaptive_decay's default history_window
+BATCH_LOAD_THRESHOLD = 500  # above this many missing cards, reload the whole deck
+
+_Obs = namedtuple('_Obs', 'timestamp rating review_id', defaults=(None,))
+_OBS_SIZE = sys.getsizeof(_Obs(None, 0, 0)) + sys.getsizeof(datetime.now()) + 2 * sys.getsizeof(10)
+
+
+class CardState:
+    # Stands in for Card wherever the scheduler reads a card
+    __slots__ = ('id', 'successes', 'failures', 'reviews', 'mature_streak',
+                 'is_mature', 'last_wrong', 'date_added', 'last_review')
+
+    def __init__(self, id, successes, failures, recent, mature_streak, is_mature,
+                 last_wrong, date_added):
+        self.id = id
+        self.successes = successes
+        self.failures = failures
+        self.reviews = deque(recent, maxlen=WINDOW)  # oldest first
+        self.mature_streak = mature_streak or 0
+        self.is_mature = bool(is_mature)
+        self.last_wrong = last_wrong
+        self.date_added = date_added
+        self.last_review = self.reviews[-1].timestamp if self.reviews else None
+
+    def outcome_counts(self):
+        return self.successes, self.failures
+
+    def review_count(self):
+        return self.successes + self.failures
+
+    def time_since_added(self):
+        return (datetime.now() - self.date_added).total_seconds() / 60
+
+    def applied(self, review_id):
+        # Whether the recent window already holds the review
+        return review_id is not None and any(obs.review_id == review_id for obs in self.reviews)
+
+    def apply_review(self, rating, timestamp, review_id=None):
+        # Same transitions as Card.add_review
+        self.reviews.append(_Obs(timestamp, rating, review_id))
+        self.last_review = timestamp
+        self.mature_streak, self.is_mature, self.last_wrong = apply_srs_transition(
+            self.mature_streak, self.is_mature, self.last_wrong, rating, timestamp)
+        if rating >= 7:
+            self.successes += 1
+        else:
+            self.failures += 1
+
+    def size(self):
+        return sys.getsizeof(self) + sys.getsizeof(self.reviews) + len(self.reviews) * _OBS_SIZE + 3 * 48
+
+
+class _DeckEntry:
+    __slots__ = ('card_ids', 'version', 'checked_at', 'arrays')
+
+    def __init__(self, card_ids, version):
+        self.card_ids = card_ids
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.arrays = {}  # user id -> DeckState, built on first use
+
+    def size(self):
+        size = sys.getsizeof(self) + sys.getsizeof(self.card_ids) + len(self.card_ids) * 28
+        return size + sum(arrays.size() for arrays in self.arrays.values())
+
+
+def load_card_states(card_ids=None, deck_id=None, user_id=None):
+    # Three aggregate queries; no ORM objects, no image columns. Whole decks
+    # are selected through deck_cards rather than a huge IN list. With a
+    # user, the states are that user's (UserCardState and their reviews, on
+    # the user-leading indexes); without one, the card-wide Card columns.
+    if deck_id is not None:
+        members = select(deck_cards.c.card_id).where(deck_cards.c.deck_id == deck_id)
+    elif card_ids:
+        members = list(card_ids)
+    else:
+        return {}
+
+    if user_id is None:
+        cards = (db.session.query(Card.id, Card.mature_streak, Card.is_mature, Card.last_wrong, Card.date_added,
+                                  Card.archived_successes, Card.archived_failures)
+                 .filter(Card.id.in_(members)).all())
+        reviewed = [Review.card_id.in_(members)]
+    else:
+        cards = (db.session.query(Card.id, UserCardState.mature_streak, UserCardState.is_mature,
+                                  UserCardState.last_wrong, Card.date_added,
+                                  UserCardState.archived_successes, UserCardState.archived_failures)
+                 .outerjoin(UserCardState, and_(UserCardState.card_id == Card.id, UserCardState.user_id == user_id))
+                 .filter(Card.id.in_(members)).all())
+        reviewed = [Review.user_id == user_id, Review.card_id.in_(members)]
+    counts = dict((card_id, (successes or 0, total - (successes or 0))) for card_id, total, successes in
+                  db.session.query(Review.card_id, func.count(Review.id),
+                                   func.sum(case((Review.rating >= 7, 1), else_=0)))
+                  .filter(*reviewed)
+                  .group_by(Review.card_id))
+
+    position = func.row_number().over(partition_by=Review.card_id,
+                                      order_by=(Review.timestamp.desc(), Review.id.desc())).label('position')
+    ranked = (db.session.query(Review.id, Review.card_id, Review.timestamp, Review.rating, position)
+              .filter(*reviewed)
+              .subquery())
+    recent = {}
+    for review_id, card_id, timestamp, rating, _ in (db.session.query(ranked)
+                                             .filter(ranked.c.position <= WINDOW)
+                                             .order_by(ranked.c.card_id, ranked.c.timestamp, ranked.c.id)):
+        recent.setdefault(card_id, []).append(_Obs(timestamp, rating, review_id))
+
+    states = {}
+    for card_id, mature_streak, is_mature, last_wrong, date_added, archived_successes, archived_failures in cards:
+        # Reviews archived by compaction.py only survive as counts
+        successes, failures = counts.get(card_id, (0, 0))
+        states[card_id] = CardState(card_id, successes + (archived_successes or 0), failures + (archived_failures or 0),
+                                    recent.get(card_id, ()), mature_streak, is_mature, last_wrong, date_added)
+    return states
+
+
+class CardStateCache:
+    def __init__(self, max_bytes=MAX_BYTES, revalidate_seconds=REVALIDATE_SECONDS):
+        self.max_bytes = max_bytes
+        self.revalidate_seconds = revalidate_seconds
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._deck_ids = {}  # deck name -> id; decks are never renamed
+        self._card_users = {}  # card id -> ids of users with a cached state for it
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    # --- LRU primitives ---
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _put(self, key, value):
+        self._drop(key)
+        size = value.size()
+        self._entries[key] = (value, size)
+        self._bytes += size
+        if key[0] == 'card':
+            self._card_users.setdefault(key[2], set()).add(key[1])
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            evicted_key, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self._forget(evicted_key)
+            self.evictions += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+            self._forget(key)
+        return entry is not None
+
+    def _forget(self, key):
+        if key[0] == 'card':
+            users = self._card_users.get(key[2])
+            if users is not None:
+                users.discard(key[1])
+                if not users:
+                    del self._card_users[key[2]]
+
+    def _drop_card(self, card_id):
+        # Every user's state for the card
+        dropped = False
+        for user_id in list(self._card_users.get(card_id, ())):
+            dropped = self._drop(('card', user_id, card_id)) or dropped
+        return dropped
+
+    # --- reads ---
+
+    def deck_id(self, name):
+        with self._lock:
+            deck_id = self._deck_ids.get(name)
+            if deck_id is None:
+                deck_id = db.session.query(Deck.id).filter_by(name=name).scalar()
+                if deck_id is not None:
+                    self._deck_ids[name] = deck_id
+            return deck_id
+
+    def _deck_entry(self, deck_id):
+        entry = self._get(('deck', deck_id))
+        if entry is not None and time.monotonic() - entry.checked_at > self.revalidate_seconds:
+            version = db.session.query(Deck.version).filter_by(id=deck_id).scalar()
+            if version == entry.version:
+                entry.checked_at = time.monotonic()
+            else:
+                # Changed by another worker: reload the deck and its cards
+                for card_id in entry.card_ids:
+                    self._drop_card(card_id)
+                self._drop(('deck', deck_id))
+                entry = None
+        if entry is None:
+            self.misses += 1
+            version = db.session.query(Deck.version).filter_by(id=deck_id).scalar()
+            card_ids = tuple(card_id for (card_id,) in db.session.query(deck_cards.c.card_id)
+                             .filter(deck_cards.c.deck_id == deck_id))
+            entry = _DeckEntry(card_ids, version)
+            self._put(('deck', deck_id), entry)
+        else:
+            self.hits += 1
+        return entry
+
+    def deck_states(self, deck_id, user_id):
+        with self._lock:
+            entry = self._deck_entry(deck_id)
+            states = {}
+            missing = []
+            for card_id in entry.card_ids:
+                state = self._get(('card', user_id, card_id))
+                if state is None:
+                    missing.append(card_id)
+                else:
+                    states[card_id] = state
+            self.hits += len(states)
+            self.misses += len(missing)
+            if len(missing) > BATCH_LOAD_THRESHOLD:
+                loaded = load_card_states(deck_id=deck_id, user_id=user_id)
+            else:
+                loaded = load_card_states(missing, user_id=user_id)
+            for card_id, state in loaded.items():
+                self._put(('card', user_id, card_id), state)
+                states[card_id] = state
+            return [states[card_id] for card_id in entry.card_ids if card_id in states]
+
+    def deck_state(self, deck_id, user_id):
+        with self._lock:
+            entry = self._deck_entry(deck_id)
+            arrays = entry.arrays.get(user_id)
+            if arrays is None:
+                arrays = entry.arrays[user_id] = DeckState(self.deck_states(deck_id, user_id))
+                self._put(('deck', deck_id), entry)  # re-account its size
+            return arrays
+
+    def card_state(self, card_id, user_id):
+        with self._lock:
+            state = self._get(('card', user_id, card_id))
+            if state is not None:
+                self.hits += 1
+                return state
+            self.misses += 1
+            state = load_card_states([card_id], user_id=user_id).get(card_id)
+            if state is not None:
+                self._put(('card', user_id, card_id), state)
+            return state
+
+    # --- writes ---
+
+    def record_review(self, card_id, user_id, review_id, rating, timestamp, deck_ids=()):
+        # Write-through after the review has been committed. A request that
+        # missed the cache between the commit and this call has already
+        # loaded the review from the database, so it isn't applied twice.
+        with self._lock:
+            state = self._get(('card', user_id, card_id))
+            if state is not None and not state.applied(review_id):
+                state.apply_review(rating, timestamp, review_id)
+                self._put(('card', user_id, card_id), state)  # window grew, re-account its size
+            self.note_deck_write(deck_ids)
+            self._note_card_write(deck_ids, user_id, state)
+
+    def note_deck_write(self, deck_ids):
+        # Our own write bumped these Deck.versions by one; follow along so the
+        # next revalidation doesn't mistake it for another worker's change
+        with self._lock:
+            for deck_id in deck_ids:
+                entry = self._get(('deck', deck_id))
+                if entry is not None and entry.version is not None:
+                    entry.version += 1
+
+    def _note_card_write(self, deck_ids, user_id, state=None):
+        # Only the reviewing user's arrays change
+        for deck_id in deck_ids:
+            entry = self._get(('deck', deck_id))
+            if entry is None:
+                continue
+            arrays = entry.arrays.get(user_id)
+            if arrays is not None:
+                if state is not None:
+                    arrays.update(state)
+                else:
+                    del entry.arrays[user_id]  # card wasn't cached, rebuild on next use
+
+    def invalidate_card(self, card_id, deck_ids=()):
+        with self._lock:
+            if self._drop_card(card_id):
+                self.invalidations += 1
+            for deck_id in deck_ids:
+                if self._drop(('deck', deck_id)):
+                    self.invalidations += 1
+
+    def invalidate_cards(self, card_ids, deck_ids=()):
+        with self._lock:
+            for card_id in card_ids:
+                self.invalidate_card(card_id)
+            for deck_id in deck_ids:
+                self.invalidate_deck(deck_id)
+
+    def invalidate_deck(self, deck_id):
+        with self._lock:
+            if self._drop(('deck', deck_id)):
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+card_cache = CardStateCache()
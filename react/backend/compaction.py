@@ -0,0 +1,135 @@
+from models import db, Card, Review, ReviewArchive, UserCardState, chunks
+from card_cache import WINDOW, load_card_states
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, literal, select, union_all, update
+
+# ------------------- REVIEW COMPACTION -------------------
+#
+# The scheduler only needs each (user, card)'s success/failure counts, its
+# last few reviews and the time of its last review. `flask compact-reviews`
+# moves reviews older than the retention horizon into review_archive and
+# folds their outcomes into the archived_successes/archived_failures of Card
+# and of the reviewer's UserCardState, always leaving the newest KEEP_RECENT
+# reviews of each user of a card in place. Cards are processed in id-ordered
+# batches, one transaction each; every batch checks that the scheduler's
+# inputs for its cards, card-wide and per user, are unchanged before
+# committing.
+#
+# Jobs that need the full history (rollup rebuilds, replay, the decay fit,
+# session charts) read review_log(), the union of both tables.
+
+RETENTION_DAYS = 365
+KEEP_RECENT = WINDOW  # adaptive_decay's default history_window
+BATCH_SIZE = 500  # cards per transaction
+
+
+def review_log():
+    # Live and archived reviews, with the Review columns
+    columns = ('id', 'card_id', 'user_id', 'session_id', 'timestamp', 'rating')
+    return union_all(
+        select(*[Review.__table__.c[name] for name in columns]),
+        select(*[ReviewArchive.__table__.c[name] for name in columns]),
+    ).subquery('review_log')
+
+
+def _scheduler_inputs(state):
+    return (state.outcome_counts(), list(state.reviews), state.last_review,
+            state.mature_streak, state.is_mature, state.last_wrong)
+
+
+def _snapshot(card_ids, user_ids):
+    # Scheduler inputs keyed by (user id or None for card-wide, card id)
+    states = {(None, card_id): _scheduler_inputs(state) for card_id, state in load_card_states(card_ids).items()}
+    for user_id in user_ids:
+        states.update(((user_id, card_id), _scheduler_inputs(state))
+                      for card_id, state in load_card_states(card_ids, user_id=user_id).items())
+    return states
+
+
+def _archive(review_ids, archived_at):
+    stale = Review.id.in_(review_ids)
+    db.session.execute(ReviewArchive.__table__.insert().from_select(
+        ['id', 'card_id', 'user_id', 'session_id', 'timestamp', 'rating', 'archived_at'],
+        select(Review.id, Review.card_id, Review.user_id, Review.session_id, Review.timestamp, Review.rating,
+               literal(archived_at, db.DateTime)).where(stale)))
+
+    def outcomes(condition):
+        return (select(func.count(Review.id))
+                .where(Review.card_id == Card.id, stale, condition)
+                .scalar_subquery())
+
+    db.session.execute(
+        update(Card)
+        .where(Card.id.in_(select(Review.card_id).where(stale)))
+        .values(archived_successes=func.coalesce(Card.archived_successes, 0) + outcomes(Review.rating >= 7),
+                archived_failures=func.coalesce(Card.archived_failures, 0) + outcomes(Review.rating < 7))
+        .execution_options(synchronize_session=False))
+
+    # Every attributed review has its user's UserCardState row
+    def user_outcomes(condition):
+        return (select(func.count(Review.id))
+                .where(Review.user_id == UserCardState.user_id, Review.card_id == UserCardState.card_id,
+                       stale, condition)
+                .scalar_subquery())
+
+    db.session.execute(
+        update(UserCardState)
+        .where(select(Review.id).where(Review.user_id == UserCardState.user_id,
+                                       Review.card_id == UserCardState.card_id, stale).exists())
+        .values(archived_successes=UserCardState.archived_successes + user_outcomes(Review.rating >= 7),
+                archived_failures=UserCardState.archived_failures + user_outcomes(Review.rating < 7))
+        .execution_options(synchronize_session=False))
+    db.session.execute(Review.__table__.delete().where(stale))
+
+
+def compact_reviews(retention_days=RETENTION_DAYS, keep_recent=KEEP_RECENT, batch_size=BATCH_SIZE):
+    if retention_days < 1:
+        raise ValueError("retention_days must be at least 1")  # today's reviews feed the rollup checks
+    if keep_recent < KEEP_RECENT:
+        raise ValueError(f"keep_recent must be at least {KEEP_RECENT}")
+
+    archived_at = datetime.now()
+    horizon = archived_at - timedelta(days=retention_days)
+    archived = 0
+    last_card_id = 0
+
+    while True:
+        card_ids = list(db.session.scalars(
+            select(Card.id).where(Card.id > last_card_id).order_by(Card.id).limit(batch_size)))
+        if not card_ids:
+            break
+        last_card_id = card_ids[-1]
+
+        # Each user's window of a card is kept, as is the card-wide one (the
+        # newest reviews over all users are among those)
+        position = func.row_number().over(partition_by=(Review.card_id, Review.user_id),
+                                          order_by=(Review.timestamp.desc(), Review.id.desc())).label('position')
+        ranked = (select(Review.id, Review.user_id, Review.timestamp, position)
+                  .where(Review.card_id >= card_ids[0], Review.card_id <= last_card_id)
+                  .subquery())
+        stale = db.session.execute(
+            select(ranked.c.id, ranked.c.user_id).where(ranked.c.position > keep_recent,
+                                                        ranked.c.timestamp < horizon)).all()
+        if not stale:
+            db.session.commit()
+            continue
+        stale_ids = [review_id for review_id, _ in stale]
+        user_ids = {user_id for _, user_id in stale if user_id is not None}
+
+        before = _snapshot(card_ids, user_ids)
+        for chunk in chunks(stale_ids):
+            _archive(chunk, archived_at)
+        after = _snapshot(card_ids, user_ids)
+
+        changed = sorted({key[1] for key, inputs in before.items() if after.get(key) != inputs})
+        if changed:
+            db.session.rollback()
+            raise RuntimeError(f"Compaction would change scheduling of cards {changed[:10]}; rolled back")
+
+        db.session.commit()
+        archived += len(stale_ids)
+        print(f"Archived {archived} reviews (cards up to id {last_card_id})")
+
+    print(f"Compaction done: {archived} reviews archived older than {horizon.isoformat()}")
+    return archived
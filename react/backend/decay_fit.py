@@ -0,0 +1,141 @@
+from models import db, User, Session
+from compaction import review_log
+from datetime import datetime
+from itertools import islice
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import bindparam, func, update
+
+# ------------------- OFFLINE DECAY FITTING -------------------
+#
+# Recall is modelled the same way sample_next_review assumes it: after an
+# interval of t minutes a card is recalled with probability exp(-decay * t).
+# Each review after the first one of a card is an observation (t, success),
+# where t is the gap since the previous review of the same card. The decay of
+# every user is fitted by maximum likelihood in one vectorized Newton solve.
+
+MIN_DECAY = 0.001   # same floor adaptive_decay uses
+MAX_DECAY = 5.0
+MIN_OBSERVATIONS = 10   # same threshold User.update_decay uses
+CHUNK_SIZE = 100000
+
+
+def load_review_intervals(chunk_size=CHUNK_SIZE):
+    # Stream (user, card, timestamp, rating) ordered by user, card and time,
+    # archived reviews included. Reviews not yet attributed by
+    # `flask attribute-reviews` fall back to their session's user.
+    reviews = review_log()
+    user_id = func.coalesce(reviews.c.user_id, Session.user_id)
+    query = (db.session.query(user_id, reviews.c.card_id, reviews.c.timestamp, reviews.c.rating)
+             .outerjoin(Session, reviews.c.session_id == Session.id)
+             .filter(user_id != None)
+             .order_by(user_id, reviews.c.card_id, reviews.c.timestamp)
+             .execution_options(yield_per=chunk_size))
+
+    user_ids, card_ids, minutes, ratings = [], [], [], []
+    rows = iter(query)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        u, c, t, r = zip(*chunk)
+        user_ids.append(np.asarray(u, dtype=np.int64))
+        card_ids.append(np.asarray(c, dtype=np.int64))
+        minutes.append(np.asarray(t, dtype='datetime64[us]').astype(np.int64) / 60e6)
+        ratings.append(np.asarray(r, dtype=np.int64))
+
+    if not user_ids:
+        return np.array([], dtype=np.int64), np.array([]), np.array([])
+
+    user_ids = np.concatenate(user_ids)
+    card_ids = np.concatenate(card_ids)
+    minutes = np.concatenate(minutes)
+    success = (np.concatenate(ratings) >= 7).astype(np.float64)
+
+    # An observation is a review whose predecessor is a review of the same card
+    # by the same user.
+    same = (card_ids[1:] == card_ids[:-1]) & (user_ids[1:] == user_ids[:-1])
+    dt = np.diff(minutes)[same]
+    keep = dt > 0
+    return user_ids[1:][same][keep], dt[keep], success[1:][same][keep]
+
+
+def fit_decay_mle(user_idx, dt, success, n_users, initial=0.03, max_iter=50, tol=1e-8):
+    # Newton iterations on the log-likelihood
+    #   success: -decay * t
+    #   failure: log(1 - exp(-decay * t))
+    # which is concave in decay, solved for all users at once.
+    decay = np.full(n_users, initial, dtype=np.float64)
+    failure = 1.0 - success
+
+    for _ in range(max_iter):
+        x = np.clip(decay[user_idx] * dt, 1e-12, 700)
+        inv = 1.0 / np.expm1(x)
+        grad_obs = -success * dt + failure * dt * inv
+        hess_obs = -failure * dt * dt * (inv + inv * inv)
+
+        grad = np.bincount(user_idx, weights=grad_obs, minlength=n_users)
+        hess = np.bincount(user_idx, weights=hess_obs, minlength=n_users)
+
+        # Users without failures have a likelihood that keeps increasing as
+        # decay goes to zero, so they are halved towards the floor instead.
+        curved = hess < 0
+        step = np.where(curved, -grad / np.where(curved, hess, -1.0), -decay / 2)
+        # Damp each step to at most a 4x change so Newton cannot oscillate
+        # between the bounds.
+        new_decay = np.clip(decay + step, decay / 4, decay * 4)
+        new_decay = np.clip(new_decay, MIN_DECAY, MAX_DECAY)
+
+        if np.max(np.abs(new_decay - decay)) < tol:
+            decay = new_decay
+            break
+        decay = new_decay
+
+    return decay
+
+
+def fit_all_users(commit=True):
+    user_ids, dt, success = load_review_intervals()
+    if user_ids.size == 0:
+        print("Decay fit: no reviews to fit")
+        return {}
+
+    unique_users, user_idx = np.unique(user_ids, return_inverse=True)
+    counts = np.bincount(user_idx, minlength=unique_users.size)
+    decay = fit_decay_mle(user_idx, dt, success, unique_users.size)
+
+    fitted_at = datetime.now()
+    fitted = {int(uid): float(d) for uid, d, n in zip(unique_users, decay, counts)
+              if n >= MIN_OBSERVATIONS}
+
+    if fitted and commit:
+        # The decay is part of the user's representation, so the same
+        # statement bumps User.version for the ETags
+        users = User.__table__
+        db.session.execute(
+            update(users).where(users.c.id == bindparam('user_id')).values(
+                global_decay=bindparam('decay'), decay_fitted_at=fitted_at,
+                version=func.coalesce(users.c.version, 0) + 1),
+            [{'user_id': uid, 'decay': d} for uid, d in fitted.items()])
+        db.session.commit()
+
+    print(f"Decay fit: {dt.size} intervals, {len(fitted)} users updated")
+    return fitted
+
+
+def start_decay_fit_scheduler(app, interval_hours):
+    def run():
+        while True:
+            time.sleep(interval_hours * 3600)
+            with app.app_context():
+                try:
+                    fit_all_users()
+                except Exception as e:
+                    print(f"Error in scheduled decay fit: {str(e)}")
+                    db.session.rollback()
+
+    thread = threading.Thread(target=run, name='decay-fit', daemon=True)
+    thread.start()
+    return thread
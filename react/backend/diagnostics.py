@@ -0,0 +1,156 @@
+from models import db, User, Deck, Card, Session, Review, ReviewArchive, SessionStats, deck_cards
+
+from sqlalchemy import func, select
+
+# ------------------- DIAGNOSTIC STREAMS -------------------
+#
+# The diagnostic endpoints stream one JSON object per line (NDJSON). Rows
+# come from plain column queries fetched in YIELD_PER batches, so memory
+# stays flat however large the database is, and every count is computed by
+# aggregate SQL rather than by loading relationships. Pagination is keyset
+# based: a page ends with {"type": "end", "next_after": <id>} when there is
+# more, and the next page is requested with ?after=<id>. Card image bodies are
+# only included with ?images=1; otherwise cards say whether they have one.
+
+YIELD_PER = 500
+MAX_LIMIT = 10000
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _page(query, id_column, after, limit):
+    if after is not None:
+        query = query.where(id_column > after)
+    query = query.order_by(id_column)
+    if limit is not None:
+        query = query.limit(limit + 1)  # one extra row tells whether there is a next page
+    return db.session.execute(query.execution_options(yield_per=YIELD_PER))
+
+
+def _end(count, last_id, limit, has_more):
+    return {'type': 'end', 'count': count, 'next_after': last_id if limit is not None and has_more else None}
+
+
+def _rows(result, limit):
+    # (row, ...) up to limit, then whether there were more
+    for i, row in enumerate(result):
+        if limit is not None and i == limit:
+            yield None
+            return
+        yield row
+
+
+def deck_lines(deck_id, after=None, limit=None, images=False):
+    deck = db.session.execute(
+        select(Deck.id, Deck.name, Deck.date_created, Deck.version).where(Deck.id == deck_id)).one()
+    card_count = db.session.scalar(select(func.count()).select_from(deck_cards)
+                                   .where(deck_cards.c.deck_id == deck_id))
+    yield {
+        'type': 'deck',
+        'id': deck.id,
+        'name': deck.name,
+        'date_created': _iso(deck.date_created),
+        'version': deck.version,
+        'card_count': card_count,
+    }
+
+    # Per-card review figures as correlated subqueries on the
+    # (card_id, timestamp) index, evaluated only for the rows streamed
+    hot_count = select(func.count(Review.id)).where(Review.card_id == Card.id).scalar_subquery()
+    last_review = select(func.max(Review.timestamp)).where(Review.card_id == Card.id).scalar_subquery()
+    image_columns = ([Card.front_image, Card.back_image] if images else
+                     [Card.front_image.isnot(None).label('has_front_image'),
+                      Card.back_image.isnot(None).label('has_back_image')])
+    query = (select(Card.id, Card.front, Card.back, Card.card_type, Card.date_added,
+                    Card.is_mature, Card.mature_streak, Card.last_wrong,
+                    (hot_count + func.coalesce(Card.archived_successes, 0)
+                     + func.coalesce(Card.archived_failures, 0)).label('review_count'),
+                    last_review.label('last_review'), *image_columns)
+             .join(deck_cards, deck_cards.c.card_id == Card.id)
+             .where(deck_cards.c.deck_id == deck_id))
+
+    count, last_id = 0, None
+    for row in _rows(_page(query, Card.id, after, limit), limit):
+        if row is None:
+            yield _end(count, last_id, limit, True)
+            return
+        line = {
+            'type': 'card',
+            'id': row.id,
+            'front': row.front,
+            'back': row.back,
+            'card_type': row.card_type,
+            'date_added': _iso(row.date_added),
+            'review_count': row.review_count,
+            'is_mature': row.is_mature,
+            'mature_streak': row.mature_streak,
+            'last_wrong': _iso(row.last_wrong),
+            'last_review': _iso(row.last_review),
+        }
+        if images:
+            line['front_image'] = row.front_image
+            line['back_image'] = row.back_image
+        else:
+            line['has_front_image'] = row.has_front_image
+            line['has_back_image'] = row.has_back_image
+        yield line
+        count, last_id = count + 1, row.id
+    yield _end(count, last_id, limit, False)
+
+
+def _deck_rows():
+    card_counts = (select(deck_cards.c.deck_id, func.count().label('card_count'))
+                   .group_by(deck_cards.c.deck_id).subquery())
+    query = (select(Deck.id, Deck.name, func.coalesce(card_counts.c.card_count, 0).label('card_count'))
+             .outerjoin(card_counts, card_counts.c.deck_id == Deck.id))
+    return query, Deck.id, lambda row: {
+        'type': 'deck', 'id': row.id, 'name': row.name, 'card_count': row.card_count}
+
+
+def _user_rows():
+    query = select(User.id, User.username, User.active_session_id)
+    return query, User.id, lambda row: {
+        'type': 'user', 'id': row.id, 'username': row.username, 'active_session_id': row.active_session_id}
+
+
+def _session_rows():
+    query = (select(Session.id, Session.name, Session.start_time, Session.end_time,
+                    User.username, Deck.name.label('deck'),
+                    func.coalesce(SessionStats.review_count, 0).label('review_count'))
+             .join(User, User.id == Session.user_id)
+             .join(Deck, Deck.id == Session.deck_id)
+             .outerjoin(SessionStats, SessionStats.session_id == Session.id))
+    return query, Session.id, lambda row: {
+        'type': 'session', 'id': row.id, 'name': row.name, 'user': row.username, 'deck': row.deck,
+        'start_time': _iso(row.start_time), 'end_time': _iso(row.end_time), 'review_count': row.review_count}
+
+
+SECTIONS = {'decks': _deck_rows, 'users': _user_rows, 'sessions': _session_rows}
+
+
+def database_lines(section=None, after=None, limit=None):
+    # Summary counts, then every section (or just one, which can be paged)
+    yield {
+        'type': 'summary',
+        'decks': db.session.scalar(select(func.count(Deck.id))),
+        'cards': db.session.scalar(select(func.count(Card.id))),
+        'users': db.session.scalar(select(func.count(User.id))),
+        'sessions': db.session.scalar(select(func.count(Session.id))),
+        'reviews': db.session.scalar(select(func.count(Review.id))),
+        'archived_reviews': db.session.scalar(select(func.count(ReviewArchive.id))),
+    }
+
+    for name in ([section] if section else SECTIONS):
+        query, id_column, to_line = SECTIONS[name]()
+        count, last_id = 0, None
+        for row in _rows(_page(query, id_column, after if section else None, limit if section else None),
+                         limit if section else None):
+            if row is None:
+                yield {**_end(count, last_id, limit, True), 'section': name}
+                break
+            yield to_line(row)
+            count, last_id = count + 1, row.id
+        else:
+            yield {**_end(count, last_id, limit if section else None, False), 'section': name}
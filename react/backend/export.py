@@ -0,0 +1,215 @@
+from models import Card, Deck, Review, ReviewArchive, Session, User, UserCardState, deck_cards
+from datetime import datetime
+import json
+import os
+
+import sqlalchemy as sa
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency, only needed for exports
+    pa = None
+    pq = None
+
+# ------------------- COLUMNAR EXPORT -------------------
+#
+# Writes the review log and the tables needed to interpret it as Parquet (or
+# Arrow IPC) files, one directory per table and one part file per run, so the
+# output can be read directly as a dataset. Rows are streamed from a
+# server-side cursor in fixed-size batches. Image bodies are never exported,
+# only whether a card has one.
+#
+# Incremental runs export rows newer than a watermark and record the new
+# watermark in <out_dir>/_watermark. Reviews, live and archived, are one
+# dataset watermarked by review id: ids only grow, while timestamps of
+# imported reviews can be old, and compaction moves a review to
+# review_archive with its id, so it isn't exported again. (A review whose
+# transaction commits after a higher id was already exported is missed.)
+# Cards and sessions are watermarked by creation time; they have no update
+# timestamp, so edits to existing rows are only picked up by a full export,
+# which replaces all previous part files. Tables without a watermark column
+# are small and rewritten as a single file on every run.
+
+BATCH_SIZE = 50000
+WATERMARK_FILE = '_watermark'
+
+
+def _review_log():
+    # Live and archived reviews; a review is in exactly one of the two
+    reviews = Review.__table__
+    archive = ReviewArchive.__table__
+    columns = ('id', 'card_id', 'user_id', 'session_id', 'timestamp', 'rating')
+    return sa.union_all(
+        sa.select(*[reviews.c[name] for name in columns], sa.null().cast(sa.DateTime).label('archived_at')),
+        sa.select(*[archive.c[name] for name in columns], archive.c.archived_at),
+    ).subquery('review_log')
+
+
+def _tables(reviews):
+    cards = Card.__table__
+    sessions = Session.__table__
+    decks = Deck.__table__
+    users = User.__table__
+    user_cards = UserCardState.__table__
+
+    return [
+        # archived_at is set for reviews moved to review_archive by compaction
+        ('review', reviews.c.id, sa.select(
+            reviews.c.id, reviews.c.card_id, reviews.c.user_id, reviews.c.session_id,
+            reviews.c.timestamp, reviews.c.rating, reviews.c.archived_at,
+        ), pa.schema([
+            ('id', pa.int64()), ('card_id', pa.int64()), ('user_id', pa.int64()), ('session_id', pa.string()),
+            ('timestamp', pa.timestamp('us')), ('rating', pa.int16()),
+            ('archived_at', pa.timestamp('us')),
+        ])),
+        ('card', cards.c.date_added, sa.select(
+            cards.c.id, cards.c.front, cards.c.back, cards.c.card_type, cards.c.date_added,
+            cards.c.mature_streak, cards.c.is_mature, cards.c.last_wrong,
+            cards.c.archived_successes, cards.c.archived_failures,
+            cards.c.front_image.isnot(None).label('has_front_image'),
+            cards.c.back_image.isnot(None).label('has_back_image'),
+        ), pa.schema([
+            ('id', pa.int64()), ('front', pa.string()), ('back', pa.string()),
+            ('card_type', pa.string()), ('date_added', pa.timestamp('us')),
+            ('mature_streak', pa.int32()), ('is_mature', pa.bool_()),
+            ('last_wrong', pa.timestamp('us')),
+            ('archived_successes', pa.int32()), ('archived_failures', pa.int32()),
+            ('has_front_image', pa.bool_()), ('has_back_image', pa.bool_()),
+        ])),
+        ('session', sessions.c.start_time, sa.select(
+            sessions.c.id, sessions.c.name, sessions.c.user_id, sessions.c.deck_id,
+            sessions.c.start_time, sessions.c.end_time,
+        ), pa.schema([
+            ('id', pa.string()), ('name', pa.string()), ('user_id', pa.int64()),
+            ('deck_id', pa.int64()), ('start_time', pa.timestamp('us')),
+            ('end_time', pa.timestamp('us')),
+        ])),
+        # Current per-user card state; it has no timestamp, so it is exported in full
+        ('user_card_state', None, sa.select(
+            user_cards.c.user_id, user_cards.c.card_id, user_cards.c.mature_streak,
+            user_cards.c.is_mature, user_cards.c.last_wrong,
+            user_cards.c.archived_successes, user_cards.c.archived_failures,
+        ), pa.schema([
+            ('user_id', pa.int64()), ('card_id', pa.int64()), ('mature_streak', pa.int32()),
+            ('is_mature', pa.bool_()), ('last_wrong', pa.timestamp('us')),
+            ('archived_successes', pa.int32()), ('archived_failures', pa.int32()),
+        ])),
+        # Small dimension tables are always exported in full
+        ('deck', None, sa.select(
+            decks.c.id, decks.c.name, decks.c.date_created,
+        ), pa.schema([
+            ('id', pa.int64()), ('name', pa.string()), ('date_created', pa.timestamp('us')),
+        ])),
+        ('user', None, sa.select(
+            users.c.id, users.c.username, users.c.global_decay,
+        ), pa.schema([
+            ('id', pa.int64()), ('username', pa.string()), ('global_decay', pa.float64()),
+        ])),
+        ('deck_cards', None, sa.select(
+            deck_cards.c.deck_id, deck_cards.c.card_id,
+        ), pa.schema([
+            ('deck_id', pa.int64()), ('card_id', pa.int64()),
+        ])),
+    ]
+
+
+def read_watermark(out_dir):
+    # (time, review id) of the previous export, (None, None) if there was
+    # none. Watermarks written before reviews were tracked by id have no
+    # review id, so the next run exports reviews in full.
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return None, None
+    with open(path) as f:
+        content = f.read().strip()
+    if not content.startswith('{'):
+        return datetime.fromisoformat(content), None
+    watermark = json.loads(content)
+    return datetime.fromisoformat(watermark['time']), watermark['review_id']
+
+
+def _write_watermark(out_dir, time, review_id):
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'time': time.isoformat(), 'review_id': review_id}, f)
+    os.replace(path + '.tmp', path)
+
+
+def _open_writer(path, schema, fmt):
+    if fmt == 'parquet':
+        return pq.ParquetWriter(path, schema, compression='zstd')
+    return pa.ipc.new_file(path, schema)
+
+
+def export_table(conn, query, schema, path, fmt, batch_size=BATCH_SIZE):
+    rows_written = 0
+    writer = None
+    result = conn.execution_options(stream_results=True, max_row_buffer=batch_size).execute(query)
+    try:
+        for rows in result.partitions(batch_size):
+            columns = list(zip(*rows))
+            batch = pa.record_batch(
+                [pa.array(col, type=field.type) for col, field in zip(columns, schema)],
+                schema=schema)
+            if writer is None:
+                # Opened lazily so an incremental run with nothing new leaves no empty part
+                writer = _open_writer(path, schema, fmt)
+            writer.write_table(pa.Table.from_batches([batch]))
+            rows_written += len(rows)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows_written
+
+
+def export_all(db_uri, out_dir, since=None, since_review_id=None, fmt='parquet', batch_size=BATCH_SIZE):
+    # since bounds the cards and sessions, since_review_id the reviews; a
+    # table without its bound is exported in full
+    if pa is None:
+        raise RuntimeError("pyarrow is required for columnar export (pip install pyarrow)")
+    if fmt not in ('parquet', 'arrow'):
+        raise ValueError(f"Unsupported export format: {fmt}")
+
+    # Fix the upper bound up front so rows written during the export are
+    # picked up by the next incremental run rather than lost
+    until = datetime.now()
+    stamp = until.strftime('%Y%m%dT%H%M%S')
+    counts = {}
+
+    engine = sa.create_engine(db_uri)
+    try:
+        with engine.connect() as conn:
+            reviews = _review_log()
+            until_review_id = conn.scalar(sa.select(sa.func.max(reviews.c.id))) or 0
+            bounds = {'review': (since_review_id, until_review_id)}
+            for name, watermark_column, query, schema in _tables(reviews):
+                lower, upper = bounds.get(name, (since, until))
+                if watermark_column is not None:
+                    query = query.where(watermark_column <= upper)
+                    if lower is not None:
+                        query = query.where(watermark_column > lower)
+
+                table_dir = os.path.join(out_dir, name)
+                os.makedirs(table_dir, exist_ok=True)
+                if watermark_column is None or lower is None:
+                    for old in os.listdir(table_dir):
+                        os.remove(os.path.join(table_dir, old))
+                    if name == 'review':
+                        _remove_dataset(out_dir, 'review_archive')  # merged into review
+                path = os.path.join(table_dir, f"part-{stamp}.{fmt}")
+                counts[name] = export_table(conn, query, schema, path, fmt, batch_size)
+                print(f"Exported {counts[name]} rows from {name} to {path}")
+    finally:
+        engine.dispose()
+
+    _write_watermark(out_dir, until, until_review_id)
+    return counts
+
+
+def _remove_dataset(out_dir, name):
+    table_dir = os.path.join(out_dir, name)
+    if os.path.isdir(table_dir):
+        for old in os.listdir(table_dir):
+            os.remove(os.path.join(table_dir, old))
+        os.rmdir(table_dir)
@@ -0,0 +1,41 @@
+from flask import request, make_response
+from functools import wraps
+import hashlib
+
+# ------------------- HTTP CACHING -------------------
+#
+# Conditional GETs for endpoints whose payload is fully determined by a few
+# cheap version counters (Deck.version, User.version, table counts). The
+# view's etag function reads only those counters; if the client's
+# If-None-Match matches, a 304 is returned without running the view at all.
+# The counters are read before the payload is built, so a concurrent write
+# can only make the ETag older than the body, never newer.
+
+
+def make_etag(*parts):
+    return hashlib.sha1('|'.join(str(p) for p in parts).encode()).hexdigest()
+
+
+def conditional(etag_func, weak=False):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+
+            etag = etag_func(*args, **kwargs)
+            if etag is None:
+                return view(*args, **kwargs)
+
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=weak)
+            # Allow caching, but always revalidate
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,200 @@
+from flask import current_app, request, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from time import perf_counter
+import gzip
+import os
+import zlib
+
+try:
+    import orjson
+except ImportError:  # optional dependency, falls back to the json module
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional dependency, gzip only without it
+    brotli = None
+
+# ------------------- RESPONSE ENCODING -------------------
+#
+# JSON responses are serialized with orjson when it is installed, straight to
+# bytes, with the same sort_keys/compact behaviour as Flask's provider.
+# Anything orjson can't handle goes through the json module as before.
+#
+# Bodies of at least COMPRESS_MIN_SIZE bytes are compressed with brotli or
+# gzip, whichever the client accepts (brotli preferred); streamed bodies are
+# compressed incrementally as they are sent. Images and other
+# already-compressed formats, files and bodies that already have a
+# Content-Encoding are sent as they are.
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # higher levels cost far more CPU for little gain on JSON
+
+SKIP_MIMETYPE_PREFIXES = ('image/', 'video/', 'audio/')
+SKIP_MIMETYPES = {'application/zip', 'application/gzip', 'application/x-brotli',
+                  'application/vnd.apache.parquet', 'application/octet-stream'}
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    def _orjson_options(self, indent=False):
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps_bytes(self, obj, indent=False):
+        if orjson is not None:
+            try:
+                # Datetimes are passed through to Flask's default() so they
+                # keep their HTTP-date format
+                return orjson.dumps(obj, default=self.default, option=self._orjson_options(indent))
+            except TypeError:
+                pass  # e.g. non-string keys or integers wider than 64 bits
+        dump_args = {'indent': 2} if indent else {'separators': (',', ':')}
+        return self.dumps(obj, **dump_args).encode()
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                pass  # let the json module raise its usual error
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self.dumps_bytes(obj, indent) + b'\n', mimetype=self.mimetype)
+
+
+def _compressible(response):
+    if response.direct_passthrough:
+        return False
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if 'Content-Encoding' in response.headers:
+        return False
+    mimetype = response.mimetype or ''
+    if mimetype.startswith(SKIP_MIMETYPE_PREFIXES) or mimetype in SKIP_MIMETYPES:
+        return False
+    return response.content_length is None or response.content_length >= COMPRESS_MIN_SIZE
+
+
+def choose_encoding(accept_encodings):
+    if brotli is not None and accept_encodings.quality('br') > 0:
+        return 'br'
+    if accept_encodings.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _compress_stream(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+        process, finish = compressor.compress, compressor.flush
+    try:
+        for chunk in chunks:
+            data = process(chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def _weaken_etag(response):
+    # The compressed bytes differ from the identity ones, so a strong ETag
+    # can no longer be shared between them
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def compress_response(response):
+    if not _compressible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers['Content-Encoding'] = encoding
+        response.headers.pop('Content-Length', None)
+        _weaken_etag(response)
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+
+    response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    _weaken_etag(response)
+    return response
+
+
+def ndjson_response(lines):
+    # Streams an iterable of JSON-serializable objects, one per line. The
+    # request context (and with it the database session) stays open until
+    # the last line has been sent.
+    provider = current_app.json
+
+    def generate():
+        for line in lines:
+            yield provider.dumps_bytes(line) + b'\n'
+    return current_app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def init_response_encoding(app):
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
+
+
+# ------------------- BENCHMARK -------------------
+
+def benchmark_response(client, path, repeat=5):
+    # Serialize + compress time and bytes on the wire for one GET endpoint,
+    # per serializer and per encoding. The view itself is run once.
+    response = client.get(path)
+    provider = client.application.json
+    if response.mimetype == 'application/x-ndjson':
+        lines = [provider.loads(line) for line in response.get_data().splitlines()]
+        serializers = {'json': lambda: b''.join(provider.dumps(line, separators=(',', ':')).encode() + b'\n'
+                                                for line in lines)}
+        if orjson is not None:
+            serializers['orjson'] = lambda: b''.join(provider.dumps_bytes(line) + b'\n' for line in lines)
+    else:
+        payload = response.get_json()
+        serializers = {'json': lambda: provider.dumps(payload, separators=(',', ':')).encode()}
+        if orjson is not None:
+            serializers['orjson'] = lambda: provider.dumps_bytes(payload)
+
+    results = {'path': path, 'status': response.status_code}
+    for name, serialize in serializers.items():
+        start = perf_counter()
+        for _ in range(repeat):
+            body = serialize()
+        results[f'{name}_ms'] = (perf_counter() - start) / repeat * 1000
+    results['identity_bytes'] = len(body)
+
+    for encoding in ['gzip'] + (['br'] if brotli is not None else []):
+        start = perf_counter()
+        for _ in range(repeat):
+            compressed = compress(body, encoding)
+        results[f'{encoding}_ms'] = (perf_counter() - start) / repeat * 1000
+        results[f'{encoding}_bytes'] = len(compressed)
+    return results
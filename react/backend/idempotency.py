@@ -0,0 +1,160 @@
+from models import db, Card, IdempotencyKey
+from card_cache import card_cache
+from flask import jsonify
+from datetime import datetime, timedelta
+import hashlib
+import json
+import os
+import threading
+
+# ------------------- IDEMPOTENT REVIEWS -------------------
+#
+# A review POSTed with an Idempotency-Key header (or "idempotency_key" in the
+# body) records the key in the same transaction as the review. A retry with
+# the same key gets the stored response instead of a second review; reusing a
+# key for a different request is a 422, and a retry that arrives while the
+# first request is still running gets a 409 to retry after. If the request
+# fails after its review was committed, the error response is stored and
+# replayed like any other. Keys are scoped per user and expire after
+# IDEMPOTENCY_TTL_HOURS; `flask purge-idempotency-keys` deletes expired ones.
+#
+# Only the next card's id and stats are stored. Replays reload its content,
+# so a retry doesn't store a second copy of the card's images.
+
+TTL = timedelta(hours=float(os.environ.get('IDEMPOTENCY_TTL_HOURS', 24)))
+MAX_KEY_LENGTH = 255
+
+
+def request_key(request, data):
+    key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    if key is not None and (not isinstance(key, str) or len(key) > MAX_KEY_LENGTH):
+        raise ValueError(f"Idempotency key must be a string of at most {MAX_KEY_LENGTH} characters")
+    return key or None
+
+
+def request_fingerprint(deck, data):
+    body = {name: value for name, value in data.items() if name != 'idempotency_key'}
+    return hashlib.sha256(json.dumps([deck, body], sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _live(row):
+    return row is not None and row.created_at >= datetime.now() - TTL
+
+
+def replay_response(user_id, key, fingerprint):
+    # The stored response for a retry, an error response, or None if the
+    # request hasn't been seen (or its key expired)
+    row = db.session.get(IdempotencyKey, (user_id, key))
+    if not _live(row):
+        return None
+    if row.fingerprint != fingerprint:
+        return jsonify({'success': False,
+                        'error': 'Idempotency key was already used for a different request'}), 422
+    if row.status_code is None:
+        response = jsonify({'success': False, 'error': 'A request with this idempotency key is in progress'})
+        response.headers['Retry-After'] = '1'
+        return response, 409
+
+    payload = dict(row.response)
+    stored_card = payload.get('next_card')
+    if stored_card:
+        card = db.session.get(Card, stored_card['id'])
+        state = card_cache.card_state(card.id, user_id) if card else None
+        payload['next_card'] = {**card.to_dict(state), 'stats': stored_card['stats']} if card else None
+    response = jsonify(payload)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response, row.status_code
+
+
+class DuplicateRequest(Exception):
+    pass
+
+
+def reserve_key(user_id, key, fingerprint):
+    # Adds the key to the current transaction; committing it alongside the
+    # review is what makes a concurrent duplicate fail (here, or with an
+    # IntegrityError at commit)
+    row = db.session.get(IdempotencyKey, (user_id, key), populate_existing=True)
+    if _live(row):
+        raise DuplicateRequest(key)
+    if row is None:
+        db.session.add(IdempotencyKey(user_id=user_id, key=key, fingerprint=fingerprint))
+    else:  # expired, reuse the row
+        row.fingerprint = fingerprint
+        row.status_code = None
+        row.response = None
+        row.created_at = datetime.now()
+
+
+def store_response(user_id, key, payload, status_code=200):
+    stored = dict(payload)
+    if stored.get('next_card'):
+        stored['next_card'] = {'id': stored['next_card']['id'], 'stats': stored['next_card'].get('stats')}
+    db.session.query(IdempotencyKey).filter_by(user_id=user_id, key=key) \
+        .update({'status_code': status_code, 'response': stored}, synchronize_session=False)
+    db.session.commit()
+
+
+def purge_expired_keys():
+    deleted = db.session.query(IdempotencyKey) \
+        .filter(IdempotencyKey.created_at < datetime.now() - TTL).delete(synchronize_session=False)
+    db.session.commit()
+    print(f"Deleted {deleted} expired idempotency keys")
+    return deleted
+
+
+# ------------------- NEXT-CARD COALESCING -------------------
+#
+# Identical next_card requests that arrive while one is being computed (a
+# double tap, or several tabs polling) wait for that computation and share
+# its result instead of each loading and scheduling the deck. Keys are
+# (user id, deck id); nothing is kept once the computation finishes.
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = self.coalesced = 0
+
+    def do(self, key, compute):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = compute()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'coalesced': self.coalesced, 'in_flight': len(self._calls)}
+
+
+next_card_flight = SingleFlight()
@@ -0,0 +1,167 @@
+from models import db, Card, Deck
+from flask import current_app
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import base64
+import binascii
+import os
+import threading
+
+from sqlalchemy import or_, update
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional dependency, images are stored as uploaded without it
+    Image = None
+    ImageOps = None
+
+# ------------------- IMAGE INGESTION -------------------
+#
+# Uploaded card images (base64, usually data URIs) are decoded, oriented,
+# downscaled to MAX_DIMENSION and re-encoded as WebP, and a THUMBNAIL_DIMENSION
+# thumbnail is stored next to each one for list views. The work runs on a
+# small thread pool after the card has been saved (Pillow releases the GIL
+# while decoding and encoding), so uploads return immediately and the card
+# briefly serves the original image.
+#
+# Each side is written back with a compare-and-set on the original image, so
+# an edit made while the job ran is never overwritten; the edit queues its
+# own job. `flask process-images` backfills cards stored before this existed.
+
+MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', 1600))
+THUMBNAIL_DIMENSION = 256
+WEBP_QUALITY = 80
+THUMBNAIL_QUALITY = 70
+WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))  # 0 processes images inline
+
+SIDES = ('front', 'back')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _decode(value):
+    # (prefix, bytes) of a base64 image, prefix being '' for bare base64
+    prefix, _, payload = value.rpartition(',') if value.startswith('data:') else ('', '', value)
+    if prefix and not prefix.endswith(';base64'):
+        return None
+    try:
+        return prefix, base64.b64decode(payload, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+
+
+def _encode(prefix, data):
+    encoded = base64.b64encode(data).decode()
+    return f"data:image/webp;base64,{encoded}" if prefix else encoded
+
+
+def _webp(img, max_dimension, quality):
+    img = img.copy()
+    img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    buf = BytesIO()
+    img.save(buf, format='WEBP', quality=quality, method=4)
+    return buf.getvalue()
+
+
+def process_image(value):
+    # (image, thumbnail) to store for an uploaded image. Anything that isn't
+    # a decodable image is kept as it is, without a thumbnail.
+    if Image is None or not value:
+        return value, None
+    decoded = _decode(value)
+    if decoded is None:
+        return value, None
+    prefix, raw = decoded
+
+    try:
+        img = Image.open(BytesIO(raw))
+        animated = getattr(img, 'is_animated', False)
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'RGBA'):
+            has_alpha = 'A' in img.getbands() or 'transparency' in img.info
+            img = img.convert('RGBA' if has_alpha else 'RGB')
+        thumbnail = _encode(prefix, _webp(img, THUMBNAIL_DIMENSION, THUMBNAIL_QUALITY))
+        if animated:
+            return value, thumbnail  # keep the animation, thumbnail its first frame
+
+        webp = _webp(img, MAX_DIMENSION, WEBP_QUALITY)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"Could not process image: {str(e)}")
+        return value, None
+
+    # Small images that are already well compressed stay as they are
+    if len(webp) >= len(raw) and max(img.size) <= MAX_DIMENSION:
+        return value, thumbnail
+    return _encode(prefix, webp), thumbnail
+
+
+def process_card_images(card_id):
+    card = db.session.get(Card, card_id)
+    if card is None:
+        return False
+
+    changed = False
+    for side in SIDES:
+        image_column = getattr(Card, f'{side}_image')
+        thumbnail_column = getattr(Card, f'{side}_thumbnail')
+        original = getattr(card, f'{side}_image')
+        if not original or getattr(card, f'{side}_thumbnail'):
+            continue  # no image, or already processed
+
+        image, thumbnail = process_image(original)
+        if thumbnail is None:
+            continue
+        changed |= db.session.execute(
+            update(Card)
+            .where(Card.id == card_id, image_column == original)
+            .values({image_column: image, thumbnail_column: thumbnail})
+            .execution_options(synchronize_session=False)).rowcount > 0
+
+    if changed:
+        Deck.bump_versions_for_card(card_id)
+    db.session.commit()
+    return changed
+
+
+def _run(app, card_id):
+    with app.app_context():
+        try:
+            process_card_images(card_id)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error processing images of card {card_id}: {str(e)}")
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='images')
+        return _executor
+
+
+def submit_card_images(card_id):
+    # Call after the card has been committed
+    if Image is None:
+        return None
+    if WORKERS <= 0:
+        return process_card_images(card_id)
+    return _pool().submit(_run, current_app._get_current_object(), card_id)
+
+
+def process_pending_images(batch_size=200):
+    # Backfill: every card with an image but no thumbnail
+    pending = or_(*[(getattr(Card, f'{side}_image') != None) & (getattr(Card, f'{side}_thumbnail') == None)
+                    for side in SIDES])
+    card_ids = [card_id for (card_id,) in db.session.query(Card.id).filter(pending).order_by(Card.id)]
+    db.session.commit()
+
+    app = current_app._get_current_object()
+    processed = 0
+    with ThreadPoolExecutor(max_workers=max(1, WORKERS)) as pool:
+        for start in range(0, len(card_ids), batch_size):
+            list(pool.map(lambda card_id: _run(app, card_id), card_ids[start:start + batch_size]))
+            processed += len(card_ids[start:start + batch_size])
+            print(f"Processed images of {processed}/{len(card_ids)} cards")
+    return processed
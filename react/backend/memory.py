@@ -0,0 +1,285 @@
+from models import (db, User, Deck, Card, Session, Review, RecallEntry, UserCardState, IdempotencyKey,
+                    DailyStats, SessionStats, deck_cards)
+from bulk import delete_cards
+from bulk_load import import_cards
+from card_cache import card_cache
+from datetime import datetime
+from time import perf_counter
+import base64
+import contextlib
+import gc
+import io
+import os
+import random
+import sys
+import threading
+import tracemalloc
+
+import numpy as np
+from sqlalchemy import delete, select, update
+
+# ------------------- ALLOCATION TRACKING -------------------
+#
+# Opt-in tracemalloc of a live worker: with MEMORY_TRACKING=<frames> set
+# (1 is enough for top allocation sites, more for tracebacks) the worker
+# traces its allocations from startup and /api/diagnostic/memory reports
+# where the traced memory was allocated, optionally as growth since a
+# baseline. Tracing costs CPU and memory on every allocation, so it is off
+# unless asked for.
+
+TRACKING_FRAMES = int(os.environ.get('MEMORY_TRACKING') or 0)
+MAX_TOP = 100
+GROUPINGS = ('lineno', 'filename', 'traceback')
+
+# Allocations made by the tracing itself and by imports aren't interesting
+_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+]
+
+_baseline = None
+_baseline_time = None
+_lock = threading.Lock()
+
+
+def rss_bytes():
+    # Current resident set size; peak RSS where /proc isn't available
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def start_tracking(frames=None):
+    frames = frames or TRACKING_FRAMES or 1
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+        print(f"Tracing memory allocations ({frames} frames)")
+
+
+def tracking_enabled():
+    return tracemalloc.is_tracing()
+
+
+def _snapshot():
+    gc.collect()
+    return tracemalloc.take_snapshot().filter_traces(_FILTERS)
+
+
+def set_baseline():
+    global _baseline, _baseline_time
+    with _lock:
+        _baseline = _snapshot()
+        _baseline_time = datetime.now()
+    return _baseline_time
+
+
+def _frame(frame):
+    return {'file': frame.filename, 'line': frame.lineno}
+
+
+def _stat(stat, group):
+    entry = {
+        'size': stat.size,
+        'count': stat.count,
+        **_frame(stat.traceback[0]),
+    }
+    if group == 'traceback':
+        entry['traceback'] = [_frame(frame) for frame in stat.traceback]
+    if hasattr(stat, 'size_diff'):
+        entry['size_diff'] = stat.size_diff
+        entry['count_diff'] = stat.count_diff
+    return entry
+
+
+def top_allocations(limit=20, group='lineno', since_baseline=False):
+    # The largest allocation sites, or the ones that grew most since the
+    # baseline. Raises ValueError if there is no baseline yet.
+    with _lock:
+        baseline = _baseline
+        if since_baseline and baseline is None:
+            raise ValueError("No baseline; POST /api/diagnostic/memory/baseline first")
+        snapshot = _snapshot()
+        if since_baseline:
+            stats = snapshot.compare_to(baseline, group)
+        else:
+            stats = snapshot.statistics(group)
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        'rss': rss_bytes(),
+        'traced': current,
+        'traced_peak': peak,
+        'frames': tracemalloc.get_traceback_limit(),
+        'baseline': _baseline_time.isoformat() if since_baseline else None,
+        'top': [_stat(stat, group) for stat in stats[:limit]],
+    }
+
+
+# ------------------- SOAK TEST -------------------
+#
+# Drives the app through many mixed requests in-process (a test client
+# against the configured database) and watches RSS and traced memory. The
+# first `warmup` requests fill the caches and are not counted; after that a
+# steady workload should hold memory flat, so growth beyond the budgets
+# fails the run and the allocation sites that grew most are reported. Runs
+# in a scratch deck and user that are removed afterwards.
+
+SOAK_WORKLOAD = (
+    # (request kind, weight)
+    ('next_card', 30),
+    ('review', 30),
+    ('cards', 8),
+    ('stats', 8),
+    ('search', 8),
+    ('diagnostic_deck', 6),
+    ('sessions', 6),
+    ('session_cycle', 4),
+)
+
+
+def _soak_image(rng, size):
+    # A base64 data URI of incompressible bytes, about as heavy as a photo
+    data = base64.b64encode(rng.randbytes(size)).decode()
+    return f'data:image/jpeg;base64,{data}'
+
+
+def _soak_fixture(n_cards, image_bytes, rng, stamp):
+    deck = Deck(name=f"_soak_{stamp}")
+    user = User(username=f"_soak_{stamp}")
+    db.session.add_all([deck, user])
+    db.session.commit()
+    card_ids = import_cards(deck.id, ({'front': f"soak front {i}", 'back': f"soak back {i}"}
+                                      for i in range(n_cards)))
+    if image_bytes:
+        # Images are set directly: the upload path would transcode them in
+        # the background, outside the measured requests
+        for card_id in card_ids[::2]:
+            db.session.execute(update(Card).where(Card.id == card_id)
+                               .values(front_image=_soak_image(rng, image_bytes)))
+        db.session.commit()
+    return deck.id, deck.name, user.id, user.username
+
+
+def _soak_cleanup(deck_id, user_id):
+    db.session.rollback()
+    card_ids, _ = delete_cards(deck_id, select(deck_cards.c.card_id).where(deck_cards.c.deck_id == deck_id))
+    session_ids = select(Session.id).where(Session.user_id == user_id)
+    db.session.execute(delete(Review).where(Review.user_id == user_id))
+    db.session.execute(delete(SessionStats).where(SessionStats.session_id.in_(session_ids)))
+    for model in (Session, DailyStats, UserCardState, IdempotencyKey, RecallEntry):
+        db.session.execute(delete(model).where(model.user_id == user_id))
+    db.session.execute(delete(Deck).where(Deck.id == deck_id))
+    db.session.execute(delete(User).where(User.id == user_id))
+    db.session.commit()
+    card_cache.invalidate_cards(card_ids, [deck_id])
+    card_cache.invalidate_deck(deck_id)
+
+
+def _soak_request(client, kind, deck, user, state, rng):
+    if kind == 'next_card' or (kind == 'review' and state.get('card_id') is None):
+        response = client.post(f'/api/next_card/{deck}/{user}')
+        card = (response.get_json(silent=True) or {}).get('next_card')
+        state['card_id'] = card['id'] if card else None
+    elif kind == 'review':
+        response = client.post(f'/api/review/{deck}/{user}',
+                               json={'id': state.pop('card_id'), 'rating': rng.randint(0, 10)})
+    elif kind == 'cards':
+        response = client.get(f'/api/cards/{deck}', query_string={'images': 'thumbnail'})
+    elif kind == 'stats':
+        response = client.get('/api/stats/user', query_string={'user': user})
+    elif kind == 'search':
+        response = client.get(f'/api/search/{deck}', query_string={'q': f"front {rng.randrange(100)}"})
+    elif kind == 'diagnostic_deck':
+        response = client.get(f'/api/diagnostic/deck/{deck}', query_string={'limit': 50})
+    elif kind == 'sessions':
+        response = client.get('/api/sessions', query_string={'user': user})
+    else:  # session_cycle: end the active session, if any, and start a new one
+        if state.get('session_id'):
+            client.post(f"/api/sessions/{state['session_id']}/end").close()
+        response = client.post('/api/sessions', json={'deck': deck, 'user': user})
+        session = (response.get_json(silent=True) or {}).get('session')
+        state['session_id'] = session['id'] if session else None
+    status = response.status_code
+    response.close()  # consumes streamed bodies
+    return status
+
+
+def run_soak(app, requests=5000, warmup=500, cards=200, image_bytes=20000, rss_budget_mb=50.0,
+             traced_budget_mb=20.0, sample_every=250, top=15, seed=0, verbose=False):
+    # Returns a report dict; report['passed'] is False if either budget was
+    # exceeded. The app's request logging is silenced unless verbose.
+    rng = random.Random(seed)
+    np.random.seed(seed)
+    random.seed(seed)
+    kinds, weights = zip(*SOAK_WORKLOAD)
+    stamp = datetime.now().strftime('%Y%m%d%H%M%S%f')
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(1)
+
+    client = app.test_client()
+    with app.app_context():
+        deck_id, deck, user_id, user = _soak_fixture(cards, image_bytes, rng, stamp)
+    state = {}
+    statuses = {}
+    samples = []
+    baseline = baseline_rss = None
+    start = perf_counter()
+    try:
+        for i in range(warmup + requests):
+            if i == warmup:
+                gc.collect()
+                baseline = tracemalloc.take_snapshot().filter_traces(_FILTERS)
+                baseline_rss = rss_bytes()
+                start = perf_counter()
+            kind = rng.choices(kinds, weights)[0]
+            with contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO()):
+                status = _soak_request(client, kind, deck, user, state, rng)
+            statuses[f'{kind} {status}'] = statuses.get(f'{kind} {status}', 0) + 1
+
+            done = i + 1 - warmup
+            if done > 0 and (done % sample_every == 0 or done == requests):
+                gc.collect()
+                samples.append({
+                    'requests': done,
+                    'rss_mb': rss_bytes() / 2**20,
+                    'traced_mb': tracemalloc.get_traced_memory()[0] / 2**20,
+                })
+                print(f"{done}/{requests} requests: RSS {samples[-1]['rss_mb']:.1f} MB, "
+                      f"traced {samples[-1]['traced_mb']:.1f} MB")
+        elapsed = perf_counter() - start
+
+        gc.collect()
+        final = tracemalloc.take_snapshot().filter_traces(_FILTERS)
+        growth = final.compare_to(baseline, 'lineno') if baseline else []
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        with app.app_context():
+            _soak_cleanup(deck_id, user_id)
+
+    rss_growth = (samples[-1]['rss_mb'] - baseline_rss / 2**20) if samples else 0.0
+    traced_growth = sum(stat.size_diff for stat in growth) / 2**20
+    # A leak shows as a steady slope; a one-off allocation as a step
+    slope = (float(np.polyfit([s['requests'] for s in samples], [s['rss_mb'] for s in samples], 1)[0]) * 1000
+             if len(samples) >= 2 else 0.0)
+    return {
+        'requests': requests,
+        'warmup': warmup,
+        'requests_per_s': requests / elapsed if elapsed else None,
+        'statuses': statuses,
+        'rss_baseline_mb': baseline_rss / 2**20 if baseline_rss else None,
+        'rss_growth_mb': rss_growth,
+        'rss_mb_per_1000_requests': slope,
+        'traced_growth_mb': traced_growth,
+        'rss_budget_mb': rss_budget_mb,
+        'traced_budget_mb': traced_budget_mb,
+        'passed': rss_growth <= rss_budget_mb and traced_growth <= traced_budget_mb,
+        'samples': samples,
+        'top_growth': [_stat(stat, 'lineno') for stat in growth[:top] if stat.size_diff > 0],
+    }
@@ -0,0 +1,46 @@
+"""Backfill: attribute existing reviews to users and rebuild the rollups
+
+Data only. Runs `flask attribute-reviews` (each review gets its session's
+user, then every user's card states are rebuilt) and `flask rebuild-rollups`
+with the application's own code, after the schema changes before it are
+committed. Both are idempotent. Sessionless reviews have no owner and stay
+unattributed; assign them with
+`flask attribute-reviews --sessionless-user <name>`.
+
+Revision ID: 0a68c24e79fc
+Revises: f57b13d68aeb
+Create Date: 2026-10-19 09:11:00.000000
+
+"""
+from alembic import context, op
+
+
+# revision identifiers, used by Alembic.
+revision = '0a68c24e79fc'
+down_revision = 'f57b13d68aeb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if context.is_offline_mode():
+        print("-- Skipping the review backfill in offline mode; run `flask attribute-reviews` "
+              "and `flask rebuild-rollups` after applying the SQL")
+        return
+
+    from models import db
+    from attribution import attribute_reviews
+    from rollups import rebuild_rollups
+
+    # The application's session uses its own connection, so the schema
+    # changes have to be committed first
+    with op.get_context().autocommit_block():
+        try:
+            attribute_reviews()
+            rebuild_rollups()
+        finally:
+            db.session.remove()
+
+
+def downgrade():
+    pass
@@ -0,0 +1,39 @@
+"""Prefix index for card search
+
+SQLite only. Every card search is a prefix query, so card_fts is recreated
+with 2- and 3-character prefix entries and rebuilt from the card table.
+Databases that don't have the index yet get it from init_search_index at
+startup; its sync triggers refer to card_fts by name and are left alone.
+
+Revision ID: 1b79d35f8a0d
+Revises: 0a68c24e79fc
+Create Date: 2026-10-19 09:12:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1b79d35f8a0d'
+down_revision = '0a68c24e79fc'
+branch_labels = None
+depends_on = None
+
+
+def _recreate_card_fts(options):
+    bind = op.get_bind()
+    if bind.dialect.name != 'sqlite' or not sa.inspect(bind).has_table('card_fts'):
+        return
+    op.execute("DROP TABLE card_fts")
+    op.execute(f"""CREATE VIRTUAL TABLE card_fts USING fts5(
+                       front, back, content='card', content_rowid='id', {options})""")
+    op.execute("INSERT INTO card_fts(card_fts) VALUES ('rebuild')")
+
+
+def upgrade():
+    _recreate_card_fts("tokenize='unicode61 remove_diacritics 2', prefix='2 3'")
+
+
+def downgrade():
+    _recreate_card_fts("tokenize='unicode61 remove_diacritics 2'")
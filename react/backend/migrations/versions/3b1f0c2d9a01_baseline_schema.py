@@ -0,0 +1,74 @@
+"""Baseline schema
+
+The tables as db.create_all made them before migrations were added. Each
+one is only created if it doesn't exist, so databases created before this
+revision can be upgraded as they are.
+
+Revision ID: 3b1f0c2d9a01
+Revises:
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b1f0c2d9a01'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _create(name, *columns):
+    if not sa.inspect(op.get_bind()).has_table(name):
+        op.create_table(name, *columns)
+
+
+def upgrade():
+    _create('user',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('username', sa.String(length=80), nullable=False, unique=True),
+            sa.Column('recall_history', sa.Text()),
+            sa.Column('global_decay', sa.Float()),
+            sa.Column('pomodoro_length', sa.Integer()),
+            sa.Column('break_length', sa.Integer()),
+            sa.Column('session_fatigue', sa.Integer()),
+            sa.Column('focus_drop_count', sa.Integer()),
+            sa.Column('active_session_id', sa.String(length=36), nullable=True))
+    _create('deck',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('name', sa.String(length=100), nullable=False, unique=True),
+            sa.Column('date_created', sa.DateTime()))
+    _create('card',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('front', sa.Text(), nullable=False),
+            sa.Column('back', sa.Text(), nullable=False),
+            sa.Column('front_image', sa.Text()),
+            sa.Column('back_image', sa.Text()),
+            sa.Column('card_type', sa.String(length=50)),
+            sa.Column('date_added', sa.DateTime()),
+            sa.Column('mature_streak', sa.Integer()),
+            sa.Column('last_wrong', sa.DateTime(), nullable=True),
+            sa.Column('is_mature', sa.Boolean()))
+    _create('session',
+            sa.Column('id', sa.String(length=36), primary_key=True),
+            sa.Column('name', sa.String(length=100), nullable=False),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.id'), nullable=False),
+            sa.Column('deck_id', sa.Integer(), sa.ForeignKey('deck.id'), nullable=False),
+            sa.Column('start_time', sa.DateTime()),
+            sa.Column('end_time', sa.DateTime(), nullable=True))
+    _create('deck_cards',
+            sa.Column('deck_id', sa.Integer(), sa.ForeignKey('deck.id'), primary_key=True),
+            sa.Column('card_id', sa.Integer(), sa.ForeignKey('card.id'), primary_key=True))
+    _create('review',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('card_id', sa.Integer(), sa.ForeignKey('card.id'), nullable=False),
+            sa.Column('session_id', sa.String(length=36), sa.ForeignKey('session.id'), nullable=True),
+            sa.Column('timestamp', sa.DateTime()),
+            sa.Column('rating', sa.Integer(), nullable=False))
+
+
+def downgrade():
+    for name in ('review', 'deck_cards', 'session', 'card', 'deck', 'user'):
+        op.drop_table(name)
@@ -0,0 +1,30 @@
+"""User.decay_fitted_at for the offline decay fit
+
+Revision ID: 5c2e7a41d0b2
+Revises: 3b1f0c2d9a01
+Create Date: 2026-10-19 09:01:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2e7a41d0b2'
+down_revision = '3b1f0c2d9a01'
+branch_labels = None
+depends_on = None
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    if 'decay_fitted_at' not in _columns('user'):
+        op.add_column('user', sa.Column('decay_fitted_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('decay_fitted_at')
@@ -0,0 +1,54 @@
+"""Daily and session review rollups, and review indexes
+
+The rollups start empty; the backfill revision (0a68c24e79fc) rebuilds them
+from the review history.
+
+Revision ID: 7d91b3e5f2c3
+Revises: 5c2e7a41d0b2
+Create Date: 2026-10-19 09:02:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d91b3e5f2c3'
+down_revision = '5c2e7a41d0b2'
+branch_labels = None
+depends_on = None
+
+
+def _counters():
+    return [sa.Column(name, sa.Integer(), nullable=False)
+            for name in ['review_count', 'success_count', 'card_count'] + [f'rating_{r}' for r in range(11)]]
+
+
+def _create_index(name, table, columns):
+    if name not in {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}:
+        op.create_index(name, table, columns)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('daily_stats'):
+        op.create_table('daily_stats',
+                        sa.Column('user_id', sa.Integer(), primary_key=True),
+                        sa.Column('deck_id', sa.Integer(), primary_key=True),
+                        sa.Column('day', sa.Date(), primary_key=True),
+                        *_counters())
+    if not inspector.has_table('session_stats'):
+        op.create_table('session_stats',
+                        sa.Column('session_id', sa.String(length=36), sa.ForeignKey('session.id'),
+                                  primary_key=True),
+                        *_counters())
+    _create_index('ix_daily_stats_deck_day', 'daily_stats', ['deck_id', 'day'])
+    _create_index('ix_review_card_timestamp', 'review', ['card_id', 'timestamp'])
+    _create_index('ix_review_session_card', 'review', ['session_id', 'card_id'])
+
+
+def downgrade():
+    op.drop_index('ix_review_session_card', table_name='review')
+    op.drop_index('ix_review_card_timestamp', table_name='review')
+    op.drop_table('session_stats')
+    op.drop_table('daily_stats')
@@ -0,0 +1,37 @@
+"""RecallEntry rows for new recall history
+
+Existing User.recall_history documents stay where they are and are read as
+the start of each user's history.
+
+Revision ID: 8e0a4c6f13d4
+Revises: 7d91b3e5f2c3
+Create Date: 2026-10-19 09:03:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e0a4c6f13d4'
+down_revision = '7d91b3e5f2c3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('recall_entry'):
+        op.create_table('recall_entry',
+                        sa.Column('id', sa.Integer(), primary_key=True),
+                        sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.id'), nullable=False),
+                        sa.Column('interval', sa.Float(), nullable=False),
+                        sa.Column('success', sa.Integer(), nullable=False),
+                        sa.Column('timestamp', sa.DateTime()))
+    indexes = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('recall_entry')}
+    if 'ix_recall_entry_user_id' not in indexes:
+        op.create_index('ix_recall_entry_user_id', 'recall_entry', ['user_id', 'id'])
+
+
+def downgrade():
+    op.drop_table('recall_entry')
@@ -0,0 +1,32 @@
+"""User.version and Deck.version for ETags
+
+Revision ID: 9f1b5d7024e5
+Revises: 8e0a4c6f13d4
+Create Date: 2026-10-19 09:04:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9f1b5d7024e5'
+down_revision = '8e0a4c6f13d4'
+branch_labels = None
+depends_on = None
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    for table in ('user', 'deck'):
+        if 'version' not in _columns(table):
+            op.add_column(table, sa.Column('version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    for table in ('deck', 'user'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('version')
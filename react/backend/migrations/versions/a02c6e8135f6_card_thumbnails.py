@@ -0,0 +1,35 @@
+"""Card image thumbnails
+
+Existing images get their thumbnails from `flask process-images`.
+
+Revision ID: a02c6e8135f6
+Revises: 9f1b5d7024e5
+Create Date: 2026-10-19 09:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a02c6e8135f6'
+down_revision = '9f1b5d7024e5'
+branch_labels = None
+depends_on = None
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    existing = _columns('card')
+    for name in ('front_thumbnail', 'back_thumbnail'):
+        if name not in existing:
+            op.add_column('card', sa.Column(name, sa.Text()))
+
+
+def downgrade():
+    with op.batch_alter_table('card') as batch_op:
+        batch_op.drop_column('back_thumbnail')
+        batch_op.drop_column('front_thumbnail')
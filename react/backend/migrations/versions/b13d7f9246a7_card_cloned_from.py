@@ -0,0 +1,30 @@
+"""Card.cloned_from for bulk copies
+
+Revision ID: b13d7f9246a7
+Revises: a02c6e8135f6
+Create Date: 2026-10-19 09:06:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b13d7f9246a7'
+down_revision = 'a02c6e8135f6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'cloned_from' not in {column['name'] for column in inspector.get_columns('card')}:
+        op.add_column('card', sa.Column('cloned_from', sa.Integer(), nullable=True))
+    if 'ix_card_cloned_from' not in {index['name'] for index in inspector.get_indexes('card')}:
+        op.create_index('ix_card_cloned_from', 'card', ['cloned_from'])
+
+
+def downgrade():
+    op.drop_index('ix_card_cloned_from', table_name='card')
+    with op.batch_alter_table('card') as batch_op:
+        batch_op.drop_column('cloned_from')
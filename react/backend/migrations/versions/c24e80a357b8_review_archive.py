@@ -0,0 +1,45 @@
+"""review_archive and Card's archived outcome counts for compaction
+
+Revision ID: c24e80a357b8
+Revises: b13d7f9246a7
+Create Date: 2026-10-19 09:07:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c24e80a357b8'
+down_revision = 'b13d7f9246a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    existing = {column['name'] for column in inspector.get_columns('card')}
+    for name in ('archived_successes', 'archived_failures'):
+        if name not in existing:
+            op.add_column('card', sa.Column(name, sa.Integer(), nullable=False, server_default='0'))
+
+    if not inspector.has_table('review_archive'):
+        op.create_table('review_archive',
+                        sa.Column('id', sa.Integer(), primary_key=True),
+                        sa.Column('card_id', sa.Integer(), sa.ForeignKey('card.id'), nullable=False),
+                        sa.Column('session_id', sa.String(length=36), sa.ForeignKey('session.id'), nullable=True),
+                        sa.Column('timestamp', sa.DateTime()),
+                        sa.Column('rating', sa.Integer(), nullable=False),
+                        sa.Column('archived_at', sa.DateTime(), nullable=False))
+    indexes = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('review_archive')}
+    if 'ix_review_archive_card_timestamp' not in indexes:
+        op.create_index('ix_review_archive_card_timestamp', 'review_archive', ['card_id', 'timestamp'])
+    if 'ix_review_archive_archived_at' not in indexes:
+        op.create_index('ix_review_archive_archived_at', 'review_archive', ['archived_at'])
+
+
+def downgrade():
+    op.drop_table('review_archive')
+    with op.batch_alter_table('card') as batch_op:
+        batch_op.drop_column('archived_failures')
+        batch_op.drop_column('archived_successes')
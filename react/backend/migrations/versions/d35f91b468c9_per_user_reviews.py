@@ -0,0 +1,57 @@
+"""Review.user_id, ReviewArchive.user_id and per-user card state
+
+The new columns start NULL and user_card_state empty; the backfill
+revision (0a68c24e79fc) attributes the existing reviews and rebuilds the
+card states.
+
+Revision ID: d35f91b468c9
+Revises: c24e80a357b8
+Create Date: 2026-10-19 09:08:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd35f91b468c9'
+down_revision = 'c24e80a357b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('review', 'review_archive'):
+        inspector = sa.inspect(op.get_bind())
+        if 'user_id' not in {column['name'] for column in inspector.get_columns(table)}:
+            # Batch mode, as SQLite can only add the foreign key by copying the table
+            with op.batch_alter_table(table) as batch_op:
+                batch_op.add_column(sa.Column('user_id', sa.Integer(), nullable=True))
+                batch_op.create_foreign_key(f'{table}_user_id_fkey', 'user', ['user_id'], ['id'])
+        index = f'ix_{table}_user_card_timestamp'
+        if index not in {existing['name'] for existing in sa.inspect(op.get_bind()).get_indexes(table)}:
+            op.create_index(index, table, ['user_id', 'card_id', 'timestamp'])
+
+    if not sa.inspect(op.get_bind()).has_table('user_card_state'):
+        op.create_table('user_card_state',
+                        sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.id'), primary_key=True),
+                        sa.Column('card_id', sa.Integer(), sa.ForeignKey('card.id'), primary_key=True),
+                        sa.Column('mature_streak', sa.Integer(), nullable=False),
+                        sa.Column('last_wrong', sa.DateTime(), nullable=True),
+                        sa.Column('is_mature', sa.Boolean(), nullable=False),
+                        sa.Column('archived_successes', sa.Integer(), nullable=False),
+                        sa.Column('archived_failures', sa.Integer(), nullable=False))
+
+
+def downgrade():
+    op.drop_table('user_card_state')
+    for table in ('review_archive', 'review'):
+        op.drop_index(f'ix_{table}_user_card_timestamp', table_name=table)
+        # Tables made by create_all may have an unnamed foreign key, which
+        # goes with the column
+        names = [fk['name'] for fk in sa.inspect(op.get_bind()).get_foreign_keys(table)
+                 if fk['constrained_columns'] == ['user_id'] and fk['name']]
+        with op.batch_alter_table(table) as batch_op:
+            for name in names:
+                batch_op.drop_constraint(name, type_='foreignkey')
+            batch_op.drop_column('user_id')
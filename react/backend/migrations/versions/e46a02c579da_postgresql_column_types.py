@@ -0,0 +1,75 @@
+"""Native PostgreSQL types: UUID session ids and JSONB recall history
+
+Elsewhere session ids stay String(36), and recall_history is only declared
+JSON; its values are stored as the same text.
+
+Revision ID: e46a02c579da
+Revises: d35f91b468c9
+Create Date: 2026-10-19 09:09:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e46a02c579da'
+down_revision = 'd35f91b468c9'
+branch_labels = None
+depends_on = None
+
+# Columns holding session ids, referenced tables first
+SESSION_KEYS = [('session', 'id'), ('review', 'session_id'), ('review_archive', 'session_id'),
+                ('session_stats', 'session_id'), ('user', 'active_session_id')]
+UUID_PATTERN = '^[0-9a-fA-F]{8}-?([0-9a-fA-F]{4}-?){3}[0-9a-fA-F]{12}$'
+
+
+def _type(inspector, table, name):
+    return next(column['type'] for column in inspector.get_columns(table) if column['name'] == name)
+
+
+def _session_foreign_keys(inspector):
+    return [(table, fk) for table, _ in SESSION_KEYS[1:] for fk in inspector.get_foreign_keys(table)
+            if fk['referred_table'] == 'session']
+
+
+def _convert_session_keys(type_, using):
+    inspector = sa.inspect(op.get_bind())
+    foreign_keys = _session_foreign_keys(inspector)
+    for table, fk in foreign_keys:
+        op.drop_constraint(fk['name'], table, type_='foreignkey')
+    for table, name in SESSION_KEYS:
+        op.alter_column(table, name, type_=type_, postgresql_using=using(name))
+    for table, fk in foreign_keys:
+        op.create_foreign_key(fk['name'], table, 'session', fk['constrained_columns'], fk['referred_columns'])
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if op.get_bind().dialect.name != 'postgresql':
+        if not isinstance(_type(inspector, 'user', 'recall_history'), sa.JSON):
+            with op.batch_alter_table('user') as batch_op:
+                batch_op.alter_column('recall_history', type_=sa.JSON())
+        return
+
+    if not isinstance(_type(inspector, 'user', 'recall_history'), postgresql.JSONB):
+        op.alter_column('user', 'recall_history', type_=postgresql.JSONB(),
+                        postgresql_using="NULLIF(recall_history, '')::jsonb")
+
+    if not isinstance(_type(inspector, 'session', 'id'), postgresql.UUID):
+        # active_session_id isn't a foreign key and may hold anything; ids
+        # that aren't UUIDs couldn't match a session and become NULL
+        _convert_session_keys(
+            postgresql.UUID(as_uuid=False),
+            lambda name: (f"CASE WHEN {name} ~ '{UUID_PATTERN}' THEN {name}::uuid END"
+                          if name == 'active_session_id' else f'{name}::uuid'))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        with op.batch_alter_table('user') as batch_op:
+            batch_op.alter_column('recall_history', type_=sa.Text())
+        return
+    _convert_session_keys(sa.String(length=36), lambda name: f'{name}::text')
+    op.alter_column('user', 'recall_history', type_=sa.Text(), postgresql_using='recall_history::text')
@@ -0,0 +1,36 @@
+"""Idempotency keys for review submissions
+
+Revision ID: f57b13d68aeb
+Revises: e46a02c579da
+Create Date: 2026-10-19 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'f57b13d68aeb'
+down_revision = 'e46a02c579da'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not sa.inspect(op.get_bind()).has_table('idempotency_key'):
+        op.create_table('idempotency_key',
+                        sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.id'), primary_key=True),
+                        sa.Column('key', sa.String(length=255), primary_key=True),
+                        sa.Column('fingerprint', sa.String(length=64), nullable=False),
+                        sa.Column('status_code', sa.Integer(), nullable=True),
+                        sa.Column('response', sa.JSON().with_variant(postgresql.JSONB(), 'postgresql'),
+                                  nullable=True),
+                        sa.Column('created_at', sa.DateTime(), nullable=False))
+    indexes = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('idempotency_key')}
+    if 'ix_idempotency_key_created_at' not in indexes:
+        op.create_index('ix_idempotency_key_created_at', 'idempotency_key', ['created_at'])
+
+
+def downgrade():
+    op.drop_table('idempotency_key')
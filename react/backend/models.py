@@ -1,10 +1,37 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import case, func, select, update
+from sqlalchemy.dialects.postgresql import JSONB, UUID, insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
-import json
 import uuid
 
 db = SQLAlchemy()
 
+
+class SessionKey(TypeDecorator):
+    # Session ids: native UUID on PostgreSQL, 36-character strings elsewhere.
+    # Always a str in Python.
+    impl = db.String(36)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(UUID(as_uuid=False))
+        return dialect.type_descriptor(db.String(36))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != 'postgresql':
+            return value
+        try:
+            return str(uuid.UUID(str(value)))
+        except ValueError:
+            return None  # not a UUID, so it can't match any session
+
+
+# JSON documents, stored as JSONB on PostgreSQL
+JSONDocument = db.JSON().with_variant(JSONB(), 'postgresql')
+
 # Association table for deck-card relationship
 deck_cards = db.Table('deck_cards',
     db.Column('deck_id', db.Integer, db.ForeignKey('deck.id'), primary_key=True),
@@ -14,34 +41,48 @@ deck_cards = db.Table('deck_cards',
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
-    recall_history = db.Column(db.Text, default='[]')  # JSON string of (interval, success) tuples
+    recall_history = db.Column(JSONDocument, default=list)  # legacy (interval, success) pairs; new entries go to RecallEntry
     global_decay = db.Column(db.Float, default=0.03)
+    decay_fitted_at = db.Column(db.DateTime, nullable=True)  # set by the offline decay fit
     pomodoro_length = db.Column(db.Integer, default=25)  # minutes
     break_length = db.Column(db.Integer, default=5)  # minutes
     session_fatigue = db.Column(db.Integer, default=0)
     focus_drop_count = db.Column(db.Integer, default=0)
-    active_session_id = db.Column(db.String(36), nullable=True)
+    active_session_id = db.Column(SessionKey, nullable=True)
+    version = db.Column(db.Integer, default=0, nullable=False)  # bumped on session and review changes, used for ETags
     
     sessions = db.relationship('Session', backref='user_profile', lazy=True)
     
-    def get_recall_history(self):
-        if not self.recall_history:
-            return []
-        return json.loads(self.recall_history)
+    @staticmethod
+    def bump_version(user_id):
+        db.session.execute(update(User).where(User.id == user_id)
+                           .values(version=func.coalesce(User.version, 0) + 1)
+                           .execution_options(synchronize_session=False))
+    
+    def get_recall_history(self, limit=None):
+        # Legacy JSON history followed by the appended RecallEntry rows
+        legacy = list(self.recall_history or [])
+        query = RecallEntry.query.filter_by(user_id=self.id).order_by(RecallEntry.id.desc())
+        if limit:
+            query = query.limit(limit)
+        history = legacy + [[e.interval, e.success] for e in reversed(query.all())]
+        return history[-limit:] if limit else history
     
     def add_recall(self, interval, success):
-        history = self.get_recall_history()
-        history.append([interval, 1 if success else 0])
-        self.recall_history = json.dumps(history)
+        # Append-only, so concurrent reviews can't overwrite each other's entries
+        db.session.add(RecallEntry(user_id=self.id, interval=interval, success=1 if success else 0))
         self.update_decay()
     
     def update_decay(self):
-        history = self.get_recall_history()
-        if not history or len(history) < 10:
+        # Once the offline MLE fit (decay_fit.py) has run for this user its
+        # estimate takes precedence over this running approximation
+        if self.decay_fitted_at:
             return
-        
         # Use the last 50 entries
-        recent = history[-50:]
+        recent = self.get_recall_history(limit=50)
+        if len(recent) < 10:
+            return
+        
         fail_intervals = [iv for iv, s in recent if s == 0]
         
         if fail_intervals:
@@ -58,17 +99,77 @@ class User(db.Model):
         self.active_session_id = None
 
 
+class RecallEntry(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    interval = db.Column(db.Float, nullable=False)  # minutes since the card's previous review
+    success = db.Column(db.Integer, nullable=False)  # 1 or 0
+    timestamp = db.Column(db.DateTime, default=datetime.now)
+    
+    __table_args__ = (
+        db.Index('ix_recall_entry_user_id', 'user_id', 'id'),
+    )
+
+
 class Deck(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
     date_created = db.Column(db.DateTime, default=datetime.now)
+    version = db.Column(db.Integer, default=0, nullable=False)  # bumped on any change to the deck's cards, used for ETags
     
-    # Many-to-many relationship with Card
-    cards = db.relationship('Card', secondary=deck_cards, lazy='subquery',
+    # Many-to-many relationship with Card. Loaded only when accessed: most
+    # requests load a deck just for its id, and the cards carry their images.
+    cards = db.relationship('Card', secondary=deck_cards, lazy=True,
                            backref=db.backref('decks', lazy=True))
     
     # One-to-many relationship with Session
     sessions = db.relationship('Session', backref='deck_info', lazy=True)
+    
+    @staticmethod
+    def bump_version(deck_ids):
+        if not deck_ids:
+            return
+        db.session.execute(update(Deck).where(Deck.id.in_(deck_ids))
+                           .values(version=func.coalesce(Deck.version, 0) + 1)
+                           .execution_options(synchronize_session=False))
+    
+    @staticmethod
+    def bump_versions_for_card(card_id):
+        # Every deck the card currently belongs to
+        containing = select(deck_cards.c.deck_id).where(deck_cards.c.card_id == card_id)
+        db.session.execute(update(Deck).where(Deck.id.in_(containing))
+                           .values(version=func.coalesce(Deck.version, 0) + 1)
+                           .execution_options(synchronize_session=False))
+
+
+CHUNK_SIZE = 900  # ids per IN (...) list, below SQLite's bound parameter limit
+
+
+def chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def srs_transition(model, rating, now):
+    # Column updates for one review, as SQL expressions on model's current
+    # row (Card or UserCardState)
+    if rating >= 7:
+        streak = func.coalesce(model.mature_streak, 0) + 1
+        return {
+            'mature_streak': streak,
+            'is_mature': case((streak >= 4, True), else_=func.coalesce(model.is_mature, False)),
+        }
+    return {'mature_streak': 0, 'is_mature': False, 'last_wrong': now}
+
+
+def apply_srs_transition(mature_streak, is_mature, last_wrong, rating, timestamp):
+    # srs_transition for states replayed or cached in Python: the
+    # (mature_streak, is_mature, last_wrong) after one review
+    if rating >= 7:
+        mature_streak = (mature_streak or 0) + 1
+        return mature_streak, bool(is_mature) or mature_streak >= 4, last_wrong
+    return 0, False, timestamp
 
 
 class Card(db.Model):
@@ -77,62 +178,90 @@ class Card(db.Model):
     back = db.Column(db.Text, nullable=False)
     front_image = db.Column(db.Text)  # Base64 encoded image
     back_image = db.Column(db.Text)  # Base64 encoded image
+    front_thumbnail = db.Column(db.Text)  # Base64 WebP, set by images.py
+    back_thumbnail = db.Column(db.Text)
     card_type = db.Column(db.String(50), default="Basic")
     date_added = db.Column(db.DateTime, default=datetime.now)
+    cloned_from = db.Column(db.Integer, nullable=True, index=True)  # source card of a copy
     
-    # Card SRS data
+    # Card SRS data, over every user's reviews of the card. The scheduler
+    # uses each user's own state in UserCardState.
     reviews = db.relationship('Review', backref='card_info', lazy=True)
     mature_streak = db.Column(db.Integer, default=0)
     last_wrong = db.Column(db.DateTime, nullable=True)
     is_mature = db.Column(db.Boolean, default=False)
+    # Outcomes of reviews moved to ReviewArchive by compaction.py
+    archived_successes = db.Column(db.Integer, default=0, nullable=False)
+    archived_failures = db.Column(db.Integer, default=0, nullable=False)
     
-    def add_review(self, rating, session_id=None):
+    def add_review(self, rating, session_id=None, user_id=None):
+        now = datetime.now()
         review = Review(
             card_id=self.id,
+            user_id=user_id,
             rating=rating,
-            session_id=session_id
+            session_id=session_id,
+            timestamp=now
         )
         db.session.add(review)
         
-        # Update card maturity status
-        if rating >= 7:
-            self.mature_streak += 1
-            if self.mature_streak >= 4:
-                self.is_mature = True
-        else:
-            self.mature_streak = 0
-            self.is_mature = False
-            self.last_wrong = datetime.now()
+        # Update card maturity status in a single UPDATE evaluated against the
+        # current row, so concurrent reviews of the same card can't lose updates
+        db.session.execute(update(Card).where(Card.id == self.id).values(**srs_transition(Card, rating, now))
+                           .execution_options(synchronize_session=False))
+        db.session.expire(self, ['mature_streak', 'is_mature', 'last_wrong'])
+        
+        # The same transition on the reviewing user's own state for the card
+        if user_id is not None:
+            UserCardState.ensure(user_id, self.id)
+            db.session.execute(update(UserCardState)
+                               .where(UserCardState.user_id == user_id, UserCardState.card_id == self.id)
+                               .values(**srs_transition(UserCardState, rating, now))
+                               .execution_options(synchronize_session=False))
+        return review
     
     def get_ratings(self):
         return [review.rating for review in self.reviews]
     
+    def outcome_counts(self):
+        # (successes, failures) over all reviews, archived ones included
+        ratings = self.get_ratings()
+        success = sum(r >= 7 for r in ratings)
+        return success + (self.archived_successes or 0), len(ratings) - success + (self.archived_failures or 0)
+    
     def get_review_times(self):
         return [review.timestamp for review in self.reviews]
     
     def review_count(self):
-        return len(self.reviews)
+        return len(self.reviews) + (self.archived_successes or 0) + (self.archived_failures or 0)
     
     def time_since_added(self):
         return (datetime.now() - self.date_added).total_seconds() / 60
     
-    def to_dict(self):
-        latest_review = max((r.timestamp for r in self.reviews), default=None) if self.reviews else None
+    def to_dict(self, state=None, thumbnails=False):
+        # A cached CardState (card_cache.py) can supply the review fields
+        # instead of loading this card's reviews. With thumbnails, list views
+        # get the small variants (or the full image until they exist).
+        if state is not None:
+            latest_review, review_count, is_mature = state.last_review, state.review_count(), state.is_mature
+        else:
+            latest_review = max((r.timestamp for r in self.reviews), default=None) if self.reviews else None
+            review_count, is_mature = self.review_count(), self.is_mature
         return {
             'id': self.id,
             'front': self.front,
             'back': self.back,
-            'frontImage': self.front_image,
-            'backImage': self.back_image,
+            'frontImage': (self.front_thumbnail or self.front_image) if thumbnails else self.front_image,
+            'backImage': (self.back_thumbnail or self.back_image) if thumbnails else self.back_image,
             'type': self.card_type,
             'last_review': latest_review.isoformat() if latest_review else None,
-            'review_count': len(self.reviews),
-            'is_mature': self.is_mature
+            'review_count': review_count,
+            'is_mature': is_mature
         }
 
 
 class Session(db.Model):
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(SessionKey, primary_key=True, default=lambda: str(uuid.uuid4()))
     name = db.Column(db.String(100), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     deck_id = db.Column(db.Integer, db.ForeignKey('deck.id'), nullable=False)
@@ -142,12 +271,16 @@ class Session(db.Model):
     # Relationship with Review
     reviews = db.relationship('Review', backref='session_info', lazy=True)
     
+    # Rolled-up review statistics, maintained by rollups.record_review
+    stats = db.relationship('SessionStats', uselist=False, lazy=True)
+    
     # Add explicit references to user_profile and deck_info relations (they are defined in the parent models' backrefs)
     # but making them explicit here for better code readability
     
     def add_review(self, card_id, rating):
         review = Review(
             card_id=card_id,
+            user_id=self.user_id,
             rating=rating,
             session_id=self.id
         )
@@ -161,16 +294,16 @@ class Session(db.Model):
         return (end - self.start_time).total_seconds() / 60
     
     def success_rate(self):
-        if not self.reviews:
+        if not self.stats or not self.stats.review_count:
             return 0
-        return sum(review.rating >= 7 for review in self.reviews) / len(self.reviews)
+        return self.stats.success_count / self.stats.review_count
     
     def cards_studied(self):
-        # Return unique card IDs that were reviewed in this session
-        return len(set(review.card_id for review in self.reviews))
+        # Number of unique cards reviewed in this session
+        return self.stats.card_count if self.stats else 0
     
     def reviews_count(self):
-        return len(self.reviews)
+        return self.stats.review_count if self.stats else 0
     
     def to_dict(self):
         return {
@@ -190,6 +323,119 @@ class Session(db.Model):
 class Review(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     card_id = db.Column(db.Integer, db.ForeignKey('card.id'), nullable=False)
-    session_id = db.Column(db.String(36), db.ForeignKey('session.id'), nullable=True)
+    # Reviewing user; NULL only for old sessionless reviews that
+    # `flask attribute-reviews` could not attribute
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    session_id = db.Column(SessionKey, db.ForeignKey('session.id'), nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.now)
-    rating = db.Column(db.Integer, nullable=False)  # 0-10 rating
\ No newline at end of file
+    rating = db.Column(db.Integer, nullable=False)  # 0-10 rating
+    
+    __table_args__ = (
+        db.Index('ix_review_card_timestamp', 'card_id', 'timestamp'),
+        db.Index('ix_review_session_card', 'session_id', 'card_id'),
+        db.Index('ix_review_user_card_timestamp', 'user_id', 'card_id', 'timestamp'),
+    )
+
+
+class ReviewArchive(db.Model):
+    # Reviews moved out of the review table by compaction.py. Cards keep the
+    # counts of these in archived_successes/archived_failures.
+    id = db.Column(db.Integer, primary_key=True)  # the review's original id
+    card_id = db.Column(db.Integer, db.ForeignKey('card.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    session_id = db.Column(SessionKey, db.ForeignKey('session.id'), nullable=True)
+    timestamp = db.Column(db.DateTime)
+    rating = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_review_archive_card_timestamp', 'card_id', 'timestamp'),
+        db.Index('ix_review_archive_archived_at', 'archived_at'),
+        db.Index('ix_review_archive_user_card_timestamp', 'user_id', 'card_id', 'timestamp'),
+    )
+
+
+class UserCardState(db.Model):
+    # One user's scheduling state for one card: the Card SRS columns, but
+    # over that user's reviews only. Created by the user's first review of
+    # the card (or by `flask attribute-reviews` for older history); no row
+    # means the user has never reviewed the card.
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    card_id = db.Column(db.Integer, db.ForeignKey('card.id'), primary_key=True)
+    mature_streak = db.Column(db.Integer, default=0, nullable=False)
+    last_wrong = db.Column(db.DateTime, nullable=True)
+    is_mature = db.Column(db.Boolean, default=False, nullable=False)
+    archived_successes = db.Column(db.Integer, default=0, nullable=False)
+    archived_failures = db.Column(db.Integer, default=0, nullable=False)
+    
+    @staticmethod
+    def ensure(user_id, card_id):
+        # Create the row unless it exists, without racing a concurrent review
+        table = UserCardState.__table__
+        row = {'user_id': user_id, 'card_id': card_id, 'mature_streak': 0, 'is_mature': False,
+               'archived_successes': 0, 'archived_failures': 0}
+        dialect = db.session.get_bind().dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            insert = sqlite_insert if dialect == 'sqlite' else postgresql_insert
+            db.session.execute(insert(table).values(**row).on_conflict_do_nothing())
+        elif db.session.get(UserCardState, (user_id, card_id)) is None:
+            db.session.execute(table.insert().values(**row))
+
+
+class IdempotencyKey(db.Model):
+    # Outcome of a review submitted with an Idempotency-Key, replayed to
+    # retries of the same request until it expires (idempotency.py)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)  # sha256 of the request body
+    status_code = db.Column(db.Integer, nullable=True)  # NULL while the request is being processed
+    response = db.Column(JSONDocument, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_idempotency_key_created_at', 'created_at'),
+    )
+
+
+# ------------------- ROLLUPS -------------------
+
+class RatingHistogramMixin:
+    # Counts per rating 0-10, as plain integer columns so the review path can
+    # increment them with atomic UPDATEs
+    rating_0 = db.Column(db.Integer, default=0, nullable=False)
+    rating_1 = db.Column(db.Integer, default=0, nullable=False)
+    rating_2 = db.Column(db.Integer, default=0, nullable=False)
+    rating_3 = db.Column(db.Integer, default=0, nullable=False)
+    rating_4 = db.Column(db.Integer, default=0, nullable=False)
+    rating_5 = db.Column(db.Integer, default=0, nullable=False)
+    rating_6 = db.Column(db.Integer, default=0, nullable=False)
+    rating_7 = db.Column(db.Integer, default=0, nullable=False)
+    rating_8 = db.Column(db.Integer, default=0, nullable=False)
+    rating_9 = db.Column(db.Integer, default=0, nullable=False)
+    rating_10 = db.Column(db.Integer, default=0, nullable=False)
+    
+    def get_rating_histogram(self):
+        return [getattr(self, f'rating_{r}') or 0 for r in range(11)]
+
+
+class DailyStats(RatingHistogramMixin, db.Model):
+    # Reviews per (user, deck, day). Reviews without a user (old sessionless
+    # ones) are kept under user_id 0. Rows with deck_id 0 are the user's
+    # totals across all decks.
+    user_id = db.Column(db.Integer, primary_key=True)
+    deck_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    review_count = db.Column(db.Integer, default=0, nullable=False)
+    success_count = db.Column(db.Integer, default=0, nullable=False)
+    card_count = db.Column(db.Integer, default=0, nullable=False)  # distinct cards reviewed
+    
+    __table_args__ = (
+        db.Index('ix_daily_stats_deck_day', 'deck_id', 'day'),
+    )
+
+
+class SessionStats(RatingHistogramMixin, db.Model):
+    session_id = db.Column(SessionKey, db.ForeignKey('session.id'), primary_key=True)
+    review_count = db.Column(db.Integer, default=0, nullable=False)
+    success_count = db.Column(db.Integer, default=0, nullable=False)
+    card_count = db.Column(db.Integer, default=0, nullable=False)  # distinct cards reviewed
@@ -0,0 +1,196 @@
+from models import Card, Session, apply_srs_transition
+from compaction import review_log
+from scheduling import adaptive_decay
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import math
+import os
+
+import sqlalchemy as sa
+
+# ------------------- HISTORICAL REPLAY -------------------
+#
+# Streams the review log in timestamp order and rebuilds every (user, card)'s
+# scheduling state as it goes. Before each review is applied, the recall the
+# scheduler would have predicted at that moment is scored against the actual
+# outcome. Cards are partitioned by id across worker processes; each worker
+# streams only its own partition and evaluates the whole parameter grid in a
+# single pass, so the log is read once in total.
+
+DEFAULT_GRID = {
+    'target_recall': [0.7],
+    'history_window': [5],
+    'maturity_multiplier': [0.6],
+    'base_decay': [0.03],
+}
+N_BUCKETS = 10
+EPS = 1e-6
+CHUNK_SIZE = 10000
+
+_Obs = namedtuple('_Obs', 'timestamp rating')
+
+
+class _ReplayCard:
+    # Carries just the parts of Card that the scheduler reads
+    __slots__ = ('reviews', 'mature_streak', 'is_mature', 'last_wrong', 'successes', 'failures', 'date_added')
+
+    def __init__(self, date_added, window):
+        self.reviews = deque(maxlen=window)
+        self.mature_streak = 0
+        self.is_mature = False
+        self.last_wrong = None
+        self.successes = 0
+        self.failures = 0
+        self.date_added = date_added
+
+    def apply(self, timestamp, rating):
+        # Same transitions as Card.add_review
+        self.reviews.append(_Obs(timestamp, rating))
+        self.mature_streak, self.is_mature, self.last_wrong = apply_srs_transition(
+            self.mature_streak, self.is_mature, self.last_wrong, rating, timestamp)
+        if rating >= 7:
+            self.successes += 1
+        else:
+            self.failures += 1
+
+
+def parameter_grid(grid=None):
+    grid = {**DEFAULT_GRID, **(grid or {})}
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in product(*(grid[k] for k in keys))]
+
+
+def predict(card, params, now):
+    # Point prediction of the model behind sample_next_review: recall decays
+    # as p0 * exp(-decay * t / age_factor) with p0 ~ Beta(alpha, beta).
+    alpha = 1.0 + card.successes
+    beta = 1.0 + card.failures
+    mean_p0 = alpha / (alpha + beta)
+    decay = adaptive_decay(card, None,
+                           base_decay=params['base_decay'],
+                           history_window=params['history_window'],
+                           maturity_multiplier=params['maturity_multiplier'])
+    time_since = max(0, (now - card.date_added).total_seconds() / 60)
+    age_factor = 1 + (card.mature_streak // 2) + (time_since / (60 * 24 * 7))
+
+    elapsed = (now - card.reviews[-1].timestamp).total_seconds() / 60
+    recall = mean_p0 * math.exp(-decay * elapsed / age_factor)
+
+    target = params['target_recall']
+    if mean_p0 <= target:
+        due = age_factor
+    else:
+        due = max(1, math.log(mean_p0 / target) / decay) * age_factor
+    return recall, elapsed >= due
+
+
+def _empty_metrics():
+    return {
+        'count': 0,
+        'log_loss': 0.0,
+        'brier': 0.0,
+        'due_count': 0,
+        'due_success': 0,
+        'buckets': [[0, 0.0, 0] for _ in range(N_BUCKETS)],  # count, sum predicted, successes
+    }
+
+
+def _merge_metrics(total, part):
+    for key in ('count', 'log_loss', 'brier', 'due_count', 'due_success'):
+        total[key] += part[key]
+    for bucket, other in zip(total['buckets'], part['buckets']):
+        for i in range(3):
+            bucket[i] += other[i]
+    return total
+
+
+def _replay_partition(db_uri, partition, n_partitions, settings, chunk_size):
+    window = max(2, max(s['history_window'] for s in settings))
+    metrics = [_empty_metrics() for _ in settings]
+    state = {}
+
+    reviews = review_log()  # archived reviews included
+    cards = Card.__table__
+    sessions = Session.__table__
+    # Unattributed reviews belong to their session's user
+    user_id = sa.func.coalesce(reviews.c.user_id, sessions.c.user_id)
+    engine = sa.create_engine(db_uri)
+    try:
+        with engine.connect() as conn:
+            date_added = dict(conn.execute(
+                sa.select(cards.c.id, cards.c.date_added)
+                .where(cards.c.id % n_partitions == partition)).all())
+
+            result = conn.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(
+                sa.select(user_id, reviews.c.card_id, reviews.c.timestamp, reviews.c.rating)
+                .select_from(reviews.outerjoin(sessions, reviews.c.session_id == sessions.c.id))
+                .where(reviews.c.card_id % n_partitions == partition)
+                .order_by(reviews.c.timestamp, reviews.c.id))
+
+            for user_id, card_id, timestamp, rating in result:
+                card = state.get((user_id, card_id))
+                if card is None:
+                    card = state[user_id, card_id] = _ReplayCard(date_added.get(card_id) or timestamp, window)
+                elif card.reviews:
+                    outcome = 1 if rating >= 7 else 0
+                    for params, m in zip(settings, metrics):
+                        recall, due = predict(card, params, timestamp)
+                        p = min(max(recall, EPS), 1 - EPS)
+                        m['count'] += 1
+                        m['log_loss'] -= math.log(p) if outcome else math.log(1 - p)
+                        m['brier'] += (recall - outcome) ** 2
+                        bucket = m['buckets'][min(int(recall * N_BUCKETS), N_BUCKETS - 1)]
+                        bucket[0] += 1
+                        bucket[1] += recall
+                        bucket[2] += outcome
+                        if due:
+                            m['due_count'] += 1
+                            m['due_success'] += outcome
+                card.apply(timestamp, rating)
+    finally:
+        engine.dispose()
+
+    return metrics
+
+
+def _summarize(params, m):
+    count = m['count']
+    return {
+        'params': params,
+        'reviews_scored': count,
+        'log_loss': m['log_loss'] / count if count else None,
+        'brier': m['brier'] / count if count else None,
+        # Observed recall on reviews taken at or after the scheduled interval;
+        # a well-tuned target_recall should roughly match it.
+        'recall_when_due': m['due_success'] / m['due_count'] if m['due_count'] else None,
+        'calibration': [{
+            'bucket': f"{i / N_BUCKETS:.1f}-{(i + 1) / N_BUCKETS:.1f}",
+            'count': n,
+            'predicted': total / n,
+            'observed': successes / n,
+        } for i, (n, total, successes) in enumerate(m['buckets']) if n],
+    }
+
+
+def run_replay(db_uri, grid=None, workers=None, chunk_size=CHUNK_SIZE):
+    settings = parameter_grid(grid)
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        parts = [_replay_partition(db_uri, 0, 1, settings, chunk_size)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_replay_partition, db_uri, k, workers, settings, chunk_size)
+                       for k in range(workers)]
+            parts = [f.result() for f in futures]
+
+    results = []
+    for i, params in enumerate(settings):
+        total = _empty_metrics()
+        for part in parts:
+            _merge_metrics(total, part[i])
+        results.append(_summarize(params, total))
+
+    results.sort(key=lambda r: float('inf') if r['log_loss'] is None else r['log_loss'])
+    return results
@@ -0,0 +1,223 @@
+from models import db, DailyStats, SessionStats, Session, Review, deck_cards
+from compaction import review_log
+from datetime import datetime
+
+from sqlalchemy import case, delete, func, literal, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+# ------------------- ROLLUPS -------------------
+#
+# Per-(user, deck, day) and per-session review counters, kept up to date by
+# the review write path so stats and session listings never rescan the
+# review history. Rows with deck_id ALL_DECKS hold a user's totals across all
+# decks, so a card that sits in several decks is only counted once there.
+# `flask rebuild-rollups` recomputes everything from scratch.
+#
+# Counters are only ever changed with `column = column + n` upserts, so
+# concurrent reviews never overwrite each other's increments.
+
+RATING_LEVELS = 11  # ratings are 0-10
+ALL_DECKS = 0
+NO_USER = 0  # reviews without a user (old sessionless ones)
+
+
+def _increment(model, key, increments):
+    table = model.__table__
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite_insert if dialect == 'sqlite' else postgresql_insert
+        stmt = insert(table).values(**key, **increments)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key),
+            set_={column: table.c[column] + stmt.excluded[column] for column in increments})
+        db.session.execute(stmt)
+        return
+
+    # Generic fallback: update, and insert if the row doesn't exist yet
+    updated = db.session.execute(
+        update(table)
+        .where(*[table.c[column] == value for column, value in key.items()])
+        .values({column: table.c[column] + n for column, n in increments.items()})).rowcount
+    if not updated:
+        db.session.execute(table.insert().values(**key, **increments))
+
+
+def record_review(card, rating, session=None, timestamp=None, user_id=None):
+    # Must run before the review itself is added, so the "seen before"
+    # checks below only see earlier reviews. The reviewing user defaults to
+    # the session's.
+    timestamp = timestamp or datetime.now()
+    day = timestamp.date()
+    day_start = datetime.combine(day, datetime.min.time())
+    if user_id is None:
+        user_id = session.user_id if session else NO_USER
+
+    with db.session.no_autoflush:
+        reviewer = Review.user_id == None if user_id == NO_USER else Review.user_id == user_id
+        earlier_today = Review.query.filter(reviewer, Review.card_id == card.id, Review.timestamp >= day_start)
+        new_today = not db.session.query(earlier_today.exists()).scalar()
+
+        new_in_session = session is not None and not db.session.query(
+            Review.query.filter_by(session_id=session.id, card_id=card.id).exists()).scalar()
+
+    increments = {'review_count': 1, 'success_count': 1 if rating >= 7 else 0}
+    if 0 <= rating < RATING_LEVELS:
+        increments[f'rating_{rating}'] = 1
+
+    for deck_id in [ALL_DECKS] + [deck.id for deck in card.decks]:
+        _increment(DailyStats, {'user_id': user_id, 'deck_id': deck_id, 'day': day},
+                   {**increments, 'card_count': 1 if new_today else 0})
+
+    if session:
+        _increment(SessionStats, {'session_id': session.id},
+                   {**increments, 'card_count': 1 if new_in_session else 0})
+
+
+def _counters(reviews):
+    return [
+        func.count(reviews.c.id),
+        func.sum(case((reviews.c.rating >= 7, 1), else_=0)),
+        func.count(func.distinct(reviews.c.card_id)),
+        *[func.sum(case((reviews.c.rating == r, 1), else_=0)) for r in range(RATING_LEVELS)],
+    ]
+
+
+def _counter_values(reviews, successes, cards, histogram):
+    return {
+        'review_count': reviews,
+        'success_count': successes,
+        'card_count': cards,
+        **{f'rating_{r}': int(n) for r, n in enumerate(histogram)},
+    }
+
+
+# ------------------- CARD DELETES AND MOVES -------------------
+#
+# Deleting cards deletes their reviews, and moving cards changes which deck's
+# rows their reviews count towards, so both adjust the rollups in their own
+# transaction instead of leaving them to a rebuild. The reviews' contribution
+# is computed like rebuild_rollups does; card_count is a distinct count, and
+# distinct counts of different cards add up, so it can be shifted too.
+
+def _day(value):
+    return datetime.strptime(str(value), '%Y-%m-%d').date()
+
+
+def _daily_contributions(card_ids, deck_id=None, every_deck=False):
+    # (user, deck, day, counters...) of the cards' reviews: towards deck_id,
+    # each deck the cards are in, or (neither) the all-deck rows
+    reviews = review_log()
+    day = func.date(reviews.c.timestamp)
+    user_id = func.coalesce(reviews.c.user_id, Session.user_id, NO_USER)
+    deck = deck_cards.c.deck_id if every_deck else literal(ALL_DECKS if deck_id is None else deck_id)
+    query = (db.session.query(user_id, deck, day, *_counters(reviews))
+             .select_from(reviews)
+             .outerjoin(Session, reviews.c.session_id == Session.id)
+             .filter(reviews.c.card_id.in_(card_ids)))
+    if every_deck:
+        query = query.join(deck_cards, deck_cards.c.card_id == reviews.c.card_id)
+        return query.group_by(user_id, deck_cards.c.deck_id, day).all()
+    return query.group_by(user_id, day).all()
+
+
+def _session_contributions(card_ids):
+    reviews = review_log()
+    return (db.session.query(reviews.c.session_id, *_counters(reviews))
+            .filter(reviews.c.card_id.in_(card_ids), reviews.c.session_id != None)
+            .group_by(reviews.c.session_id).all())
+
+
+def _shift_daily(rows, sign):
+    for user_id, deck_id, day, count, successes, cards, *histogram in rows:
+        values = _counter_values(count, successes, cards, histogram)
+        _increment(DailyStats, {'user_id': user_id, 'deck_id': deck_id, 'day': _day(day)},
+                   {column: sign * n for column, n in values.items()})
+
+
+def _drop_empty(daily_rows, session_rows):
+    # Rows left without reviews, which a rebuild wouldn't have
+    if daily_rows:
+        db.session.execute(delete(DailyStats).where(
+            DailyStats.user_id.in_({row[0] for row in daily_rows}),
+            DailyStats.deck_id.in_({row[1] for row in daily_rows}),
+            DailyStats.review_count <= 0))
+    if session_rows:
+        db.session.execute(delete(SessionStats).where(
+            SessionStats.session_id.in_([row[0] for row in session_rows]),
+            SessionStats.review_count <= 0))
+
+
+def remove_card_reviews(card_ids):
+    # Before the cards' reviews and deck links are deleted
+    daily = _daily_contributions(card_ids, every_deck=True) + _daily_contributions(card_ids)
+    sessions = _session_contributions(card_ids)
+    _shift_daily(daily, -1)
+    for session_id, count, successes, cards, *histogram in sessions:
+        values = _counter_values(count, successes, cards, histogram)
+        _increment(SessionStats, {'session_id': session_id}, {column: -n for column, n in values.items()})
+    _drop_empty(daily, sessions)
+
+
+def move_card_reviews(card_ids, deck_id, target_id, added_ids):
+    # card_ids leave deck_id; added_ids (those not already in the target)
+    # join target_id. The all-deck and session rows don't change.
+    removed = _daily_contributions(card_ids, deck_id=deck_id)
+    _shift_daily(removed, -1)
+    if added_ids:
+        _shift_daily(_daily_contributions(added_ids, deck_id=target_id), 1)
+    _drop_empty(removed, [])
+
+
+def rebuild_rollups():
+    DailyStats.query.delete()
+    SessionStats.query.delete()
+
+    # Archived reviews count too
+    reviews = review_log()
+    day = func.date(reviews.c.timestamp)
+    user_id = func.coalesce(reviews.c.user_id, Session.user_id, NO_USER)
+    per_deck = (db.session.query(user_id, deck_cards.c.deck_id, day, *_counters(reviews))
+                .select_from(reviews)
+                .join(deck_cards, deck_cards.c.card_id == reviews.c.card_id)
+                .outerjoin(Session, reviews.c.session_id == Session.id)
+                .group_by(user_id, deck_cards.c.deck_id, day))
+    all_decks = (db.session.query(user_id, literal(ALL_DECKS), day, *_counters(reviews))
+                 .select_from(reviews)
+                 .outerjoin(Session, reviews.c.session_id == Session.id)
+                 .group_by(user_id, day))
+
+    daily_rows = [{
+        'user_id': user,
+        'deck_id': deck,
+        'day': datetime.strptime(str(day_value), '%Y-%m-%d').date(),
+        **_counter_values(count, successes, cards, histogram),
+    } for query in (per_deck, all_decks)
+      for user, deck, day_value, count, successes, cards, *histogram in query]
+
+    sessions = (db.session.query(reviews.c.session_id, *_counters(reviews))
+                .filter(reviews.c.session_id != None)
+                .group_by(reviews.c.session_id))
+
+    session_rows = [{
+        'session_id': session_id,
+        **_counter_values(count, successes, cards, histogram),
+    } for session_id, count, successes, cards, *histogram in sessions]
+
+    db.session.bulk_insert_mappings(DailyStats, daily_rows)
+    db.session.bulk_insert_mappings(SessionStats, session_rows)
+    db.session.commit()
+    print(f"Rebuilt {len(daily_rows)} daily and {len(session_rows)} session rollups")
+
+
+def daily_series(user_id=None, deck_id=None):
+    # (day, reviews, successes) for one user and/or one deck; without a deck
+    # the user's all-deck rows are used, without a user all users are summed
+    query = db.session.query(DailyStats.day,
+                             func.sum(DailyStats.review_count),
+                             func.sum(DailyStats.success_count))
+    if user_id is not None:
+        query = query.filter(DailyStats.user_id == user_id)
+    query = query.filter(DailyStats.deck_id == (ALL_DECKS if deck_id is None else deck_id))
+    return query.group_by(DailyStats.day).order_by(DailyStats.day).all()
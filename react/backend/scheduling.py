@@ -0,0 +1,181 @@
+import numpy as np
+from datetime import datetime
+import random
+
+# ------------------- BAYESIAN MODEL -------------------
+
+def bayesian_posterior(card, prior_alpha=1.0, prior_beta=1.0):
+    success, fail = card.outcome_counts()
+    if not success and not fail:
+        return prior_alpha, prior_beta
+    return prior_alpha + success, prior_beta + fail
+
+def adaptive_decay(card, user_profile, base_decay=None, history_window=5, maturity_multiplier=0.6):
+    reviews = card.reviews
+    if base_decay is None:
+        base_decay = user_profile.global_decay
+    if len(reviews) < 2:
+        return base_decay
+        
+    # Get the most recent reviews
+    window = sorted(reviews, key=lambda x: x.timestamp)[-history_window:]
+    decay = base_decay
+    
+    for i in range(1, len(window)):
+        t0, rating0 = window[i-1].timestamp, window[i-1].rating
+        t1, rating1 = window[i].timestamp, window[i].rating
+        delta_t = (t1 - t0).total_seconds() / 60
+        delta_rating = rating1 - rating0
+        if delta_rating < 0:
+            decay += abs(delta_rating) * delta_t / 10000
+        elif delta_rating > 0 and delta_t > 10:
+            decay *= 0.97
+            
+    # reward for maturity streak
+    if card.mature_streak > 3:
+        decay *= maturity_multiplier
+    return max(0.001, decay)
+
+def sample_next_review(card, user_profile, target_recall=0.7, n_samples=3000):
+    try:
+        alpha, beta = bayesian_posterior(card)
+        decay = adaptive_decay(card, user_profile)
+        p0_samples = np.random.beta(alpha, beta, n_samples)
+        with np.errstate(divide='ignore'):
+            t_samples = np.where(p0_samples <= target_recall, 1.0,
+                                 np.maximum(1.0, np.log(p0_samples / target_recall) / decay))
+        
+        # Safely handle streak/age calculation
+        try:
+            mature_streak = getattr(card, 'mature_streak', 0)
+            # Safely call time_since_added
+            time_since = 0
+            try:
+                time_since = card.time_since_added()
+            except Exception:
+                # If time_since_added fails, calculate directly if possible
+                if hasattr(card, 'date_added'):
+                    time_since = (datetime.now() - card.date_added).total_seconds() / 60
+            
+            age_factor = 1 + (mature_streak // 2) + (time_since / (60 * 24 * 7))
+            t_samples = t_samples * age_factor
+        except Exception as e:
+            print(f"Error calculating age factor: {str(e)}")
+            # Continue without applying age factor if there's an error
+        
+        # Add random jitter for multi-scale spacing
+        interval = int(np.percentile(t_samples, np.random.uniform(30, 80)))
+        return interval, t_samples
+    except Exception as e:
+        print(f"Error in sample_next_review: {str(e)}")
+        # Return default values if anything fails
+        return 1, np.ones(n_samples)
+
+def interval_to_text(minutes):
+    if minutes < 60:
+        return f"{minutes} minutes"
+    elif minutes < 1440:
+        return f"{minutes // 60} hours"
+    else:
+        days = minutes // 1440
+        hours = (minutes % 1440) // 60
+        return f"{days} days, {hours} hours" if hours else f"{days} days"
+
+def get_recent_posterior(user_profile, window=30, prior_alpha=2, prior_beta=1):
+    recent = user_profile.get_recall_history()[-window:]
+    successes = sum(s for _, s in recent)
+    failures = len(recent) - successes
+    alpha = prior_alpha + successes
+    beta = prior_beta + failures
+    return alpha, beta
+
+def sample_success_rate(alpha, beta, n_samples=1000):
+    return np.random.beta(alpha, beta, n_samples)
+
+def bayesian_success_rate_interval(interval, alpha, beta, target=0.8, sensitivity=0.2):
+    p_samples = np.random.beta(alpha, beta, 1000)
+    mean_p = np.mean(p_samples)
+    correction = 1 + sensitivity * (mean_p - target)
+    return int(max(1, interval * correction))
+
+# ------------------- SCHEDULER -------------------
+
+RECENTLY_WRONG_SECONDS = 48 * 3600  # a card missed this recently is urgent even if mature
+
+class DeckState:
+    # The fields the scheduler classifies cards on, as parallel arrays over a
+    # deck's cards (ORM cards or cached CardStates). Built once per deck and
+    # kept current with update() rather than rebuilt for every request.
+    def __init__(self, cards):
+        self.cards = list(cards)
+        self.index = {card.id: i for i, card in enumerate(self.cards)}
+        self.review_counts = np.zeros(len(self.cards), dtype=np.int64)
+        self.is_mature = np.zeros(len(self.cards), dtype=bool)
+        self.last_wrong = np.full(len(self.cards), np.nan)  # epoch seconds, NaN if never wrong
+        for i, card in enumerate(self.cards):
+            self._set_row(i, card)
+
+    def __len__(self):
+        return len(self.cards)
+
+    def _set_row(self, i, card):
+        self.review_counts[i] = card.review_count()
+        self.is_mature[i] = bool(card.is_mature)
+        self.last_wrong[i] = card.last_wrong.timestamp() if card.last_wrong else np.nan
+
+    def update(self, card):
+        # Refresh one card's row after it was reviewed
+        i = self.index.get(card.id)
+        if i is not None:
+            self.cards[i] = card
+            self._set_row(i, card)
+
+    def size(self):
+        return (self.review_counts.nbytes + self.is_mature.nbytes + self.last_wrong.nbytes
+                + len(self.cards) * 8 + len(self.index) * 100)
+
+
+class Scheduler:
+    def __init__(self, user_profile, cards):
+        self.user_profile = user_profile
+        self.deck = cards if isinstance(cards, DeckState) else DeckState(cards)
+        self.cards = self.deck.cards
+        self.card_review_counts = np.zeros(len(self.cards), dtype=np.int64)  # For per-session review limits
+
+    def _pick(self, mask):
+        candidates = np.flatnonzero(mask)
+        i = candidates[random.randrange(len(candidates))]
+        self.card_review_counts[i] += 1
+        return self.cards[i]
+
+    def select_next_card(self, backlog_limit=50, max_reviews_per_card=2):
+        deck = self.deck
+        if not len(deck):
+            return None
+        
+        available = self.card_review_counts < max_reviews_per_card
+        new = available & (deck.review_counts == 0)
+        with np.errstate(invalid='ignore'):
+            recently_wrong = datetime.now().timestamp() - deck.last_wrong < RECENTLY_WRONG_SECONDS
+        urgent = available & ~new & (~deck.is_mature | recently_wrong)
+        mature = available & ~new & ~urgent
+        
+        # Same distribution as shuffling each bucket and choosing uniformly
+        # from urgents[:backlog_limit] + news[:3] + matures[:5], cut to
+        # backlog_limit: pick a bucket in proportion to its share of that
+        # list, then any card of the bucket uniformly
+        n_urgent = min(int(np.count_nonzero(urgent)), backlog_limit)
+        n_new = min(int(np.count_nonzero(new)), 3, backlog_limit - n_urgent)
+        n_mature = min(int(np.count_nonzero(mature)), 5, backlog_limit - n_urgent - n_new)
+        
+        total = n_urgent + n_new + n_mature
+        if total:
+            r = random.randrange(total)
+            if r < n_urgent:
+                return self._pick(urgent)
+            if r < n_urgent + n_new:
+                return self._pick(new)
+            return self._pick(mature)
+        if available.any():
+            return self._pick(available)
+        return random.choice(self.cards)
@@ -0,0 +1,105 @@
+from models import db, Card, deck_cards
+
+from sqlalchemy import text
+
+# ------------------- FULL-TEXT SEARCH -------------------
+#
+# On SQLite, card_fts is an external-content FTS5 index over card.front and
+# card.back. Triggers keep it in sync with every insert, update and delete on
+# the card table, whichever code path makes the change. Other databases fall
+# back to an unranked LIKE scan.
+#
+# Every query is a prefix query (see _match_expression), so the index keeps
+# 2- and 3-character prefix entries. Queries let the MATCH drive the join:
+# SQLite's planner doesn't know how many rows a MATCH returns and would
+# otherwise re-run it once per card in the deck.
+
+FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS card_fts USING fts5(
+           front, back, content='card', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS card_fts_insert AFTER INSERT ON card BEGIN
+           INSERT INTO card_fts(rowid, front, back) VALUES (new.id, new.front, new.back);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS card_fts_delete AFTER DELETE ON card BEGIN
+           INSERT INTO card_fts(card_fts, rowid, front, back) VALUES ('delete', old.id, old.front, old.back);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS card_fts_update AFTER UPDATE OF front, back ON card BEGIN
+           INSERT INTO card_fts(card_fts, rowid, front, back) VALUES ('delete', old.id, old.front, old.back);
+           INSERT INTO card_fts(rowid, front, back) VALUES (new.id, new.front, new.back);
+       END""",
+]
+
+
+def fts_available():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def init_search_index():
+    if not fts_available():
+        return False
+    with db.engine.begin() as conn:
+        exists = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'card_fts'")).first()
+        for statement in FTS_SCHEMA:
+            conn.execute(text(statement))
+        if not exists:
+            # Index cards that predate the index
+            conn.execute(text("INSERT INTO card_fts(card_fts) VALUES ('rebuild')"))
+    return True
+
+
+def _match_expression(query):
+    # Quote every term so user input can't break the FTS5 query syntax, and
+    # prefix-match the last one for search-as-you-type
+    terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+    if terms:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def matching_card_ids(query):
+    # Ids of all cards matching query, as an uncorrelated subquery for IN
+    # filters, so the MATCH runs once rather than once per candidate row
+    if fts_available():
+        return text("SELECT rowid FROM card_fts WHERE card_fts MATCH :match") \
+            .bindparams(match=_match_expression(query)).columns(rowid=db.Integer)
+    pattern = f"%{query.strip()}%"
+    return db.session.query(Card.id).filter(Card.front.ilike(pattern) | Card.back.ilike(pattern)).subquery()
+
+
+def search_cards(deck_id, query, limit=20, offset=0):
+    if not query.strip():
+        return 0, []
+
+    if fts_available():
+        params = {'deck_id': deck_id, 'match': _match_expression(query),
+                  'limit': limit, 'offset': offset}
+        total = db.session.execute(text(
+            """SELECT count(*) FROM card_fts
+               CROSS JOIN deck_cards ON deck_cards.card_id = card_fts.rowid
+               WHERE card_fts MATCH :match AND deck_cards.deck_id = :deck_id"""), params).scalar()
+        rows = db.session.execute(text(
+            """SELECT card.id, card.front, card.back, card.card_type,
+                      snippet(card_fts, -1, '<mark>', '</mark>', '…', 12) AS snippet
+               FROM card_fts
+               CROSS JOIN deck_cards ON deck_cards.card_id = card_fts.rowid
+               CROSS JOIN card ON card.id = card_fts.rowid
+               WHERE card_fts MATCH :match AND deck_cards.deck_id = :deck_id
+               ORDER BY bm25(card_fts)
+               LIMIT :limit OFFSET :offset"""), params).all()
+    else:
+        pattern = f"%{query.strip()}%"
+        matches = (db.session.query(Card.id, Card.front, Card.back, Card.card_type)
+                   .join(deck_cards, deck_cards.c.card_id == Card.id)
+                   .filter(deck_cards.c.deck_id == deck_id)
+                   .filter(Card.front.ilike(pattern) | Card.back.ilike(pattern)))
+        total = matches.count()
+        rows = [(*row, None) for row in matches.order_by(Card.id).limit(limit).offset(offset).all()]
+
+    return total, [{
+        'id': card_id,
+        'front': front,
+        'back': back,
+        'type': card_type,
+        'snippet': snippet,
+    } for card_id, front, back, card_type, snippet in rows]
@@ -0,0 +1,190 @@
+from card_cache import WINDOW, card_cache
+from flask import current_app
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import os
+import random
+import threading
+
+import numpy as np
+from scipy.special import betaincinv
+
+# ------------------- SESSION INTERVAL PRECOMPUTATION -------------------
+#
+# sample_next_review draws 3000 recall probabilities from the card's Beta
+# posterior and returns a random 30th-80th percentile of the resulting
+# intervals. The interval is monotone in p0, so that percentile is the
+# interval at the same quantile of the posterior, which can be computed
+# directly. When a session starts, a background job computes, for every card
+# of the deck in one vectorized pass:
+#
+#   - log(p0 / target) at QUANTILES of the posterior,
+#   - adaptive_decay as a * base_decay + b (it is linear in base_decay
+#     before the floor), so later changes to the user's decay still apply,
+#   - the age factor.
+#
+# next_card then only interpolates one row at a random quantile. A session
+# is computed from its user's card states, and a review recomputes the
+# reviewed card's row in that user's cached sessions.
+
+TARGET_RECALL = 0.7  # sample_next_review's default
+QUANTILES = np.linspace(30, 80, 11)
+MIN_DECAY = 0.001  # adaptive_decay's floor
+MATURITY_MULTIPLIER = 0.6
+MAX_SESSIONS = int(os.environ.get('SESSION_INTERVAL_CACHE_SIZE', 32))
+PRECOMPUTE_DEFAULT = os.environ.get('SESSION_PRECOMPUTE', '1') == '1'
+
+
+def decay_coefficients(cards, history_window=WINDOW):
+    # (a, b) per card with adaptive_decay(card) == max(MIN_DECAY, a * base + b)
+    n = len(cards)
+    minutes = np.full((n, history_window), np.nan)
+    ratings = np.zeros((n, history_window))
+    counts = np.zeros(n, dtype=np.int64)
+    streaks = np.zeros(n, dtype=np.int64)
+    for i, card in enumerate(cards):
+        window = sorted(card.reviews, key=lambda r: r.timestamp)[-history_window:]
+        counts[i] = len(card.reviews)
+        streaks[i] = card.mature_streak or 0
+        for j, review in enumerate(window, start=history_window - len(window)):  # right-aligned
+            minutes[i, j] = review.timestamp.timestamp() / 60
+            ratings[i, j] = review.rating
+
+    a = np.ones(n)
+    b = np.zeros(n)
+    for j in range(1, history_window):
+        present = ~np.isnan(minutes[:, j - 1])
+        delta_t = np.where(present, minutes[:, j] - minutes[:, j - 1], 0)
+        delta_rating = np.where(present, ratings[:, j] - ratings[:, j - 1], 0)
+        b += np.where(delta_rating < 0, -delta_rating * delta_t / 10000, 0)
+        slower = (delta_rating > 0) & (delta_t > 10)
+        a = np.where(slower, a * 0.97, a)
+        b = np.where(slower, b * 0.97, b)
+
+    mature = streaks > 3
+    a = np.where(mature, a * MATURITY_MULTIPLIER, a)
+    b = np.where(mature, b * MATURITY_MULTIPLIER, b)
+    # Fewer than two reviews: the user's base decay as it is
+    few = counts < 2
+    return np.where(few, 1.0, a), np.where(few, 0.0, b)
+
+
+class SessionIntervals:
+    def __init__(self, cards, target_recall=TARGET_RECALL):
+        self.target_recall = target_recall
+        self.index = {card.id: i for i, card in enumerate(cards)}
+        n = len(cards)
+        self.a = np.ones(n)
+        self.b = np.zeros(n)
+        self.age_factor = np.ones(n)
+        self.log_ratio = np.zeros((n, len(QUANTILES)), dtype=np.float32)
+        self._compute(np.arange(n), cards)
+
+    def _compute(self, rows, cards):
+        outcomes = np.array([card.outcome_counts() for card in cards], dtype=np.float64).reshape(-1, 2)
+        alpha = 1.0 + outcomes[:, 0]
+        beta = 1.0 + outcomes[:, 1]
+        p0 = betaincinv(alpha[:, None], beta[:, None], QUANTILES[None, :] / 100)
+        self.log_ratio[rows] = np.log(np.maximum(p0, 1e-12) / self.target_recall)
+
+        self.a[rows], self.b[rows] = decay_coefficients(cards)
+
+        now = datetime.now()
+        streaks = np.array([card.mature_streak or 0 for card in cards])
+        weeks = np.array([(now - card.date_added).total_seconds() / 60 / (60 * 24 * 7) for card in cards])
+        self.age_factor[rows] = 1 + streaks // 2 + weeks
+
+    def update(self, card):
+        row = self.index.get(card.id)
+        if row is not None:
+            self._compute(np.array([row]), [card])
+
+    def sample(self, card_id, base_decay):
+        row = self.index.get(card_id)
+        if row is None:
+            return None
+        decay = max(MIN_DECAY, self.a[row] * base_decay + self.b[row])
+        intervals = np.maximum(1, self.log_ratio[row] / decay) * self.age_factor[row]
+        return int(np.interp(random.uniform(30, 80), QUANTILES, intervals))
+
+    def expected(self, base_decay):
+        # Every card's interval at the middle of sample's quantile range
+        decay = np.maximum(MIN_DECAY, self.a * base_decay + self.b)
+        intervals = np.maximum(1, self.log_ratio / decay[:, None]) * self.age_factor[:, None]
+        return intervals[:, len(QUANTILES) // 2]
+
+
+class SessionIntervalCache:
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session id -> SessionIntervals
+        self._pending = {}  # session id -> ids of cards reviewed while computing
+        self._users = {}  # session id -> user id
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def start(self, session_id, deck_id, user_id):
+        # Kick off the precomputation for a new session in the background
+        with self._lock:
+            self._pending[session_id] = set()
+            self._users[session_id] = user_id
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session-intervals')
+        return self._executor.submit(self._run, current_app._get_current_object(), session_id, deck_id, user_id)
+
+    def _run(self, app, session_id, deck_id, user_id):
+        with app.app_context():
+            try:
+                intervals = SessionIntervals(card_cache.deck_states(deck_id, user_id))
+            except Exception as e:
+                print(f"Error precomputing intervals for session {session_id}: {str(e)}")
+                with self._lock:
+                    self._pending.pop(session_id, None)
+                    self._users.pop(session_id, None)
+                return
+
+            with self._lock:
+                reviewed = self._pending.pop(session_id, None)
+                if reviewed is None:
+                    return  # ended while we were computing
+                # Reviews that arrived during the computation
+                for card_id in reviewed:
+                    state = card_cache.card_state(card_id, user_id)
+                    if state is not None:
+                        intervals.update(state)
+                self._sessions[session_id] = intervals
+                while len(self._sessions) > self.max_sessions:
+                    evicted, _ = self._sessions.popitem(last=False)
+                    self._users.pop(evicted, None)
+            print(f"Precomputed intervals for {len(intervals.index)} cards of session {session_id}")
+
+    def sample(self, session_id, card_id, base_decay):
+        # Interval in minutes, or None if this session has nothing cached for the card
+        with self._lock:
+            intervals = self._sessions.get(session_id)
+            if intervals is None:
+                return None
+            self._sessions.move_to_end(session_id)
+            return intervals.sample(card_id, base_decay)
+
+    def record_review(self, card_id, user_id):
+        # Call after the card cache has applied the review
+        state = card_cache.card_state(card_id, user_id)
+        with self._lock:
+            for session_id, reviewed in self._pending.items():
+                if self._users.get(session_id) == user_id:
+                    reviewed.add(card_id)
+            if state is not None:
+                for session_id, intervals in self._sessions.items():
+                    if self._users.get(session_id) == user_id:
+                        intervals.update(state)
+
+    def end(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._pending.pop(session_id, None)
+            self._users.pop(session_id, None)
+
+
+session_intervals = SessionIntervalCache()
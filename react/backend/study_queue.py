@@ -0,0 +1,243 @@
+from models import db, Deck, User
+from card_cache import card_cache
+from scheduling import RECENTLY_WRONG_SECONDS
+from session_intervals import SessionIntervals
+from collections import OrderedDict
+from datetime import datetime
+import heapq
+import os
+import threading
+
+import numpy as np
+
+# ------------------- CROSS-DECK STUDY QUEUE -------------------
+#
+# "Study everything due" across a user's decks. A card is due when the
+# scheduler would treat it as urgent (reviewed, and not mature or recently
+# wrong), when it is new, or when it is mature and overdue: its last review
+# is longer ago than the interval sample_next_review predicts for it (taken
+# at the middle of its jitter range, with the user's decay when the pass
+# starts). Due cards come urgent first, least recently reviewed first, then
+# overdue cards, most overdue first, then new cards, oldest first.
+#
+# Each deck keeps a heap of its due cards built from its cached DeckState
+# (card_cache.py), and a heap over the decks' head keys merges them lazily,
+# so a pick costs O(log decks) plus O(log cards) within the deck it comes
+# from. Entries are checked against the card's current state only when they
+# reach the top of their deck's heap: a card whose state changed is re-keyed,
+# and one that is no longer due is dropped. A review can also make a card
+# more urgent, so the review path pushes a fresh entry for it
+# (record_review); the stale one is dropped once the card is served.
+#
+# A card in several decks appears in each deck's heap but is served once per
+# pass; when every deck is exhausted, a new pass rebuilds the heaps from the
+# current states (and picks up new decks).
+#
+# Queues are per worker process and per (user, deck selection), kept for the
+# MAX_QUEUES most recently used.
+
+MAX_QUEUES = int(os.environ.get('STUDY_QUEUE_CACHE_SIZE', 256))
+URGENT, OVERDUE, NEW = 0, 1, 2
+
+
+def _seconds(value):
+    return value.timestamp() if value else 0.0
+
+
+class _DeckQueue:
+    __slots__ = ('deck_id', 'state', 'heap', 'listed', 'intervals')
+
+    def __init__(self, deck_id, state, served, now, base_decay):
+        self.deck_id = deck_id
+        self.state = state
+        self.listed = None  # the key of the deck's entry in StudyQueue.heap
+        new = state.review_counts == 0
+        with np.errstate(invalid='ignore'):
+            recently_wrong = now - state.last_wrong < RECENTLY_WRONG_SECONDS
+        urgent = ~new & (~state.is_mature | recently_wrong)
+        # Seconds from a mature card's last review until it is due again; NaN
+        # for the others (a card that matures during the pass isn't overdue)
+        self.intervals = np.full(len(state), np.nan)
+        mature = np.flatnonzero(~new & ~urgent)
+        if len(mature):
+            cards = [state.cards[i] for i in mature]
+            self.intervals[mature] = SessionIntervals(cards).expected(base_decay) * 60
+            last_reviews = np.array([_seconds(card.last_review) for card in cards])
+            mature = mature[last_reviews + self.intervals[mature] <= now]
+        due = np.flatnonzero(new | urgent)
+        self.heap = [key for key in (self._key(i, now) for i in np.concatenate([due, mature]))
+                     if key is not None and key[2] not in served]
+        heapq.heapify(self.heap)
+
+    def _key(self, i, now):
+        # (bucket, seconds, card id, index), or None if the card isn't due
+        state = self.state
+        card = state.cards[i]
+        if state.review_counts[i] == 0:
+            return (NEW, _seconds(card.date_added), card.id, int(i))
+        if not state.is_mature[i] or now - state.last_wrong[i] < RECENTLY_WRONG_SECONDS:
+            return (URGENT, _seconds(card.last_review), card.id, int(i))
+        due_at = _seconds(card.last_review) + self.intervals[i]
+        if due_at <= now:
+            return (OVERDUE, float(due_at), card.id, int(i))
+        return None
+
+    def push(self, card_id, now):
+        # A fresh entry for a card whose state changed; returns its key
+        i = self.state.index.get(card_id)
+        key = self._key(i, now) if i is not None else None
+        if key is not None:
+            heapq.heappush(self.heap, key)
+        return key
+
+    def head(self, served, now):
+        # The most urgent entry still due and not yet served, or None
+        heap = self.heap
+        while heap:
+            key = heap[0]
+            if key[2] in served:
+                heapq.heappop(heap)
+                continue
+            current = self._key(key[3], now)
+            if current is None:
+                heapq.heappop(heap)
+            elif current != key:
+                heapq.heapreplace(heap, current)
+            else:
+                return key
+        return None
+
+
+class StudyQueue:
+    def __init__(self, user_id, deck_ids=None):
+        self.user_id = user_id
+        self.deck_ids = deck_ids  # None: every deck
+        self.decks = {}  # deck id -> _DeckQueue
+        self.heap = []  # (head key, deck id), one live entry per deck
+        self.served = set()  # card ids served this pass
+        self.base_decay = None  # the user's decay when the pass started
+        self.passes = 0
+        self.lock = threading.Lock()
+
+    def _start_pass(self):
+        deck_ids = self.deck_ids
+        if deck_ids is None:
+            deck_ids = [deck_id for (deck_id,) in db.session.query(Deck.id).order_by(Deck.id)]
+        now = datetime.now().timestamp()
+        self.base_decay = db.session.query(User.global_decay).filter_by(id=self.user_id).scalar()
+        self.served = set()
+        self.decks = {}
+        self.heap = []
+        for deck_id in deck_ids:
+            queue = self.decks[deck_id] = _DeckQueue(deck_id, card_cache.deck_state(deck_id, self.user_id),
+                                                     self.served, now, self.base_decay)
+            queue.listed = queue.head(self.served, now)
+            if queue.listed is not None:
+                self.heap.append((queue.listed, deck_id))
+        heapq.heapify(self.heap)
+        self.passes += 1
+
+    def _list(self, queue, key):
+        # Make key the deck's entry in the heap; a replaced entry goes stale
+        if queue.listed is None or key < queue.listed:
+            queue.listed = key
+            heapq.heappush(self.heap, (key, queue.deck_id))
+
+    def _pop(self):
+        now = datetime.now().timestamp()
+        heap = self.heap
+        while heap:
+            key, deck_id = heap[0]
+            queue = self.decks[deck_id]
+            if key != queue.listed:
+                heapq.heappop(heap)  # replaced by a more urgent entry
+                continue
+            state = card_cache.deck_state(deck_id, self.user_id)
+            if state is not queue.state:
+                # The deck's cards changed since the pass started
+                queue = self.decks[deck_id] = _DeckQueue(deck_id, state, self.served, now, self.base_decay)
+            head = queue.listed = queue.head(self.served, now)
+            if head is None:
+                heapq.heappop(heap)
+                continue
+            if head != key:
+                heapq.heapreplace(heap, (head, deck_id))
+                continue
+
+            heapq.heappop(queue.heap)
+            self.served.add(head[2])
+            card = queue.state.cards[head[3]]
+            queue.listed = queue.head(self.served, now)
+            if queue.listed is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (queue.listed, deck_id))
+            return card, deck_id
+        return None
+
+    def record_review(self, card_id, deck_ids):
+        now = datetime.now().timestamp()
+        with self.lock:
+            if card_id in self.served:
+                return
+            for deck_id in deck_ids:
+                queue = self.decks.get(deck_id)
+                if queue is not None:
+                    key = queue.push(card_id, now)
+                    if key is not None:
+                        self._list(queue, key)
+
+    def next_card(self):
+        # (card state, id of a deck it was queued from), or None if nothing
+        # is due in any of the decks
+        with self.lock:
+            picked = self._pop() if self.passes else None
+            if picked is None:
+                self._start_pass()
+                picked = self._pop()
+            return picked
+
+    def size(self):
+        return len(self.heap), sum(len(queue.heap) for queue in self.decks.values())
+
+
+class StudyQueueCache:
+    def __init__(self, max_queues=MAX_QUEUES):
+        self.max_queues = max_queues
+        self._queues = OrderedDict()  # (user id, deck ids or None) -> StudyQueue
+        self._lock = threading.Lock()
+
+    def get(self, user_id, deck_ids=None):
+        key = (user_id, tuple(sorted(deck_ids)) if deck_ids is not None else None)
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = StudyQueue(user_id, key[1])
+                while len(self._queues) > self.max_queues:
+                    self._queues.popitem(last=False)
+            else:
+                self._queues.move_to_end(key)
+            return queue
+
+    def next_card(self, user_id, deck_ids=None):
+        return self.get(user_id, deck_ids).next_card()
+
+    def record_review(self, card_id, user_id, deck_ids):
+        # After the review is committed and card_cache has the new state
+        with self._lock:
+            queues = [queue for (queue_user, _), queue in self._queues.items() if queue_user == user_id]
+        for queue in queues:
+            queue.record_review(card_id, deck_ids)
+
+    def stats(self):
+        with self._lock:
+            queues = list(self._queues.values())
+        sizes = [queue.size() for queue in queues]
+        return {
+            'queues': len(queues),
+            'decks_queued': sum(decks for decks, _ in sizes),
+            'cards_queued': sum(cards for _, cards in sizes),
+        }
+
+
+study_queues = StudyQueueCache()
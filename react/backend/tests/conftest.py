@@ -0,0 +1,74 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app connects to DATABASE_URL when it is imported, so point it at a
+# scratch SQLite database before any test imports it
+_scratch = tempfile.mkdtemp(prefix='flashcards-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_scratch, 'test.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app():
+    import app as backend
+    return backend.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def deck(client, request):
+    # A deck of three cards, named after the test
+    name = request.node.name
+    client.post('/api/decks', json={'deck': name})
+    for i in range(3):
+        client.post(f'/api/cards/{name}', json={'front': f'front {i}', 'back': f'back {i}'})
+    return name
+
+
+@pytest.fixture
+def postgresql_url():
+    # TEST_DATABASE_URL names a scratch PostgreSQL database, whose tables
+    # the tests drop; without one (or a driver) they are skipped
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.exc import SQLAlchemyError
+
+    url = os.environ.get('TEST_DATABASE_URL')
+    if not url or not url.startswith('postgresql'):
+        pytest.skip('TEST_DATABASE_URL is not set to a PostgreSQL database')
+    try:
+        engine = create_engine(url)
+    except ImportError as e:
+        pytest.skip(f'No PostgreSQL driver: {e}')
+    try:
+        with engine.begin() as connection:
+            connection.execute(text('DROP SCHEMA public CASCADE'))
+            connection.execute(text('CREATE SCHEMA public'))
+    except SQLAlchemyError as e:
+        pytest.skip(f'PostgreSQL is not available: {e}')
+    finally:
+        engine.dispose()
+    return url
+
+
+@pytest.fixture
+def scratch_app():
+    # A second app on another database, sharing the models
+    from flask import Flask
+    from flask_migrate import Migrate
+    from app import MIGRATIONS_DIR
+    from models import db
+
+    def make(url):
+        scratch = Flask(__name__)
+        scratch.config['SQLALCHEMY_DATABASE_URI'] = url
+        db.init_app(scratch)
+        Migrate(scratch, db, directory=MIGRATIONS_DIR)
+        return scratch
+    return make
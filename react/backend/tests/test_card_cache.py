@@ -0,0 +1,60 @@
+import app as backend
+from card_cache import card_cache, load_card_states
+from models import User
+
+
+def _setup(app, client, deck):
+    # The deck's first card, with the deck and the reviewer's state cached
+    card_id = client.get(f'/api/cards/{deck}').get_json()[0]['id']
+    client.post(f'/api/review/{deck}/{deck}-user', json={'id': card_id, 'rating': 3})
+    with app.app_context():
+        user_id = User.query.filter_by(username=f'{deck}-user').first().id
+        card_cache.deck_state(card_cache.deck_id(deck), user_id)
+    return card_id, user_id
+
+
+def _cached_matches_database(app, card_id, user_id):
+    with app.app_context():
+        cached = card_cache._get(('card', user_id, card_id))
+        loaded = load_card_states([card_id], user_id=user_id)[card_id]
+        return (cached.outcome_counts(), list(cached.reviews), cached.mature_streak, cached.is_mature) == \
+               (loaded.outcome_counts(), list(loaded.reviews), loaded.mature_streak, loaded.is_mature)
+
+
+def test_review_loaded_by_a_concurrent_miss_is_not_applied_twice(app, client, deck, monkeypatch):
+    card_id, user_id = _setup(app, client, deck)
+    record_review = card_cache.record_review
+
+    def reload_then_record(card_id, user_id, *args):
+        # Another request misses the cache after the commit and loads the
+        # card's row, review included, before the write-through runs
+        card_cache.invalidate_card(card_id)
+        card_cache.card_state(card_id, user_id)
+        record_review(card_id, user_id, *args)
+    monkeypatch.setattr(backend.card_cache, 'record_review', reload_then_record)
+    client.post(f'/api/review/{deck}/{deck}-user', json={'id': card_id, 'rating': 9})
+    monkeypatch.undo()
+
+    assert _cached_matches_database(app, card_id, user_id)
+    with app.app_context():
+        assert card_cache.card_state(card_id, user_id).outcome_counts() == (1, 1)
+
+
+def test_write_through_matches_database(app, client, deck):
+    card_id, user_id = _setup(app, client, deck)
+    for rating in (8, 9, 10, 8):
+        client.post(f'/api/review/{deck}/{deck}-user', json={'id': card_id, 'rating': rating})
+    assert _cached_matches_database(app, card_id, user_id)
+
+
+def test_content_edit_keeps_cached_states(app, client, deck):
+    card_id, user_id = _setup(app, client, deck)
+    with app.app_context():
+        before = card_cache._get(('card', user_id, card_id))
+        assert before is not None
+    client.put(f'/api/cards/{deck}/{card_id}', json={'front': 'edited'})
+    with app.app_context():
+        assert card_cache._get(('card', user_id, card_id)) is before
+        deck_id = card_cache.deck_id(deck)
+        # The edit's own version bump isn't taken for another worker's write
+        assert card_cache._get(('deck', deck_id)).version == backend.Deck.query.get(deck_id).version
@@ -0,0 +1,23 @@
+from datetime import datetime, timedelta
+
+from compaction import compact_reviews
+from models import db, Review
+
+
+def test_database_etag_changes_after_compaction(app, client, deck):
+    card_id = client.get(f'/api/cards/{deck}').get_json()[0]['id']
+    with app.app_context():
+        long_ago = datetime.now() - timedelta(days=800)
+        db.session.add_all(Review(card_id=card_id, rating=8, timestamp=long_ago + timedelta(days=i))
+                           for i in range(8))
+        db.session.commit()
+
+    first = client.get('/api/diagnostic/db')
+    etag = first.headers['ETag']
+    assert client.get('/api/diagnostic/db', headers={'If-None-Match': etag}).status_code == 304
+
+    with app.app_context():
+        assert compact_reviews() > 0
+    second = client.get('/api/diagnostic/db', headers={'If-None-Match': etag})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != etag
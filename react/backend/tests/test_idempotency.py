@@ -0,0 +1,49 @@
+import app as backend
+from models import db, Review, User
+
+
+def _review(client, deck, card_id, key):
+    return client.post(f'/api/review/{deck}/{deck}-user', headers={'Idempotency-Key': key},
+                       json={'id': card_id, 'rating': 8})
+
+
+def _reviews(app, card_id):
+    with app.app_context():
+        return Review.query.filter_by(card_id=card_id).count()
+
+
+def test_failure_after_commit_is_replayed(app, client, deck, monkeypatch):
+    # The review is recorded before the next card fails, so a retry gets the
+    # stored error instead of a 409 or a second review
+    card_id = client.get(f'/api/cards/{deck}').get_json()[0]['id']
+
+    def fail(*args):
+        raise RuntimeError('scheduler exploded')
+    monkeypatch.setattr(backend.study_queues, 'record_review', fail)
+    first = _review(client, deck, card_id, 'after-commit')
+    monkeypatch.undo()
+    retry = _review(client, deck, card_id, 'after-commit')
+
+    assert first.status_code == retry.status_code == 500
+    assert retry.headers.get('Idempotent-Replayed') == 'true'
+    assert retry.get_json() == first.get_json()
+    assert _reviews(app, card_id) == 1
+
+
+def test_other_integrity_errors_are_not_duplicates(app, client, deck, monkeypatch):
+    # A constraint other than the key's fails the request without taking the
+    # key, so the retry goes through
+    card_id = client.get(f'/api/cards/{deck}').get_json()[0]['id']
+    reserve_key = backend.reserve_key
+
+    def reserve_and_clash(user_id, key, fingerprint):
+        reserve_key(user_id, key, fingerprint)
+        db.session.add(User(username='default'))  # username is unique
+    monkeypatch.setattr(backend, 'reserve_key', reserve_and_clash)
+    first = _review(client, deck, card_id, 'integrity')
+    monkeypatch.undo()
+    retry = _review(client, deck, card_id, 'integrity')
+
+    assert first.status_code == 500
+    assert retry.status_code == 200 and retry.headers.get('Idempotent-Replayed') is None
+    assert _reviews(app, card_id) == 1
@@ -0,0 +1,87 @@
+import json
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from alembic.autogenerate import compare_metadata
+from alembic.runtime.migration import MigrationContext
+from flask_migrate import upgrade
+from sqlalchemy import text
+
+from app import MIGRATIONS_DIR
+from models import db
+
+BASELINE = '3b1f0c2d9a01'
+
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def legacy_app(request, tmp_path, scratch_app):
+    # A database as the app created it before migrations existed
+    if request.param == 'sqlite':
+        legacy = scratch_app(f"sqlite:///{tmp_path / 'legacy.db'}")
+    else:
+        legacy = scratch_app(request.getfixturevalue('postgresql_url'))
+    with legacy.app_context():
+        upgrade(directory=MIGRATIONS_DIR, revision=BASELINE)
+    return legacy
+
+
+def _key(session_id):
+    # Native UUIDs on PostgreSQL come back as uuid.UUID
+    return str(session_id) if session_id is not None else None
+
+
+def _seed_legacy(sessions):
+    now = datetime.now()
+    statements = [
+        """INSERT INTO "user" (id, username, recall_history) VALUES (1, 'ann', '[[5.0, 1]]'), (2, 'bob', '[]')""",
+        "INSERT INTO deck (id, name, date_created) VALUES (1, 'd', :now)",
+        "INSERT INTO card (id, front, back, date_added, mature_streak, is_mature) VALUES "
+        "(1, 'f1', 'b1', :now, 0, false), (2, 'f2', 'b2', :now, 0, false)",
+        "INSERT INTO deck_cards (deck_id, card_id) VALUES (1, 1), (1, 2)",
+        "INSERT INTO session (id, name, user_id, deck_id, start_time) VALUES "
+        "(:ann, 'a', 1, 1, :now), (:bob, 'b', 2, 1, :now)",
+        # bob's isn't a session id, which a UUID column can't hold
+        """UPDATE "user" SET active_session_id = :ann WHERE id = 1""",
+        """UPDATE "user" SET active_session_id = 'none' WHERE id = 2""",
+    ]
+    for statement in statements:
+        db.session.execute(text(statement), {'now': now, **sessions})
+    reviews = [(1, sessions['ann'], 9), (1, sessions['ann'], 8), (2, sessions['ann'], 3),
+               (1, sessions['bob'], 2), (2, None, 10)]
+    for i, (card_id, session_id, rating) in enumerate(reviews):
+        db.session.execute(text("INSERT INTO review (card_id, session_id, timestamp, rating) "
+                                "VALUES (:card_id, :session_id, :timestamp, :rating)"),
+                           {'card_id': card_id, 'session_id': session_id, 'rating': rating,
+                            'timestamp': now - timedelta(hours=len(reviews) - i)})
+    db.session.commit()
+
+
+def test_upgrade_from_baseline(legacy_app):
+    sessions = {'ann': str(uuid.uuid4()), 'bob': str(uuid.uuid4())}
+    with legacy_app.app_context():
+        _seed_legacy(sessions)
+        upgrade(directory=MIGRATIONS_DIR)
+
+        with db.engine.connect() as connection:
+            assert compare_metadata(MigrationContext.configure(connection), db.metadata) == []
+
+        # The backfill attributed the reviews and rebuilt the derived tables
+        attributed = db.session.execute(text("SELECT session_id, user_id FROM review")).all()
+        owners = {sessions['ann']: 1, sessions['bob']: 2, None: None}
+        assert all(user_id == owners[_key(session_id)] for session_id, user_id in attributed)
+        states = {(user_id, card_id): streak for user_id, card_id, streak in db.session.execute(
+            text("SELECT user_id, card_id, mature_streak FROM user_card_state"))}
+        assert states == {(1, 1): 2, (1, 2): 0, (2, 1): 0}
+        assert db.session.scalar(text("SELECT sum(review_count) FROM daily_stats WHERE deck_id = 0")) == 5
+        assert db.session.scalar(text("SELECT sum(review_count) FROM session_stats")) == 4
+        history = db.session.scalar(text('SELECT recall_history FROM "user" WHERE id = 1'))
+        assert (json.loads(history) if isinstance(history, str) else history) == [[5.0, 1]]
+        active = {user_id: _key(session_id) for user_id, session_id in
+                  db.session.execute(text('SELECT id, active_session_id FROM "user"'))}
+        postgresql = db.engine.dialect.name == 'postgresql'
+        assert active == {1: sessions['ann'], 2: None if postgresql else 'none'}
+
+        # Upgrading again changes nothing
+        upgrade(directory=MIGRATIONS_DIR)
+        assert db.session.scalar(text("SELECT count(*) FROM user_card_state")) == 3
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from bulk import copy_cards
+from bulk_load import import_cards, import_reviews
+from models import db, Card, DailyStats, Deck, Review, Session, SessionStats, User, deck_cards
+from rollups import ALL_DECKS
+
+
+def test_copy_import(postgresql_url, scratch_app):
+    # COPY must tell NULL from empty strings and keep quotes, commas and
+    # newlines in text
+    app = scratch_app(postgresql_url)
+    with app.app_context():
+        db.create_all()
+        deck = Deck(name='d')
+        user = User(username='ann')
+        db.session.add_all([deck, user])
+        db.session.commit()
+        session = Session(name='s', user_id=user.id, deck_id=deck.id)
+        db.session.add(session)
+        db.session.commit()
+
+        front = 'He said "hi", then\nleft'
+        card_ids = import_cards(deck.id, [{'front': front, 'back': 'b'},
+                                          {'front': 'f', 'back': 'b', 'type': 'Cloze'}])
+        assert [db.session.get(Card, card_id).front for card_id in card_ids] == [front, 'f']
+
+        now = datetime.now()
+        count = import_reviews([
+            {'card_id': card_ids[0], 'user': 'ann', 'rating': 9, 'timestamp': now - timedelta(days=1),
+             'session_id': session.id},
+            {'card_id': card_ids[1], 'user': 'ann', 'rating': 3, 'timestamp': now},
+        ])
+        assert count == 2
+        sessions = dict(db.session.execute(select(Review.card_id, Review.session_id)).all())
+        assert sessions == {card_ids[0]: session.id, card_ids[1]: None}
+        assert db.session.scalar(select(func.sum(DailyStats.review_count))
+                                 .where(DailyStats.deck_id == ALL_DECKS)) == 2
+        assert db.session.get(SessionStats, session.id).review_count == 1
+
+
+def test_copy_cards_links_returned_ids(postgresql_url, scratch_app):
+    app = scratch_app(postgresql_url)
+    with app.app_context():
+        db.create_all()
+        source, target = Deck(name='source'), Deck(name='target')
+        db.session.add_all([source, target])
+        db.session.commit()
+        card_ids = import_cards(source.id, [{'front': f'f{i}', 'back': 'b'} for i in range(3)])
+
+        assert copy_cards(source.id, target.id, select(deck_cards.c.card_id)
+                          .where(deck_cards.c.deck_id == source.id)) == 3
+        db.session.commit()
+        copies = db.session.scalars(select(Card.cloned_from).join(deck_cards, deck_cards.c.card_id == Card.id)
+                                    .where(deck_cards.c.deck_id == target.id))
+        assert sorted(copies) == card_ids
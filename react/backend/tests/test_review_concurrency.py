@@ -0,0 +1,54 @@
+import threading
+import time
+import uuid
+from datetime import date
+
+from models import db, Card, Deck, DailyStats, RecallEntry, Review, SessionStats, User, UserCardState
+
+THREADS = 8
+REVIEWS_PER_THREAD = 25
+ATTEMPTS = 20
+
+
+def test_concurrent_reviews_lose_no_updates(app, client, deck):
+    # Every review of one card is a relative update, so concurrent reviews
+    # must all be counted in the card, the user's card state, the recall
+    # history and the rollups. SQLite can fail a write with "database is
+    # locked" under contention, so each review is retried with its
+    # idempotency key like a client would; exactly one attempt may count.
+    user = f'{deck}-user'
+    session = client.post('/api/sessions', json={'deck': deck, 'user': user}).get_json()['session']
+    card_id = client.get(f'/api/cards/{deck}').get_json()[0]['id']
+
+    failures = []
+
+    def review():
+        thread_client = app.test_client()
+        for _ in range(REVIEWS_PER_THREAD):
+            headers = {'Idempotency-Key': str(uuid.uuid4())}
+            for _ in range(ATTEMPTS):
+                response = thread_client.post(f'/api/review/{deck}/{user}', headers=headers,
+                                              json={'id': card_id, 'rating': 9})
+                if response.status_code not in (409, 500):
+                    break
+                time.sleep(0.05)
+            if response.status_code != 200 or not response.get_json().get('success'):
+                failures.append((response.status_code, response.get_json()))
+
+    threads = [threading.Thread(target=review) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    expected = THREADS * REVIEWS_PER_THREAD
+    assert failures == []
+    with app.app_context():
+        user_id = db.session.query(User.id).filter_by(username=user).scalar()
+        deck_id = db.session.query(Deck.id).filter_by(name=deck).scalar()
+        assert Review.query.filter_by(card_id=card_id).count() == expected
+        assert db.session.get(Card, card_id).mature_streak == expected
+        assert db.session.get(UserCardState, (user_id, card_id)).mature_streak == expected
+        assert RecallEntry.query.filter_by(user_id=user_id).count() == expected
+        assert db.session.get(SessionStats, session['id']).review_count == expected
+        assert db.session.get(DailyStats, (user_id, deck_id, date.today())).review_count == expected
@@ -0,0 +1,113 @@
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from card_cache import CardState, _Obs
+from scheduling import DeckState, Scheduler
+
+N_SAMPLES = 10000
+TOLERANCE = 0.025  # absolute, per bucket frequency
+
+
+def _card(card_id, reviews=0, is_mature=False, wrong_hours_ago=None):
+    now = datetime.now()
+    recent = [_Obs(now - timedelta(days=reviews - i), 8) for i in range(reviews)]
+    last_wrong = now - timedelta(hours=wrong_hours_ago) if wrong_hours_ago is not None else None
+    return CardState(card_id, reviews, 0, recent[-5:], 4 if is_mature else 0, is_mature, last_wrong,
+                     now - timedelta(weeks=4))
+
+
+def _deck():
+    # 8 new, 12 urgent (8 learning, 4 mature but missed yesterday) and 20
+    # mature cards, 4 of them missed long enough ago not to count
+    rng = random.Random(0)
+    cards = ([_card(i) for i in range(8)]
+             + [_card(i, reviews=rng.randint(1, 5)) for i in range(8, 16)]
+             + [_card(i, reviews=6, is_mature=True, wrong_hours_ago=24) for i in range(16, 20)]
+             + [_card(i, reviews=6, is_mature=True) for i in range(20, 36)]
+             + [_card(i, reviews=6, is_mature=True, wrong_hours_ago=72) for i in range(36, 40)])
+    rng.shuffle(cards)
+    return cards
+
+
+def _bucket(card):
+    if card.review_count() == 0:
+        return 'new'
+    if not card.is_mature or (card.last_wrong and datetime.now() - card.last_wrong < timedelta(hours=48)):
+        return 'urgent'
+    return 'mature'
+
+
+def _legacy_select(cards, review_counts, backlog_limit, max_reviews_per_card):
+    # The selection Scheduler used before it was vectorized: shuffle each
+    # bucket, then choose uniformly from the front of each
+    buckets = {'urgent': [], 'new': [], 'mature': []}
+    for card in cards:
+        if review_counts[card.id] < max_reviews_per_card:
+            buckets[_bucket(card)].append(card)
+    for bucket in buckets.values():
+        random.shuffle(bucket)
+    to_study = (buckets['urgent'][:backlog_limit] + buckets['new'][:3] + buckets['mature'][:5])[:backlog_limit]
+    if to_study:
+        return random.choice(to_study)
+    remaining = [card for card in cards if review_counts[card.id] < max_reviews_per_card]
+    return random.choice(remaining or cards)
+
+
+def _frequencies(picks):
+    counts = Counter(_bucket(card) for card in picks)
+    return {bucket: counts[bucket] / len(picks) for bucket in ('urgent', 'new', 'mature')}
+
+
+@pytest.mark.parametrize('backlog_limit', [50, 14, 10])
+@pytest.mark.parametrize('exhausted', [(), ('urgent',), ('urgent', 'new')])
+def test_bucket_frequencies_match_legacy_selection(backlog_limit, exhausted):
+    # exhausted: buckets whose cards have all been studied enough this session
+    random.seed(1)
+    cards = _deck()
+    deck = DeckState(cards)
+    review_counts = {card.id: 2 if _bucket(card) in exhausted else 0 for card in cards}
+
+    picks = []
+    for _ in range(N_SAMPLES):
+        scheduler = Scheduler(None, deck)
+        scheduler.card_review_counts[:] = [review_counts[card.id] for card in scheduler.cards]
+        picks.append(scheduler.select_next_card(backlog_limit=backlog_limit))
+    legacy = [_legacy_select(cards, review_counts, backlog_limit, 2) for _ in range(N_SAMPLES)]
+
+    vectorized, expected = _frequencies(picks), _frequencies(legacy)
+    for bucket in expected:
+        assert vectorized[bucket] == pytest.approx(expected[bucket], abs=TOLERANCE), bucket
+    # Any card of a bucket can come up, not just a fixed few
+    per_card = Counter(card.id for card in picks if _bucket(card) == 'mature')
+    if per_card:
+        assert len(per_card) == sum(1 for card in cards if _bucket(card) == 'mature')
+
+
+def test_session_respects_review_limit():
+    random.seed(2)
+    scheduler = Scheduler(None, _deck())
+    picks = Counter(scheduler.select_next_card(max_reviews_per_card=2).id for _ in range(80))
+    assert max(picks.values()) == 2
+    assert len(picks) == 40
+
+
+def test_large_deck_smoke():
+    rng = np.random.default_rng(3)
+    n = 100000
+    kinds = rng.choice(['new', 'learning', 'mature', 'missed'], size=n, p=[0.1, 0.2, 0.65, 0.05])
+    cards = [_card(i, reviews=0 if kind == 'new' else 6, is_mature=kind in ('mature', 'missed'),
+                   wrong_hours_ago=12 if kind == 'missed' else None) for i, kind in enumerate(kinds)]
+    scheduler = Scheduler(None, DeckState(cards))
+
+    start = time.perf_counter()
+    picks = [scheduler.select_next_card() for _ in range(200)]
+    elapsed = time.perf_counter() - start
+    assert elapsed < 2.0, f"200 selections over {n} cards took {elapsed:.1f}s"
+    assert len({card.id for card in picks}) > 100
+    # A backlog of more than backlog_limit urgent cards crowds out the rest
+    assert all(_bucket(card) == 'urgent' for card in picks)
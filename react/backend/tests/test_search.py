@@ -0,0 +1,61 @@
+import random
+import time
+
+import pytest
+
+N_CARDS = 20000
+WORDS = ['apple', 'banana', 'cherry', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet']
+TIME_LIMIT = 2.0  # seconds; a MATCH re-run per card takes tens of seconds at this size
+
+
+@pytest.fixture(scope='module')
+def big_deck(app):
+    # A deck of N_CARDS random cards, and each card's words by id
+    from models import db, Deck
+    from bulk_load import import_cards
+
+    rng = random.Random(0)
+    rows = [{'front': ' '.join(rng.choice(WORDS) + str(rng.randrange(1000)) for _ in range(4)),
+             'back': ' '.join(rng.choice(WORDS) for _ in range(3))} for _ in range(N_CARDS)]
+    name = 'test_search_big_deck'
+    with app.app_context():
+        deck = Deck(name=name)
+        db.session.add(deck)
+        db.session.commit()
+        card_ids = import_cards(deck.id, rows)
+        db.session.remove()
+    return name, {card_id: (row['front'] + ' ' + row['back']).split() for card_id, row in zip(card_ids, rows)}
+
+
+def _expected(words_by_id, query):
+    # Cards with a word starting with query, by brute force
+    return {card_id for card_id, words in words_by_id.items() if any(word.startswith(query) for word in words)}
+
+
+@pytest.mark.parametrize('query', ['a', 'ap', 'apple1', 'apple123', 'zulu'])
+def test_search_large_deck(client, big_deck, query):
+    name, words_by_id = big_deck
+    start = time.perf_counter()
+    first = client.get(f'/api/search/{name}', query_string={'q': query, 'per_page': 100}).get_json()
+    elapsed = time.perf_counter() - start
+    assert elapsed < TIME_LIMIT, f"searching {query!r} took {elapsed:.1f}s"
+
+    expected = _expected(words_by_id, query)
+    assert first['total'] == len(expected)
+    assert {result['id'] for result in first['results']} <= expected
+    assert len(first['results']) == min(100, len(expected))
+
+
+def test_bulk_query_filter_large_deck(client, big_deck):
+    from bulk import select_card_ids
+    from models import db, Deck
+
+    name, words_by_id = big_deck
+    with client.application.app_context():
+        deck_obj = Deck.query.filter_by(name=name).first()
+        start = time.perf_counter()
+        selected = set(db.session.scalars(select_card_ids(deck_obj.id, filters={'query': 'ap'})))
+        elapsed = time.perf_counter() - start
+        db.session.remove()
+    assert elapsed < TIME_LIMIT
+    assert selected == _expected(words_by_id, 'ap')
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import session_intervals
+from card_cache import CardState, _Obs
+from scheduling import sample_next_review
+from session_intervals import QUANTILES, SessionIntervals
+
+N_SAMPLES = 200000
+TOLERANCE = 0.03  # relative, on top of a minute for int() truncation
+
+
+def _card(card_id, ratings, hours_apart=6, mature_streak=0, weeks_old=2):
+    now = datetime.now()
+    recent = [_Obs(now - timedelta(hours=hours_apart * (len(ratings) - i)), rating)
+              for i, rating in enumerate(ratings)]
+    successes = sum(rating >= 7 for rating in ratings)
+    return CardState(card_id, successes, len(ratings) - successes, recent[-5:], mature_streak,
+                     mature_streak >= 3, None, now - timedelta(weeks=weeks_old))
+
+
+CARDS = [
+    _card(1, []),
+    _card(2, [8]),
+    _card(3, [9, 3, 8, 9, 10]),
+    _card(4, [8, 9, 4, 10, 9], hours_apart=30),
+    _card(5, [9, 9, 10, 9, 9], mature_streak=6, weeks_old=10),
+    _card(6, [1, 2, 8, 0, 3], hours_apart=1),
+    _card(7, [10, 10, 9, 10, 10], hours_apart=48, mature_streak=4, weeks_old=1),
+]
+
+
+@pytest.mark.parametrize('base_decay', [0.01, 0.05, 0.3])
+def test_precomputed_percentiles_match_sampler(monkeypatch, base_decay):
+    # The precomputed interval at each quantile is the Monte Carlo sampler's
+    # percentile of its interval samples
+    intervals = SessionIntervals(CARDS)
+    user = SimpleNamespace(global_decay=base_decay)
+    np.random.seed(0)
+    for card in CARDS:
+        _, samples = sample_next_review(card, user, n_samples=N_SAMPLES)
+        for quantile in QUANTILES[::2]:
+            monkeypatch.setattr(session_intervals.random, 'uniform', lambda low, high: quantile)
+            precomputed = intervals.sample(card.id, base_decay)
+            expected = np.percentile(samples, quantile)
+            assert precomputed == pytest.approx(expected, rel=TOLERANCE, abs=1), (card.id, quantile)
+
+
+def test_update_tracks_new_reviews(monkeypatch):
+    card = _card(8, [9, 4, 8])
+    intervals = SessionIntervals([card])
+    card.apply_review(10, datetime.now())
+    intervals.update(card)
+
+    user = SimpleNamespace(global_decay=0.05)
+    np.random.seed(1)
+    _, samples = sample_next_review(card, user, n_samples=N_SAMPLES)
+    monkeypatch.setattr(session_intervals.random, 'uniform', lambda low, high: 50.0)
+    assert intervals.sample(card.id, 0.05) == pytest.approx(np.percentile(samples, 50), rel=TOLERANCE, abs=1)
@@ -0,0 +1,54 @@
+import heapq
+from datetime import datetime, timedelta
+
+from card_cache import CardState, _Obs
+from scheduling import DeckState
+from study_queue import NEW, OVERDUE, URGENT, _DeckQueue
+
+BASE_DECAY = 0.03
+
+
+def _card(card_id, ratings=(), last_review_ago=timedelta(days=1), wrong_ago=None, weeks_old=2):
+    now = datetime.now()
+    last = now - last_review_ago
+    recent = [_Obs(last - timedelta(days=len(ratings) - 1 - i), rating) for i, rating in enumerate(ratings)]
+    successes = sum(rating >= 7 for rating in ratings)
+    streak = len(ratings) - max((i + 1 for i, rating in enumerate(ratings) if rating < 7), default=0)
+    return CardState(card_id, successes, len(ratings) - successes, recent[-5:], streak, streak >= 4,
+                     now - wrong_ago if wrong_ago else None, now - timedelta(weeks=weeks_old))
+
+
+def _drain(queue, now):
+    keys = []
+    while queue.head(set(), now) is not None:
+        keys.append(heapq.heappop(queue.heap))
+    return [(bucket, card_id) for bucket, _, card_id, _ in keys]
+
+
+def test_overdue_mature_cards_are_due():
+    cards = [
+        _card(1),  # new
+        _card(2, [8, 3, 8]),  # learning
+        _card(3, [9, 9, 9, 9, 9], last_review_ago=timedelta(hours=5), wrong_ago=timedelta(hours=5)),  # missed
+        _card(4, [9, 9, 9, 9, 9], last_review_ago=timedelta(days=60)),
+        _card(5, [9, 9, 9, 9, 9], last_review_ago=timedelta(days=30)),
+        _card(6, [9, 9, 9, 9, 9], last_review_ago=timedelta(minutes=1)),
+    ]
+    now = datetime.now().timestamp()
+    queue = _DeckQueue(1, DeckState(cards), set(), now, BASE_DECAY)
+    # Urgent, then overdue (most overdue first), then new; the mature card
+    # reviewed a minute ago isn't due yet
+    assert _drain(queue, now) == [(URGENT, 2), (URGENT, 3), (OVERDUE, 4), (OVERDUE, 5), (NEW, 1)]
+
+
+def test_reviewing_an_overdue_card_makes_it_not_due():
+    card = _card(1, [9, 9, 9, 9, 9], last_review_ago=timedelta(days=60))
+    state = DeckState([card])
+    now = datetime.now().timestamp()
+    queue = _DeckQueue(1, state, set(), now, BASE_DECAY)
+    assert queue.head(set(), now)[0] == OVERDUE
+
+    card.apply_review(10, datetime.now())
+    state.update(card)
+    assert queue.push(card.id, now) is None
+    assert queue.head(set(), now) is None